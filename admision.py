@@ -0,0 +1,105 @@
+import os
+import threading
+from contextlib import contextmanager
+
+from limites import CubosPorClave
+
+# Control de admisión delante del dispatcher, para que un chat desbocado o una
+# tormenta de reintentos no tumben el bot para los demás vendedores:
+# - cubetas de tokens por chat para los mensajes, las cotizaciones (cada "si" es un
+#   PDF y una subida) y las altas al catálogo (productos, tamaños y cobros nuevos),
+# - descarte de mensajes con una respuesta de "ocupado" cuando las colas de ingesta o
+#   de envíos pasan de un umbral (antes de que la ingesta llegue a su máximo y
+#   responda 503, que Telegram reintenta),
+# - un máximo de PDFs renderizándose a la vez en el proceso.
+# Los avisos al chat salen como mucho una vez cada ADMISION_AVISO_SEGUNDOS.
+
+ADMISION_POR_CHAT = float(os.getenv("ADMISION_POR_CHAT", "1"))            # mensajes por segundo
+ADMISION_RAFAGA = int(os.getenv("ADMISION_RAFAGA", "10"))
+ADMISION_COTIZACIONES_POR_MINUTO = float(os.getenv("ADMISION_COTIZACIONES_POR_MINUTO", "6"))
+ADMISION_RAFAGA_COTIZACIONES = int(os.getenv("ADMISION_RAFAGA_COTIZACIONES", "3"))
+ADMISION_ALTAS_POR_HORA = float(os.getenv("ADMISION_ALTAS_POR_HORA", "20"))
+ADMISION_RAFAGA_ALTAS = int(os.getenv("ADMISION_RAFAGA_ALTAS", "5"))
+ADMISION_UMBRAL_INGESTA = int(os.getenv("ADMISION_UMBRAL_INGESTA", "400"))
+ADMISION_UMBRAL_ENVIOS = int(os.getenv("ADMISION_UMBRAL_ENVIOS", "1000"))
+ADMISION_AVISO_SEGUNDOS = float(os.getenv("ADMISION_AVISO_SEGUNDOS", "30"))
+PDF_RENDERS_MAX = int(os.getenv("PDF_RENDERS_MAX", os.getenv("PDF_WORKERS", "2")))
+PDF_RENDERS_ESPERA = float(os.getenv("PDF_RENDERS_ESPERA", "20"))           # segundos
+
+ADMITIDO = "admitido"
+LIMITADO = "limitado"
+OCUPADO = "ocupado"
+
+AVISO_LIMITADO = "Estás enviando mensajes muy rápido. Espera unos segundos y envía tu respuesta de nuevo."
+AVISO_OCUPADO = "Estamos atendiendo muchos mensajes en este momento. Intenta de nuevo en unos segundos."
+
+
+class Ocupado(Exception):
+    """
+    No hubo lugar para renderizar un PDF dentro del tiempo de espera.
+    """
+
+
+class Admision:
+    def __init__(self, por_chat=ADMISION_POR_CHAT, rafaga=ADMISION_RAFAGA,
+                 cotizaciones_por_minuto=ADMISION_COTIZACIONES_POR_MINUTO,
+                 rafaga_cotizaciones=ADMISION_RAFAGA_COTIZACIONES,
+                 altas_por_hora=ADMISION_ALTAS_POR_HORA, rafaga_altas=ADMISION_RAFAGA_ALTAS,
+                 umbral_ingesta=ADMISION_UMBRAL_INGESTA, umbral_envios=ADMISION_UMBRAL_ENVIOS,
+                 aviso_segundos=ADMISION_AVISO_SEGUNDOS, renders_max=PDF_RENDERS_MAX,
+                 renders_espera=PDF_RENDERS_ESPERA):
+        self.umbral_ingesta = umbral_ingesta
+        self.umbral_envios = umbral_envios
+        self.renders_espera = renders_espera
+        self._mensajes = CubosPorClave(por_chat, rafaga)
+        self._cotizaciones = CubosPorClave(cotizaciones_por_minuto / 60, rafaga_cotizaciones)
+        self._altas = CubosPorClave(altas_por_hora / 3600, rafaga_altas)
+        self._avisos = CubosPorClave(1 / aviso_segundos, 1) if aviso_segundos > 0 else None
+        self._renders = threading.BoundedSemaphore(max(renders_max, 1))
+
+    def admitir(self, chat_id, pendientes_ingesta, pendientes_envios):
+        """
+        ADMITIDO, LIMITADO (el chat pasó su cuota) u OCUPADO (colas sobre el umbral).
+        Un mensaje descartado por carga no gasta tokens del chat.
+        """
+        if pendientes_ingesta >= self.umbral_ingesta or pendientes_envios >= self.umbral_envios:
+            return OCUPADO
+        if chat_id is not None and self._mensajes.intentar(chat_id):
+            return LIMITADO
+        return ADMITIDO
+
+    def cotizacion(self, chat_id):
+        """
+        True si el chat todavía puede pedir una cotización (un PDF).
+        """
+        return not self._cotizaciones.intentar(chat_id)
+
+    def devolver_cotizacion(self, chat_id):
+        """
+        Regresa al chat la cotización que se le contó y no se pudo encolar.
+        """
+        self._cotizaciones.devolver(chat_id)
+
+    def alta(self, chat_id):
+        """
+        True si el chat todavía puede agregar filas al catálogo.
+        """
+        return not self._altas.intentar(chat_id)
+
+    def avisar(self, chat_id):
+        """
+        True si corresponde responderle al chat que se descartó su mensaje.
+        """
+        return self._avisos is None or not self._avisos.intentar(chat_id)
+
+    @contextmanager
+    def render(self):
+        """
+        Reserva un lugar para renderizar un PDF; levanta Ocupado si no hay en renders_espera.
+        """
+        if not self._renders.acquire(timeout=self.renders_espera):
+            raise Ocupado("Demasiados PDFs en generación")
+        try:
+            yield
+        finally:
+            self._renders.release()
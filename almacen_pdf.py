@@ -0,0 +1,39 @@
+import os
+import hashlib
+import tempfile
+
+# Archivo permanente de PDFs direccionado por contenido: cada PDF se guarda una vez
+# con el sha256 de sus bytes como nombre, repartido en dos niveles de subcarpetas
+# (ab/cd/abcd....pdf) para que ningún directorio crezca sin límite. A diferencia de
+# cache_pdf.py aquí no se expulsa nada; la tabla quotes guarda el hash de cada cotización.
+
+
+class AlmacenPDF:
+    def __init__(self, directorio):
+        self.directorio = directorio
+
+    def ruta(self, digest):
+        return os.path.join(self.directorio, digest[:2], digest[2:4], f"{digest}.pdf")
+
+    def guardar(self, datos):
+        """
+        Guarda el PDF (si no estaba ya) y devuelve su hash.
+        """
+        digest = hashlib.sha256(datos).hexdigest()
+        ruta = self.ruta(digest)
+        if os.path.exists(ruta):
+            return digest
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        # Escritura atómica: un lector nunca ve un PDF a medias
+        fd, temporal = tempfile.mkstemp(dir=os.path.dirname(ruta), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(datos)
+        os.replace(temporal, ruta)
+        return digest
+
+    def leer(self, digest):
+        try:
+            with open(self.ruta(digest), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
@@ -1,765 +1,1175 @@
+import io
 import os
+import json
+import hmac
+import hashlib
 import re
-import math
 import time
 import logging
-from flask import Flask, request, send_from_directory
+import threading
+import queue
+from flask import Blueprint, Flask, Response, request, send_file, jsonify
 from dotenv import load_dotenv
-from telegram import Bot, Update
-from telegram.ext import Dispatcher, MessageHandler, Filters
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.pdfgen import canvas
-from reportlab.lib.utils import ImageReader
-import sqlite3
-from reportlab.lib import colors
-from reportlab.lib.colors import HexColor
+import admision
+import db
+import descargas
+import envios
+import historial
+import registro
+import lote
+import matriz_precios
+import metricas
+import perfiles
+from almacen_pdf import AlmacenPDF
+from ingesta import Ingesta, DUPLICADO, LLENO
+from sesiones import crear_almacen
+from pasos import MaquinaPasos, numero, si_no
+from precios import DIMENSION_MAXIMA, DIMENSION_MINIMA, cotizar, dimension_aceptable, parse_dimension
+from cache_pdf import CachePDF, clave_canonica
+from cotizacion_pdf import PLANTILLA_VERSION, cargar_plantilla, generar_pdf, nombre_pdf
 
 load_dotenv()
-app = Flask(__name__)
 
-# Configuración de logging
-LOG_FILE = "/var/www/db_serigraph/logs/serigraph.log"
-logging.basicConfig(
-    filename=LOG_FILE,
-    level=logging.INFO,
-    format='%(asctime)s %(levelname)s: %(message)s'
-)
+# Importar este módulo debe ser barato (arranque de workers de gunicorn): la app se
+# arma en crear_app() y python-telegram-bot, ReportLab y la base de datos se cargan
+# o se abren la primera vez que se usan. benchmark.py mide el presupuesto de importación.
+# Lo que tiene hilos, pools o archivos abiertos (envíos, ingesta, sesiones, almacén y
+# caché de PDFs, perfilador) va en PorProceso: se crea con el primer uso en cada
+# proceso, así nada de eso cruza el fork de gunicorn --preload.
+rutas = Blueprint("seri", __name__)
+
+
+class PorProceso:
+    """
+    Crea el objeto con fabrica() la primera vez que se usa en el proceso actual y le
+    pasa los atributos. Después de un fork el hijo crea el suyo.
+    """
+
+    def __init__(self, fabrica):
+        self._fabrica = fabrica
+        self._objeto = None
+        self._pid = None
+        self._lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._despues_de_fork)
+
+    def _despues_de_fork(self):
+        self._lock = threading.Lock()
+
+    def _instancia(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self._objeto = self._fabrica()
+                    self._pid = pid
+        return self._objeto
+
+    def __getattr__(self, nombre):
+        return getattr(self._instancia(), nombre)
 
-# Conexión a la base de datos.
-conn = sqlite3.connect('/var/www/db_serigraph/seri.db', check_same_thread=False)
-cursor = conn.cursor()
 
 TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
-bot = Bot(token=TOKEN)
-dispatcher = Dispatcher(bot, None, workers=0)
+PRECARGAR_PLANTILLA = os.getenv("PRECARGAR_PLANTILLA", "0") == "1"
+bot = None
+dispatcher = None
+_telegram_lock = threading.RLock()
+
+def obtener_bot():
+    """
+    Crea el Bot con el primer uso; importar python-telegram-bot cuesta más que el resto de la app.
+    """
+    global bot
+    if bot is None:
+        with _telegram_lock:
+            if bot is None:
+                from telegram import Bot
+                bot = Bot(token=TOKEN, base_url=f"{envios.TELEGRAM_API_URL}/bot")
+    return bot
+
+# Los envíos salen por un pool de conexiones con límite de tasa (ver envios.py); el Bot
+# de python-telegram-bot solo se usa para leer los updates y despachar los comandos.
+enviador = PorProceso(lambda: envios.Enviador(TOKEN))
+
+def obtener_dispatcher():
+    global dispatcher
+    if dispatcher is None:
+        with _telegram_lock:
+            if dispatcher is None:
+                from telegram.ext import CommandHandler, Dispatcher, MessageHandler, Filters
+                nuevo = Dispatcher(obtener_bot(), None, workers=0)
+                # Los comandos van antes: Filters.text también acepta "/buscar ..."
+                nuevo.add_handler(CommandHandler("buscar", comando_buscar))
+                nuevo.add_handler(CommandHandler("reenviar", comando_reenviar))
+                nuevo.add_handler(CommandHandler("rapida", comando_rapida))
+                nuevo.add_handler(CommandHandler("perfilar", comando_perfilar))
+                nuevo.add_handler(MessageHandler(Filters.text, telegram_webhook))
+                dispatcher = nuevo
+    return dispatcher
+
+def procesar_update(update):
+    mensaje = update.effective_message
+    if perfilador.activo and mensaje is not None and perfilador.elegir("mensaje", mensaje.chat.id):
+        perfilador.correr("mensaje", etiqueta_perfil(mensaje), obtener_dispatcher().process_update, update)
+        return
+    obtener_dispatcher().process_update(update)
+
+# Estado de la conversación por chat, compartido entre procesos (ver sesiones.py)
+sesiones = PorProceso(crear_almacen)
 
-user_data = {}
+# Caché del catálogo (productos, dimensiones, materiales y cobros adicionales).
+# Se carga una sola vez y se invalida con un contador de versión que suben las
+# rutas de escritura; db.version_catalogo() detecta escrituras de otros procesos
+# en las tablas del catálogo (no en el libro de cotizaciones ni en la matriz).
+_catalogo_lock = threading.Lock()
+_catalogo_version = 0
+_catalogo = None
 
-# Carpeta temporal para PDFs (aunque ahora se guardará en la carpeta de cotizaciones)
-TEMP_PDF_DIR = "temp_pdfs"
-if not os.path.exists(TEMP_PDF_DIR):
-    os.makedirs(TEMP_PDF_DIR)
+def invalidar_catalogo():
+    global _catalogo_version
+    with _catalogo_lock:
+        _catalogo_version += 1
 
-DIMENSION_ALIASES = {
-    "carta 8.5x11": (8.5, 11),        # 8.5" x 11"
-    "oficio 8.5x14": (8.5, 14),       # 8.5" x 14"
-    "media carta 8.5x5.5": (8.5, 5.5),  # 8.5" x 5.5"
-    "medio oficio 8.5x7": (8.5, 7),   # 8.5" x 7"
-    # Agrega aquí más equivalencias si lo requieres...
-}
+def obtener_catalogo():
+    """
+    Devuelve el catálogo en memoria; solo consulta las tablas si cambió la versión.
+    """
+    global _catalogo
+    with _catalogo_lock:
+        version = (_catalogo_version, db.version_catalogo())
+        if _catalogo is not None and _catalogo["version"] == version:
+            return _catalogo
+
+        products = db.consultar("productos")
+        dimensions = db.consultar("dimensiones")
+        materials = db.consultar("materiales")
+        cobros = db.consultar("cobros")
+
+        _catalogo = {
+            "version": version,
+            "productos": {fila[1]: fila[2] for fila in products},
+            "dimensiones": {fila[1]: fila[2] for fila in dimensions},
+            "material": {fila[1]: (fila[2], fila[3]) for fila in materials},
+            "materiales": {i+1: fila[1] for i, fila in enumerate(materials)},
+            "cobros": cobros,
+        }
+        logging.info(f"Catálogo recargado (versión {version})")
+        # Fuera del lock y del hilo que pidió el catálogo (ver matriz_precios.programar)
+        matriz_precios.programar(_catalogo)
+        return _catalogo
 
 def formato_monetario(valor):
     return f"Q{valor:,.2f}"
 
-def generar_pdf(client_name, material, flyer_width, cantidad, costo_total, descripcion_producto, quote_folder,day):
-    """
-    Genera un PDF de cotización con información esencial y lo guarda en el folder quote_folder.
-    """
-    file_name = f"cotizacion_{client_name}_{int(time.time())}.pdf"
-    file_path = os.path.join(quote_folder, file_name)
-    c = canvas.Canvas(file_path, pagesize=A4)
-
-    # Logo y datos de la empresa
-    logo = ImageReader('/var/www/db_serigraph/seri.png')
-    c.drawImage(logo, 4, 725, width=140, height=90, preserveAspectRatio=True)
-    x, y = 220, 735
-    prefijo = "Hoja de cotización: "
-    sufijo = f"No. {int(time.time()) % 100000}"
-    c.setFont("Helvetica-Bold", 12)
-    c.drawString(x, y, prefijo)
-    ancho_prefijo = c.stringWidth(prefijo, "Helvetica-Bold", 13)
-    c.setFont("Helvetica", 15)
-    c.drawString(x + ancho_prefijo, y, sufijo)
-    
-    
-    c.setFont("Helvetica", 12)
-    c.drawString(130, 715, "Serigráfica Internacional, S.A.")
-    c.setFont("Helvetica", 12)
-    c.drawString(130, 700, "10 avenida 25-63 zona 13")
-    c.drawString(130, 685, "Complejo Industrial Aurora Bodega 13")
-    c.drawString(130, 670, "Tel: (502) 2319-2900")
-    c.drawString(130, 655, "NIT: 528440-6")
-#     c.setFont("Helvetica-Bold", 11)
-    c.setFont("Helvetica", 12)
-    c.drawString(130, 640, f"Fecha: {time.strftime('%d/%m/%Y')}")
-    c.setFont("Helvetica", 12)
-    c.drawString(130, 625, f"Dirigido a: {client_name}")
-#     c.drawString(220, 690, f"Hoja de cotización: No. {int(time.time()) % 100000}")
-
-    c.setLineWidth(1.5)
-
-    # --- Parámetros del recuadro exterior ---
-    x0, y0 = 50,  150    # esquina inferior izquierda
-    w,  h  = 500, 470   # ancho y alto del recuadro
-
-    # Dibuja el rectángulo exterior
-    c.rect(x0, y0, w, h)
-
-    # --- Líneas verticales internas ---
-    # División entre CANTIDAD y DESCRIPCIÓN
-    x1 = x0 +  80
-    c.line(x1, y0, x1, y0 + h)
-
-    # División entre DESCRIPCIÓN y TOTAL
-    x2 = x0 + 430
-    c.line(x2, y0, x2, y0 + h)
-
-
-
-    # Para separar el encabezado de la tabla
-    y_header = y0 + h - 20
-    c.setFont("Helvetica-Bold", 12)
-    c.drawString(x0+10, y_header, f"CANTIDAD")
-#     c.line(x0, y_header, x0 + w, y_header)
-    ancho = c.stringWidth(f"CANTIDAD", "Helvetica-Bold", 12)
-    # 2) Ajusta grosor y distancia de la línea
-    c.setLineWidth(1)
-    underline_gap = 3  # cuantos puntos por debajo de la “baseline”
-    # 3) Dibuja la línea
-    c.line(x0+10, y_header - underline_gap,
-           x0+10 + ancho, y_header - underline_gap)
-    
-    #Description
-    x_text2 = x0 + 220
-    y_text  = y0 + h - 20
-
-    # Dibuja “Descripción”
-    c.setFont("Helvetica-Bold", 12)
-    c.drawString(x_text2, y_text, "DESCRIPCION")
-
-    # Mide su ancho
-    ancho2 = c.stringWidth("DESCRIPCION", "Helvetica-Bold", 12)
-
-    # Traza la línea justo debajo, con la misma X inicial
-    underline_gap = 3
-    c.setLineWidth(1)
-    c.line(x_text2,           y_text - underline_gap,
-           x_text2 + ancho2,  y_text - underline_gap)
-    
-    
-    #Total
-    x_text2 = x0 + 440
-    y_text  = y0 + h - 20
-
-    # Dibuja “Descripción”
-    c.setFont("Helvetica-Bold", 12)
-    c.drawString(x_text2, y_text, "TOTAL:")
-
-    # Mide su ancho
-    ancho2 = c.stringWidth("TOTAL:", "Helvetica-Bold", 12)
-
-    # Traza la línea justo debajo, con la misma X inicial
-    underline_gap = 3
-    c.setLineWidth(1)
-    c.line(x_text2,           y_text - underline_gap,
-           x_text2 + ancho2,  y_text - underline_gap)
-    
-    
-    
-    #CANTIDAD DE PRODUCTOS CUADRO
-    c.setFont("Helvetica-Bold", 8)
-    x0_cuadro_datos= x0 + 35
-    y_text  = y0 + h - 50
-    c.drawString(x0_cuadro_datos, y_text, f"{cantidad}")
-    x0_cuadro_datos= x0 + 25
-    y_text  = y0 + h - 60
-    c.drawString(x0_cuadro_datos, y_text, f"Unidades")
-    
-    
-    #DESCRIPCION PRODUCTO
-    c.setFont("Helvetica-Bold", 9)
-    x0_cuadro_datos= x0 + 90
-    y_text  = y0 + h - 50
-    c.drawString(x0_cuadro_datos, y_text, f"{descripcion_producto}")
-    
-    
-    #MINI CUADROS
-    # --- Dibujemos ahora las mini cajas de la columna TOTAL ---
-    # 1) Calcula ancho de la columna TOTAL
-    col_total_x    = x2                   # origen X de la columna
-    col_total_w    = (x0 + w) - x2        # ancho de la columna
-    pad            = 5                    # un pequeño padding interno
-
-    # 2) Define alto de cada caja
-    box_h = 50   # ajusta según necesites
-
-    # 3) Primera caja: P/U
-    box1_x = col_total_x + pad
-    box1_y = y0 + h - pad - box_h         # empieza justo abajo del tope del recuadro
-    box1_w = col_total_w - 2*pad
-    c.rect(box1_x, box1_y-40, box1_w, box_h)
-
-    # añade el texto centrado o con padding
-    c.setFont("Helvetica-Bold", 10)
-    c.drawString(box1_x + pad, box1_y + box_h - 55, f"P/U:")
-    c.drawString(box1_x + pad, box1_y + box_h - 70, f"Q{costo_total/cantidad:.2f}")
-
-    # 4) Segunda caja: TOTAL
-    box2_x = box1_x
-    box2_y = box1_y - pad - box_h         # separada por el mismo padding
-    box2_w = box1_w
-    c.rect(box2_x, box2_y-50, box2_w, box_h)
-
-    c.setFont("Helvetica-Bold", 10)
-    c.drawString(box2_x + pad, box2_y + box_h - 70, f"TOTAL:")
-    c.drawString(box2_x + pad, box2_y + box_h - 85, f"Q{costo_total:.2f}")
-
-    #TOTAL PRODUCTO CUADRO
-    
-    
-
-
-#     c.drawString(50, 630, f"Costo final: {formato_monetario(costo_total)}")
-
-    # Mensaje final
-    # Posición base para el texto final
-    x0_1, y0_1 = 60, 140
-    leading = 13
-
-    # 1) Dibujo las primeras 3 líneas con TextObject en NEGRO
-    c.setFillColor(colors.black)
-    c.setFont("Helvetica", 9)
-    text = c.beginText(x0_1, y0_1)
-    text.setLeading(leading)
-    for linea in [
-        f"El tiempo de entrega es de {day} día hábil, desde el momento de la aprobación del proyecto y arte.",
-        "Si el proyecto está antes, se le llamará para notificarle.",
-        "El pago es a contra entrega, salvo que se pacte lo contrario."
-    ]:
-        text.textLine(linea)
-    c.drawText(text)
-
-    # Calcula la Y donde terminó el TextObject
-    # Son 3 líneas → baja 3 * leading
-    y_despues = y0_1 - 3 * leading
-
-    base = "Si cuenta con el diseño de la impresión, mandar a "
-    c.setFont("Helvetica", 9)
-    c.setFillColor(colors.black)
-    c.drawString(x0_1, y_despues, base)
-
-    # 2) Calcula X de inicio del correo
-    ancho_base = c.stringWidth(base, "Helvetica", 9)
-    x_correo = x0_1 + ancho_base
-
-    # 3) Dibuja el correo en AZUL
-    correo = "jjdahud@gmail.com"
-    c.setFillColor(colors.blue)
-    c.drawString(x_correo, y_despues, correo)
-
-    # 4) Subrayado: usa la misma X y la misma anchura
-    ancho_correo = c.stringWidth(correo, "Helvetica", 9)
-    gap = 2  # separación desde la baseline
-    c.setStrokeColor(colors.blue)
-    c.setLineWidth(0.5)
-    c.line(x_correo, y_despues - gap, x_correo + ancho_correo, y_despues - gap)
-
-    # 5) (Opcional) Restaura color negro para lo que siga dibujando
-    c.setFillColor(colors.black)
-    c.setStrokeColor(colors.black)
-
-    # 3) Finalmente la línea de “Muchas gracias…” en AMBAR
-    texto_gracias = "Muchas gracias por contactar a Zerigráfica Internacional"
-    # baja una línea extra para separar
-    y_gracias = y_despues - leading - 5  
-    c.setFont("Helvetica-Bold", 9)
-    c.setFillColor(HexColor("#FFBF00"))   # amber
-    c.drawString(x0_1, y_gracias, texto_gracias)
-
-    c.setFont("Helvetica-Bold", 12)
-    c.drawString(x0_1+200, y_gracias-30, "Att: José David")
-    c.drawString(x0_1+200, y_gracias-45, "Gerente General")
-    # 4) (Opcional) Vuelve a negro para lo que siga
-    c.setFillColor(colors.black)
-
-    c.save()
-    return file_path
-    logging.info(f"PDF generado para {client_name} en {file_path}")
-    return file_path
+# Cola de cotizaciones: el PDF se genera y se envía fuera del hilo del webhook.
+# PDF_WORKERS limita la concurrencia y PDF_QUEUE_MAX la cantidad de trabajos en espera.
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "2"))
+PDF_QUEUE_MAX = int(os.getenv("PDF_QUEUE_MAX", "20"))
+COTIS_DIR = os.getenv("SERI_COTIS_DIR", "/var/www/db_serigraph/cotis")
+ARCHIVAR_COTIZACIONES = os.getenv("ARCHIVAR_COTIZACIONES", "1") == "1"
+
+# Archivo de PDFs enviados, direccionado por contenido (ver almacen_pdf.py); el
+# registro de cada cotización va a la tabla quotes.
+ALMACEN_PDF_DIR = os.getenv("SERI_ALMACEN_PDF_DIR", os.path.join(COTIS_DIR, "pdf"))
+almacen_pdf = PorProceso(lambda: AlmacenPDF(ALMACEN_PDF_DIR))
+
+# Perfilado bajo demanda (ver perfiles.py): PERFILES_MUESTREO=N perfila uno de cada N
+# mensajes y PDFs; /perfilar desde un chat de ADMIN_CHATS perfila un chat unos minutos.
+PERFILES_DIR = os.getenv("SERI_PERFILES_DIR", os.path.join(COTIS_DIR, "perfiles"))
+perfilador = PorProceso(lambda: perfiles.Perfilador(PERFILES_DIR, int(os.getenv("PERFILES_MUESTREO", "0")),
+                                                    int(os.getenv("PERFILES_MAX", "200"))))
+
+# Caché de PDFs ya generados, con tamaño máximo en disco (ver cache_pdf.py)
+CACHE_PDF_DIR = os.getenv("SERI_CACHE_PDF_DIR", os.path.join(COTIS_DIR, ".cache"))
+CACHE_PDF_MAX_MB = int(os.getenv("CACHE_PDF_MAX_MB", "200"))
+cache_pdf = PorProceso(lambda: CachePDF(CACHE_PDF_DIR, CACHE_PDF_MAX_MB * 1024 * 1024))
+
+cola_cotizaciones = queue.Queue(maxsize=PDF_QUEUE_MAX)
+# Cuotas por chat, tope de PDFs a la vez y descarte por carga (ver admision.py)
+control_admision = admision.Admision()
+_trabajadores = []
+_trabajadores_pid = None
+_trabajadores_lock = threading.Lock()
+
+# Métricas de latencia (ver metricas.py), expuestas en /metrics
+MENSAJE_SEGUNDOS = metricas.Histograma("seri_mensaje_segundos", "Tiempo de respuesta por paso de la conversación", "step")
+PDF_SEGUNDOS = metricas.Histograma("seri_pdf_render_segundos", "Tiempo de generación de un PDF (sin aciertos de caché)")
+COTIZACIONES = metricas.Contador("seri_cotizaciones_total", "Cotizaciones procesadas por resultado", "resultado")
+
+def archivar_pdf(pdf_bytes):
+    """
+    Guarda una copia del PDF en el almacén y devuelve su hash (None si no se pudo).
+    """
+    try:
+        return almacen_pdf.guardar(pdf_bytes)
+    except OSError as e:
+        logging.error(f"No se pudo archivar el PDF: {e}")
+        return None
+
+def registrar_cotizacion(trabajo, clave, pdf_hash):
+    """
+    Agrega la cotización al libro (tabla quotes) con los datos del cálculo.
+    """
+    db.ejecutar("registrar_cotizacion", (
+        time.time(), time.strftime('%Y-%m-%d'), str(trabajo["chat_id"]), trabajo["client_name"],
+        trabajo.get("producto"), trabajo.get("dimension"), trabajo["material"],
+        trabajo.get("precio_material"), trabajo.get("medida_material"), trabajo["cantidad"],
+        json.dumps(trabajo.get("adicionales", [])), trabajo.get("margen"), trabajo.get("tiro_retiro"),
+        trabajo["dias"], trabajo.get("piezas_por_pliego"), trabajo.get("pliegos"), trabajo["costo_total"],
+        trabajo["descripcion_producto"], PLANTILLA_VERSION, clave, pdf_hash))
+
+def pdf_de_cotizacion(cotizacion):
+    """
+    Bytes del PDF de una fila de quotes: del almacén si se archivó, si no se
+    regenera con los datos guardados.
+    """
+    if cotizacion["pdf_hash"]:
+        pdf_bytes = almacen_pdf.leer(cotizacion["pdf_hash"])
+        if pdf_bytes is not None:
+            return pdf_bytes
+        logging.warning(f"PDF {cotizacion['pdf_hash']} de la cotización {cotizacion['id']} no está en el almacén")
+    # Con la fecha en que se envió y el número de la cotización, no los de hoy
+    return generar_pdf_cacheado(cotizacion["cliente"], cotizacion["material"],
+                                parse_dimension(cotizacion["dimension"] or "")[0], cotizacion["cantidad"],
+                                cotizacion["costo_total"], cotizacion["descripcion"], cotizacion["dias"],
+                                fecha=cotizacion["fecha"], numero=cotizacion["id"])
+
+def clave_render(client_name, material, flyer_width, cantidad, costo_total, descripcion_producto, day,
+                 fecha=None, numero=None):
+    """
+    Clave canónica de los datos que recibe generar_pdf y de la versión de la plantilla.
+    La fecha (la del día si no se da) entra en la clave porque también sale impresa, y
+    el número solo cuando es fijo (una reimpresión); si no, sale de la hora y no cuenta.
+    """
+    datos = (PLANTILLA_VERSION, fecha or time.strftime('%Y-%m-%d'), client_name, material,
+             flyer_width, cantidad, costo_total, descripcion_producto, day)
+    return clave_canonica(*datos) if numero is None else clave_canonica(*datos, numero)
+
+def clave_cotizacion(trabajo):
+    return clave_render(trabajo["client_name"], trabajo["material"], trabajo["flyer_width"],
+                        trabajo["cantidad"], trabajo["costo_total"], trabajo["descripcion_producto"],
+                        trabajo["dias"])
+
+def generar_pdf_cacheado(client_name, material, flyer_width, cantidad, costo_total, descripcion_producto, day,
+                         fecha=None, numero=None):
+    """
+    Como generar_pdf(en_memoria=True), pero reutiliza el PDF si ya se generó con los mismos datos.
+    """
+    clave = clave_render(client_name, material, flyer_width, cantidad, costo_total, descripcion_producto, day,
+                         fecha, numero)
+    pdf_bytes = cache_pdf.obtener(clave)
+    if pdf_bytes is not None:
+        return pdf_bytes
+    # Tope de PDFs a la vez en el proceso: cola de cotizaciones, reenvíos y descargas
+    with control_admision.render(), PDF_SEGUNDOS.medir():
+        pdf_bytes = generar_pdf(client_name, material, flyer_width, cantidad, costo_total,
+                                descripcion_producto, None, day, en_memoria=True, fecha=fecha, numero=numero)
+    try:
+        cache_pdf.guardar(clave, pdf_bytes)
+    except OSError as e:
+        logging.error(f"No se pudo guardar el PDF en caché: {e}")
+    return pdf_bytes
+
+def reenviar_por_file_id(chat_id, clave):
+    """
+    Si Telegram ya tiene este documento, lo envía por file_id sin volver a subirlo.
+    """
+    fila = db.consultar("buscar_file_id", (clave,))
+    if not fila:
+        return False
+    try:
+        enviador.enviar_documento(chat_id, fila[0][0]).result()
+    except envios.ErrorTelegram as e:
+        logging.warning(f"file_id en caché ya no es válido ({e}); se sube de nuevo")
+        db.ejecutar("borrar_file_id", (clave,))
+        return False
+    return True
+
+def procesar_cotizacion(trabajo):
+    """
+    Genera el PDF en memoria, lo envía al chat, lo archiva si ARCHIVAR_COTIZACIONES está
+    activo y lo registra en el libro de cotizaciones.
+    Una cotización idéntica que ya se subió se reenvía con el file_id de Telegram.
+    """
+    client_name = trabajo["client_name"]
+    clave = clave_cotizacion(trabajo)
+    if reenviar_por_file_id(trabajo["chat_id"], clave):
+        enviador.enviar_mensaje(trabajo["chat_id"], "¡Cotización generada!")
+        COTIZACIONES.incrementar("reenviada")
+        logging.info(f"Cotización reenviada por file_id a {trabajo['chat_id']} para {client_name}")
+        fila = db.consultar("pdf_por_clave", (clave,))
+        registrar_cotizacion(trabajo, clave, fila[0][0] if fila else None)
+        return
+    file_name = nombre_pdf(client_name)
+    datos_pdf = (client_name, trabajo["material"], trabajo["flyer_width"], trabajo["cantidad"],
+                 trabajo["costo_total"], trabajo["descripcion_producto"], trabajo["dias"])
+    if perfilador.activo and perfilador.elegir("pdf", trabajo["chat_id"]):
+        pdf_bytes = perfilador.correr("pdf", "generar_pdf", generar_pdf_cacheado, *datos_pdf)
+    else:
+        pdf_bytes = generar_pdf_cacheado(*datos_pdf)
+    # Se espera la subida para guardar el file_id; el aviso siguiente sale sin esperar
+    enviado = enviador.enviar_documento(trabajo["chat_id"], pdf_bytes, file_name).result()
+    file_id = ((enviado or {}).get("document") or {}).get("file_id")
+    if file_id:
+        db.ejecutar("guardar_file_id", (clave, file_id, time.time()))
+    enviador.enviar_mensaje(trabajo["chat_id"], "¡Cotización generada!")
+    COTIZACIONES.incrementar("enviada")
+    logging.info(f"Cotización enviada a {trabajo['chat_id']} para {client_name}")
+    # El archivo y el registro se escriben después de responder al usuario
+    pdf_hash = archivar_pdf(pdf_bytes) if ARCHIVAR_COTIZACIONES else None
+    registrar_cotizacion(trabajo, clave, pdf_hash)
+
+def _trabajador_cotizaciones():
+    while True:
+        trabajo = cola_cotizaciones.get()
+        try:
+            procesar_cotizacion(trabajo)
+        except admision.Ocupado:
+            COTIZACIONES.incrementar("ocupado")
+            logging.warning(f"Sin lugar para renderizar la cotización de {trabajo['chat_id']}")
+            enviador.enviar_mensaje(trabajo["chat_id"],
+                                    "Estamos generando muchas cotizaciones en este momento. "
+                                    "Envía 'hola' en unos minutos para intentarlo de nuevo.")
+        except Exception as e:
+            COTIZACIONES.incrementar("error")
+            logging.error(f"Error al generar cotización para {trabajo['chat_id']}: {e}")
+            enviador.enviar_mensaje(trabajo["chat_id"],
+                                    "No se pudo generar la cotización. Envía 'hola' para intentarlo de nuevo.")
+        finally:
+            cola_cotizaciones.task_done()
+
+def iniciar_trabajadores():
+    """
+    Arranca los hilos de la cola (una sola vez por proceso, ya después del fork de gunicorn).
+    """
+    global _trabajadores_pid
+    with _trabajadores_lock:
+        if _trabajadores_pid == os.getpid():
+            return
+        # Hilos arrancados antes de un fork no existen en el hijo
+        _trabajadores.clear()
+        _trabajadores_pid = os.getpid()
+        for i in range(max(PDF_WORKERS, 1)):
+            hilo = threading.Thread(target=_trabajador_cotizaciones, name=f"cotizaciones-{i}", daemon=True)
+            hilo.start()
+            _trabajadores.append(hilo)
+        logging.info(f"{len(_trabajadores)} trabajadores de cotizaciones iniciados")
+
+def encolar_cotizacion(trabajo):
+    """
+    Agrega el trabajo a la cola. Devuelve False si la cola está llena o el chat
+    pasó su cuota de cotizaciones.
+    """
+    iniciar_trabajadores()
+    if not control_admision.cotizacion(trabajo["chat_id"]):
+        COTIZACIONES.incrementar("limitada")
+        logging.warning(f"{trabajo['chat_id']} pasó su cuota de cotizaciones; se rechaza")
+        return False
+    try:
+        cola_cotizaciones.put_nowait(trabajo)
+    except queue.Full:
+        # La cotización no se va a hacer: no cuenta para la cuota del chat
+        control_admision.devolver_cotizacion(trabajo["chat_id"])
+        COTIZACIONES.incrementar("rechazada")
+        logging.warning(f"Cola de cotizaciones llena ({PDF_QUEUE_MAX}); se rechaza {trabajo['chat_id']}")
+        return False
+    return True
+
+def armar_trabajo(chat_id, client_name, producto, dim_str, material, mat_price, mat_medida, cantidad, dias,
+                  adicionales, margen, tiro_retiro, precio):
+    """
+    Trabajo para la cola de cotizaciones; `precio` es el resultado de cotizar (o de la matriz).
+    """
+    return {
+        "chat_id": chat_id,
+        "client_name": client_name,
+        "material": material,
+        "flyer_width": precio["flyer_width"],
+        "cantidad": cantidad,
+        "costo_total": precio["final_cost"],
+        "descripcion_producto": f"{producto}, Tamaño: {dim_str}, Material: {material}",
+        "dias": dias,
+        # Datos del cálculo para el libro de cotizaciones
+        "producto": producto,
+        "dimension": dim_str,
+        "precio_material": mat_price,
+        "medida_material": mat_medida,
+        "adicionales": adicionales,
+        "margen": margen,
+        "tiro_retiro": tiro_retiro,
+        "piezas_por_pliego": precio["flyers_per_sheet"],
+        "pliegos": precio["required_sheets"],
+    }
+
+LIMITE_ALTAS = "Alcanzaste el límite de altas al catálogo por ahora; intenta más tarde."
 
 # Funciones para administrar cobros adicionales (menú de edición)
 def agregar_cobro(nombre, descripcion):
-    cursor.execute("INSERT INTO additional_charges (name, description) VALUES (?, ?)", (nombre, descripcion))
-    conn.commit()
+    db.ejecutar("agregar_cobro", (nombre, descripcion))
+    invalidar_catalogo()
     logging.info(f"Cobro adicional agregado: {nombre} - {descripcion}")
 
 def eliminar_cobro(cobro_id):
-    cursor.execute("DELETE FROM additional_charges WHERE id=?", (cobro_id,))
-    conn.commit()
+    db.ejecutar("eliminar_cobro", (cobro_id,))
+    invalidar_catalogo()
     logging.info(f"Cobro adicional eliminado: ID {cobro_id}")
 
 def obtener_cobros():
-    cursor.execute("SELECT id, name, description FROM additional_charges")
-    return cursor.fetchall()
+    return list(obtener_catalogo()["cobros"])
+
+# Flujo de la conversación de Telegram: un paso por manejador, registrado en la máquina.
+# Cada manejador recibe la sesión del chat, el mensaje ya validado y el chat id.
+conversacion_telegram = MaquinaPasos("telegram")
+
+MENSAJE_MENU = "Bienvenido\n1. Cotización\n2. Editar cobros adicionales"
+SI_NO_INVALIDO = "Respuesta no válida. Ingresa 'si' o 'no'."
+PREGUNTA_MARGEN = "Por defecto, el margen de ganancia es del 50%. ¿Desea modificarlo? (si/no):"
+PREGUNTA_CONFIRMAR = "Confirma tu pedido respondiendo 'si' o 'no':"
+
+def texto_materiales(materiales):
+    return "\n".join([f"{i}. {mat}" for i, mat in materiales.items()])
+
+def texto_productos(diccionario_productos):
+    texto = "0. Agregar nuevo producto\n"
+    texto += "\n".join([f"{i+1}. {prod}" for i, prod in enumerate(diccionario_productos.keys())])
+    return texto
+
+@conversacion_telegram.paso("ask_nombre")
+def paso_ask_nombre(sesion, mensaje, user_number):
+    client_name = mensaje.strip()
+    logging.info(f"Nueva cotización para cliente {client_name}")
+    if not client_name:
+        return "El nombre no puede estar vacío. Ingresa tu nombre de cliente:"
+    sesion["client_name"] = client_name
+    sesion["step"] = "menu"
+    logging.info(f"Cliente {client_name} ingresado por {user_number}")
+    return MENSAJE_MENU
+
+# Menú principal
+@conversacion_telegram.paso("menu")
+def paso_menu(sesion, mensaje, user_number):
+    if mensaje == "1":
+        sesion["step"] = "productos"
+        return "Selecciona el producto:\n" + texto_productos(obtener_catalogo()["productos"])
+    if mensaje == "2":
+        sesion["step"] = "admin_charges"
+        return ("Has seleccionado editar cobros adicionales:\n"
+                "1. Agregar cobro adicional\n"
+                "2. Eliminar cobro adicional\n"
+                "3. Ver cobros adicionales existentes")
+    return "Opción no válida. Envía '1' para Cotización o '2' para Editar cobros adicionales."
+
+@conversacion_telegram.paso("admin_charges", atras="menu")
+def paso_admin_charges(sesion, mensaje, user_number):
+    if mensaje == "1":
+        sesion["step"] = "add_charge"
+        return "Ingresa el nombre y la descripción separados por coma.\nEj: Pegamento, Especial"
+    if mensaje == "2":
+        charges = obtener_cobros()
+        if charges:
+            response_message = "Selecciona el ID del cobro a eliminar:\n"
+            for charge in charges:
+                response_message += f"{charge[0]}. {charge[1]} - {charge[2]}\n"
+        else:
+            response_message = "No hay cobros adicionales registrados."
+        sesion["step"] = "delete_charge"
+        return response_message
+    if mensaje == "3":
+        charges = obtener_cobros()
+        if charges:
+            response_message = "Cobros actuales:\n"
+            for charge in charges:
+                response_message += f"{charge[1]} ({charge[2]})\n"
+        else:
+            response_message = "No hay cobros adicionales registrados."
+        response_message += "\n\nMenú:\n1. Cotización\n2. Editar cobros adicionales"
+        sesion["step"] = "menu"
+        return response_message
+    return "Opción no válida en administración de cobros. Intenta de nuevo."
+
+@conversacion_telegram.paso("add_charge", atras="admin_charges")
+def paso_add_charge(sesion, mensaje, user_number):
+    sesion["step"] = "menu"
+    try:
+        parts = mensaje.split(",")
+        if len(parts) < 2:
+            raise ValueError("Faltan datos")
+        if not control_admision.alta(user_number):
+            return LIMITE_ALTAS
+        agregar_cobro(parts[0].strip(), parts[1].strip())
+        return "Cobro agregado correctamente."
+    except Exception as e:
+        logging.error(f"Error al agregar cobro: {e}")
+        return "Formato incorrecto. Intenta de nuevo. Ej: Pegamento, Especial"
+
+@conversacion_telegram.paso("delete_charge", atras="admin_charges")
+def paso_delete_charge(sesion, mensaje, user_number):
+    sesion["step"] = "menu"
+    try:
+        eliminar_cobro(int(mensaje))
+        return "Cobro eliminado correctamente."
+    except Exception as e:
+        logging.error(f"Error al eliminar cobro: {e}")
+        return "Opción inválida. Intenta de nuevo."
+
+# Flujo de cotización:
+@conversacion_telegram.paso("productos", atras="menu",
+                            validador=numero(int, "Ingresa una opción válida."))
+def paso_productos(sesion, opcion, user_number):
+    if opcion == 0:
+        sesion["step"] = "nuevo_producto"
+        return "Ingresa el nombre del nuevo producto:"
+    catalogo = obtener_catalogo()
+    product_keys = list(catalogo["productos"].keys())
+    if opcion < 0 or opcion > len(product_keys):
+        return "Producto no válido."
+    producto = product_keys[opcion - 1]
+    sesion["product"] = (producto, catalogo["productos"][producto])
+    texto = f"{producto} - \nElige tamaño (dimensional inches):\n"
+    texto += "0. Agregar nuevo tamaño (Ej: 20x10)\n"
+    texto += "\n".join([f"{i+1}. {dim}" for i, dim in enumerate(catalogo["dimensiones"].keys())])
+    sesion["step"] = "dimensiones"
+    return texto
+
+@conversacion_telegram.paso("nuevo_producto", atras="productos")
+def paso_nuevo_producto(sesion, mensaje, user_number):
+    new_product_name = mensaje.strip()
+    if not control_admision.alta(user_number):
+        sesion["step"] = "productos"
+        return LIMITE_ALTAS + "\nSelecciona el producto:\n" + texto_productos(obtener_catalogo()["productos"])
+    db.ejecutar("agregar_producto", (new_product_name, 0.0))
+    invalidar_catalogo()
+    sesion["step"] = "productos"
+    return (f"Producto '{new_product_name}' agregado con éxito.\nSelecciona el producto:\n"
+            + texto_productos(obtener_catalogo()["productos"]))
+
+@conversacion_telegram.paso("dimensiones", atras="productos")
+def paso_dimensiones(sesion, mensaje, user_number):
+    try:
+        opcion = mensaje.strip()
+        if opcion == "0":
+            sesion["step"] = "dimension_specific"
+            return "Ingresa el tamaño en formato anchoxalto (Ej: 20x10):"
+        catalogo = obtener_catalogo()
+        opcion_int = int(opcion)
+        dims_list = list(catalogo["dimensiones"].keys())
+        if opcion_int < 1 or opcion_int > len(dims_list):
+            return "Tamaño no válido."
+        dim = dims_list[opcion_int - 1]
+        precio_dim = catalogo["dimensiones"][dim]
+        sesion.update({"step": "material", "dimensiones": (dim, precio_dim)})
+        return f"Tamaño: {dim} - \nSelecciona material:\n" + texto_materiales(catalogo["materiales"])
+    except Exception as e:
+        logging.error(f"Error en selección de dimensión: {e}")
+        return "Error, ingresa un tamaño válido."
+
+@conversacion_telegram.paso("dimension_specific", atras="dimensiones")
+def paso_dimension_specific(sesion, mensaje, user_number):
+    pattern = r'^\s*(\d+(?:\.\d+)?)\s*x\s*(\d+(?:\.\d+)?)\s*$'
+    match = re.fullmatch(pattern, mensaje)
+    if not match:
+        return "Formato inválido. Usa el formato 'ancho x alto' (Ej: 20x10)."
+    width, height = match.groups()
+    width, height = float(width), float(height)
+    if width <= 0 or height <= 0:
+        return "Las dimensiones deben ser mayores a 0. Ingresa el tamaño nuevamente (Ej: 20x10):"
+    if not dimension_aceptable(width, height):
+        return (f"Cada medida debe estar entre {DIMENSION_MINIMA:g} y {DIMENSION_MAXIMA:g}. "
+                "Ingresa el tamaño nuevamente (Ej: 20x10):")
+    dim_str = f"{width}x{height}"
+    if not control_admision.alta(user_number):
+        sesion["step"] = "dimensiones"
+        return (LIMITE_ALTAS + "\nElige tamaño:\n"
+                + "\n".join(f"{i+1}. {dim}" for i, dim in enumerate(obtener_catalogo()["dimensiones"].keys())))
+    db.ejecutar("agregar_dimension", (dim_str, 0.0))
+    invalidar_catalogo()
+    sesion.update({"step": "material", "dimensiones": (dim_str, 0.0)})
+    logging.info(f"Dimensión específica ingresada: {dim_str} por {user_number}")
+    return f"Tamaño: {dim_str} - \nSelecciona material:\n" + texto_materiales(obtener_catalogo()["materiales"])
+
+@conversacion_telegram.paso("material", atras="dimensiones")
+def paso_material(sesion, mensaje, user_number):
+    catalogo = obtener_catalogo()
+    try:
+        material = catalogo["materiales"][int(mensaje)]
+    except Exception:
+        return "Selecciona un material válido."
+    precio_mat, medida_mat = catalogo["material"].get(material, (0, "0x0"))
+    sesion["material"] = (material, precio_mat, medida_mat)
+    sesion["step"] = "cantidad"
+    return "¿Cuántos volantes deseas cotizar? (debe ser mayor a 0)"
+
+@conversacion_telegram.paso("cantidad", atras="material",
+                            validador=numero(int, "Ingresa una cantidad válida (número mayor a 0).",
+                                             minimo=0, minimo_incluido=False,
+                                             error_minimo="La cantidad debe ser mayor a 0. Ingresa la cantidad:"))
+def paso_cantidad(sesion, cantidad, user_number):
+    sesion["cantidad"] = cantidad
+    sesion["step"] = "digital"
+    return "¿Es impresión digital? (si/no):"
+
+# Paso: determinar si es digital y luego preparar cargos adicionales
+@conversacion_telegram.paso("digital", atras="cantidad",
+                            validador=si_no("Respuesta no válida, ingresa 'si' o 'no'."))
+def paso_digital(sesion, digital, user_number):
+    # Se guarda True si es digital, False en caso contrario
+    sesion["digital"] = digital
+    additional_list = obtener_cobros()
+    # Si es digital se eliminan los cargos de "clicks"; si no, se incluyen
+    if not digital:
+        additional_list = [charge for charge in additional_list if charge[2].lower() != "clicks"]
+        logging.debug(f"Cobros adicionales sin clicks: {len(additional_list)}")
+    sesion["additional_list"] = additional_list
+    sesion["current_charge_index"] = 0
+    sesion["additional_values"] = []
+    if additional_list:
+        charge = additional_list[0]
+        sesion["step"] = "ask_additional"
+        return f"Ingrese el precio para {charge[1]} ({charge[2]}): "
+    sesion["step"] = "ask_extra_cost"
+    return "No hay cargos adicionales. ¿Desea agregar algún costo extra? (si/no):"
 
-def parse_dimension(dim_str: str) -> (float, float):
+@conversacion_telegram.paso("ask_additional", atras="digital",
+                            validador=numero(float, "Ingresa un valor numérico para el precio (valor >= 0).",
+                                             minimo=0,
+                                             error_minimo="El precio no puede ser negativo. Ingresa un valor >= 0:"))
+def paso_ask_additional(sesion, price, user_number):
+    sesion.setdefault("additional_values", []).append(price)
+    current_index = sesion["current_charge_index"] + 1
+    additional_list = sesion["additional_list"]
+    if current_index < len(additional_list):
+        sesion["current_charge_index"] = current_index
+        charge = additional_list[current_index]
+        return f"Ingrese el precio para {charge[1]} ({charge[2]}): "
+    sesion["step"] = "ask_extra_cost"
+    return "Todos los cargos adicionales han sido registrados. ¿Desea agregar algún costo extra? (si/no):"
+
+# Flujo para agregar costos extras (no predefinidos)
+@conversacion_telegram.paso("ask_extra_cost", atras="ask_additional", validador=si_no(SI_NO_INVALIDO))
+def paso_ask_extra_cost(sesion, agregar, user_number):
+    if agregar:
+        sesion["step"] = "extra_cost_amount"
+        return "Ingresa el monto del costo extra:"
+    # EN LUGAR de ir directamente a ask_margin, preguntamos por días hábiles
+    sesion["step"] = "ask_days"
+    return "¿En cuántos días hábiles requieres la entrega?"
+
+@conversacion_telegram.paso("ask_days",
+                            validador=numero(int, "Por favor ingresa un número entero de días hábiles."))
+def paso_ask_days(sesion, dias, user_number):
+    sesion["dias_habiles"] = dias
+    sesion["step"] = "ask_tiro_retiro"
+    return "¿Es servicio tiro-retiro? (si/no):"
+
+@conversacion_telegram.paso("ask_tiro_retiro", validador=si_no(SI_NO_INVALIDO))
+def paso_ask_tiro_retiro(sesion, tiro_retiro, user_number):
+    if tiro_retiro:
+        sesion["step"] = "ask_tiro_retiro_cost"
+        return "¿Cuál es el costo extra de tiro-retiro?"
+    sesion["tirretiro_cost"] = 0.0
+    sesion["step"] = "ask_margin"
+    return PREGUNTA_MARGEN
+
+@conversacion_telegram.paso("ask_tiro_retiro_cost",
+                            validador=numero(float, "Ingresa un valor numérico para el costo extra."))
+def paso_ask_tiro_retiro_cost(sesion, cost_tr, user_number):
+    sesion["tirretiro_cost"] = cost_tr
+    sesion["step"] = "ask_margin"
+    return PREGUNTA_MARGEN
+
+@conversacion_telegram.paso("extra_cost_amount", atras="ask_extra_cost",
+                            validador=numero(float, "Ingresa un valor numérico para el costo extra.",
+                                             minimo=0,
+                                             error_minimo="El monto no puede ser negativo. Ingresa un valor mayor o igual a 0:"))
+def paso_extra_cost_amount(sesion, extra_cost, user_number):
+    sesion["temp_extra_cost"] = extra_cost
+    sesion["step"] = "extra_cost_description"
+    return "Ingresa la descripción para el costo extra:"
+
+@conversacion_telegram.paso("extra_cost_description", atras="extra_cost_amount")
+def paso_extra_cost_description(sesion, mensaje, user_number):
+    extra_cost = sesion.pop("temp_extra_cost", 0)
+    sesion.setdefault("additional_values", []).append(extra_cost)
+    sesion["step"] = "ask_extra_cost"
+    # El monto cuenta para esta cotización; la fila en additional_charges es un alta más
+    if not control_admision.alta(user_number):
+        return ("Costo extra agregado a esta cotización, sin guardarlo en los cobros: " + LIMITE_ALTAS
+                + "\n¿Desea agregar otro costo extra? (si/no):")
+    agregar_cobro("costo", mensaje.strip())
+    return "Costo extra agregado. ¿Desea agregar otro costo extra? (si/no):"
+
+# Preguntar por el margen justo antes de confirmar
+@conversacion_telegram.paso("ask_margin", atras="ask_extra_cost", validador=si_no(SI_NO_INVALIDO))
+def paso_ask_margin(sesion, modificar, user_number):
+    if modificar:
+        sesion["step"] = "set_margin"
+        return "Ingresa el porcentaje de margen de ganancia (ej: 50 para 50%):"
+    sesion["margin"] = 50  # Valor por defecto
+    sesion["step"] = "confirmacion"
+    return PREGUNTA_CONFIRMAR
+
+@conversacion_telegram.paso("set_margin", atras="ask_margin",
+                            validador=numero(float, "Por favor, ingresa un número válido para el margen.",
+                                             minimo=0,
+                                             error_minimo="El margen no puede ser negativo. Ingresa un valor válido:"))
+def paso_set_margin(sesion, margin_val, user_number):
+    sesion["margin"] = margin_val
+    sesion["step"] = "confirmacion"
+    return PREGUNTA_CONFIRMAR
+
+@conversacion_telegram.paso("confirmacion", atras="set_margin")
+def paso_confirmacion(sesion, mensaje, user_number):
+    if "si" in mensaje.lower():
+        cantidad = sesion["cantidad"]
+        dim_str, _precio_dim = sesion["dimensiones"]
+        material, mat_price, mat_medida = sesion["material"]
+        dias = sesion.get("dias_habiles", 1)
+        precio = cotizar(dim_str, mat_price, mat_medida, cantidad,
+                         adicionales=sesion.get("additional_values", []),
+                         margin=sesion.get("margin", 50),
+                         costo_tr=sesion.get("tirretiro_cost", 0.0))
+        if precio["flyer_width"] <= 0 or precio["flyer_height"] <= 0:
+            logging.warning(f"No se pudo parsear la dimensión {dim_str}, se usará 0,0")
+        trabajo = armar_trabajo(user_number, sesion.get("client_name", "Cliente"), sesion["product"][0],
+                                dim_str, material, mat_price, mat_medida, cantidad, dias,
+                                sesion.get("additional_values", []), sesion.get("margin", 50),
+                                sesion.get("tirretiro_cost", 0.0), precio)
+        if not encolar_cotizacion(trabajo):
+            # Cola llena: se conserva el paso para que el usuario reintente con 'si'
+            return ("Estamos generando muchas cotizaciones en este momento. "
+                    "Espera unos segundos y responde 'si' de nuevo.")
+        sesion.clear()
+        return "Generando tu cotización, te la enviaremos en un momento."
+    if "no" in mensaje.lower():
+        logging.info(f"Cotización cancelada por {user_number}")
+        sesion.clear()
+        return "Cotización cancelada."
+    return "Debes ingresar 'si' o 'no'."
+
+def telegram_webhook(update, context):
     """
-    Devuelve (width, height) en cm a partir de una cadena como '20x30', 'carta' o 'carta 8.5x11'.
-    Si no se puede parsear, devuelve (0,0).
+    Carga la sesión del chat, despacha el mensaje al paso actual y guarda la sesión
+    (una sesión vacía significa que la conversación terminó).
     """
-    dim_str = dim_str.lower().strip()
-    
-    # Buscar un patrón que contenga dos números separados por "x"
-    match = re.search(r'(\d+(?:\.\d+)?)\s*x\s*(\d+(?:\.\d+)?)', dim_str)
-    if match:
-        try:
-            w = float(match.group(1))
-            h = float(match.group(2))
-            if w > 0 and h > 0:
-                return (w, h)
-        except Exception:
-            return (0, 0)
-    
-    # Si no se encontró un patrón numérico, se busca el alias completo en DIMENSION_ALIASES.
-    if dim_str in DIMENSION_ALIASES:
-        return DIMENSION_ALIASES[dim_str]
-    
-    return (0, 0)
-
-# Flujo del webhook de Telegram.
-def telegram_webhook(update: Update, context):
+    inicio = time.perf_counter()
     user_number = update.message.chat.id
     incoming_message = update.message.text.strip()
+    sesion = sesiones.obtener(user_number)
+    step = sesion.get("step") if sesion else None
 
-    # -------------------------------------------------------
-    # Opción de "paso atrás": se aceptan "atras" o "atrás"
-    if user_number in user_data and incoming_message.lower() in ["r", "R"]:
-        current_step = user_data[user_number].get("step", "")
-        back_steps = {
-            "menu": None,  # No se permite retroceder desde el menú principal
-            "productos": "menu",
-            "nuevo_producto": "productos",
-            "dimensiones": "productos",
-            "dimension_specific": "dimensiones",
-            "material": "dimensiones",
-            "cantidad": "material",
-            "digital": "cantidad",
-            "ask_additional": "digital",
-            "ask_extra_cost": "ask_additional",
-            "extra_cost_amount": "ask_extra_cost",
-            "extra_cost_description": "extra_cost_amount",
-            "ask_margin": "ask_extra_cost",
-            "set_margin": "ask_margin",
-            "confirmacion": "set_margin",
-            "admin_charges": "menu",
-            "add_charge": "admin_charges",
-            "delete_charge": "admin_charges"
-        }
-        if current_step in back_steps and back_steps[current_step]:
-            prev = back_steps[current_step]
-            user_data[user_number]["step"] = prev
+    if incoming_message.lower() == "hola":
+        sesion = {"step": "ask_nombre"}
+        response_message = "¡Hola! Ingresa tu nombre de cliente:"
+        logging.info(f"Nuevo inicio de conversación con {user_number}")
+    elif sesion is None:
+        response_message = "Envía 'hola' para comenzar."
+    elif incoming_message.lower() == "r":
+        # Opción de "paso atrás"
+        prev = conversacion_telegram.anterior(sesion.get("step", ""))
+        if prev:
+            sesion["step"] = prev
             response_message = f"Retrocediendo. Por favor ingresa nuevamente la información para '{prev}':"
-            update.message.reply_text(response_message)
-            return
         else:
             response_message = "No puedes retroceder en este paso."
-            update.message.reply_text(response_message)
-            return
-    # -------------------------------------------------------
+    else:
+        response_message = conversacion_telegram.despachar(sesion, incoming_message, user_number)
+        if response_message is None:
+            response_message = "No te entendí. Intenta de nuevo."
 
-    # Consultas de productos, dimensiones y materiales
-    cursor.execute("SELECT * FROM products;")
-    products = cursor.fetchall()
-    diccionario_productos = {fila[1]: fila[2] for fila in products}
+    if sesion:
+        sesiones.guardar(user_number, sesion)
+    else:
+        sesiones.borrar(user_number)
+    enviador.enviar_mensaje(user_number, response_message)
+    latencia = time.perf_counter() - inicio
+    MENSAJE_SEGUNDOS.observar(latencia, step or "ninguno")
+    logging.info("Mensaje procesado", extra={"chat_id": user_number, "step": step,
+                                            "latencia_ms": round(latencia * 1000, 2)})
 
-    cursor.execute("SELECT * FROM dimensions_volante;")
-    dimensions = cursor.fetchall()
-    diccionario_dimensiones = {fila[1]: fila[2] for fila in dimensions}
+# Historial de cotizaciones (ver historial.py). Los chats de HISTORIAL_CHATS (ids
+# separados por coma) ven todo el libro; los demás solo sus propias cotizaciones.
+HISTORIAL_CHATS = {c.strip() for c in os.getenv("HISTORIAL_CHATS", "").split(",") if c.strip()}
+AYUDA_BUSCAR = ("Uso: /buscar [texto] [cliente:Nombre] [producto:Volante] "
+                "[desde:AAAA-MM-DD] [hasta:AAAA-MM-DD] [pagina:N]\n"
+                "Después envía /reenviar <número> para recibir el PDF.")
 
-    cursor.execute("SELECT * FROM material;")
-    materials = cursor.fetchall()
-    diccionario_material = {fila[1]: (fila[2], fila[3]) for fila in materials}
-    materiales = {i+1: fila[1] for i, fila in enumerate(materials)}
+# Chats de administración (ids separados por coma): pueden usar /perfilar
+ADMIN_CHATS = {c.strip() for c in os.getenv("ADMIN_CHATS", "").split(",") if c.strip()}
 
-    # Flujo de conversación
-    if incoming_message.lower() == "hola":
-        response_message = "¡Hola! Ingresa tu nombre de cliente:"
-        user_data[user_number] = {"step": "ask_nombre"}
-        logging.info(f"Nuevo inicio de conversación con {user_number}")
-    elif user_number in user_data:
-        step = user_data[user_number]["step"]
-        if step == "ask_nombre":
-            client_name = incoming_message.strip()
-            logging.info(f"Nueva cotización para cliente {client_name}")
-            if not client_name:
-                response_message = "El nombre no puede estar vacío. Ingresa tu nombre de cliente:"
-            else:
-                user_data[user_number]["client_name"] = client_name
-                response_message = "Bienvenido\n1. Cotización\n2. Editar cobros adicionales"
-                user_data[user_number]["step"] = "menu"
-                logging.info(f"Cliente {client_name} ingresado por {user_number}")
-        elif step == "ask_quote_name":
-            quote_name = incoming_message.strip()
-            if not quote_name:
-                response_message = "El nombre de la cotización no puede estar vacío. Ingresa el nombre de la cotización:"
-            else:
-                user_data[user_number]["quote_name"] = quote_name
-        # Menú principal
-        elif step == "menu":
-            if incoming_message == "1":
-                texto = "Selecciona el producto:\n"
-                texto += "0. Agregar nuevo producto\n"
-                texto += "\n".join([f"{i+1}. {prod}" for i, prod in enumerate(diccionario_productos.keys())])
-                response_message = texto
-                user_data[user_number]["step"] = "productos"
-            elif incoming_message == "2":
-                response_message = ("Has seleccionado editar cobros adicionales:\n"
-                                    "1. Agregar cobro adicional\n"
-                                    "2. Eliminar cobro adicional\n"
-                                    "3. Ver cobros adicionales existentes")
-                user_data[user_number]["step"] = "admin_charges"
-            else:
-                response_message = "Opción no válida. Envía '1' para Cotización o '2' para Editar cobros adicionales."
-        elif step == "admin_charges":
-            if incoming_message == "1":
-                response_message = "Ingresa el nombre y la descripción separados por coma.\nEj: Pegamento, Especial"
-                user_data[user_number]["step"] = "add_charge"
-            elif incoming_message == "2":
-                charges = obtener_cobros()
-                if charges:
-                    response_message = "Selecciona el ID del cobro a eliminar:\n"
-                    for charge in charges:
-                        response_message += f"{charge[0]}. {charge[1]} - {charge[2]}\n"
-                else:
-                    response_message = "No hay cobros adicionales registrados."
-                user_data[user_number]["step"] = "delete_charge"
-            elif incoming_message == "3":
-                charges = obtener_cobros()
-                if charges:
-                    response_message = "Cobros actuales:\n"
-                    for charge in charges:
-                        response_message += f"{charge[1]} ({charge[2]})\n"
-                else:
-                    response_message = "No hay cobros adicionales registrados."
-                response_message += "\n\nMenú:\n1. Cotización\n2. Editar cobros adicionales"
-                user_data[user_number]["step"] = "menu"
-            else:
-                response_message = "Opción no válida en administración de cobros. Intenta de nuevo."
-        elif step == "add_charge":
-            try:
-                parts = incoming_message.split(",")
-                if len(parts) < 2:
-                    raise ValueError("Faltan datos")
-                nombre = parts[0].strip()
-                descripcion = parts[1].strip()
-                agregar_cobro(nombre, descripcion)
-                response_message = "Cobro agregado correctamente."
-            except Exception as e:
-                logging.error(f"Error al agregar cobro: {e}")
-                response_message = "Formato incorrecto. Intenta de nuevo. Ej: Pegamento, Especial"
-            user_data[user_number]["step"] = "menu"
-        elif step == "delete_charge":
-            try:
-                charge_id = int(incoming_message)
-                eliminar_cobro(charge_id)
-                response_message = "Cobro eliminado correctamente."
-            except Exception as e:
-                logging.error(f"Error al eliminar cobro: {e}")
-                response_message = "Opción inválida. Intenta de nuevo."
-            user_data[user_number]["step"] = "menu"
-        # Flujo de cotización:
-        elif step == "productos":
-            try:
-                opcion = int(incoming_message)
-            except:
-                response_message = "Ingresa una opción válida."
-                return update.message.reply_text(response_message)
-            if opcion == 0:
-                response_message = "Ingresa el nombre del nuevo producto:"
-                user_data[user_number]["step"] = "nuevo_producto"
-            else:
-                product_keys = list(diccionario_productos.keys())
-                if opcion > len(product_keys):
-                    response_message = "Producto no válido."
-                else:
-                    producto = product_keys[opcion - 1]
-                    precio_producto = diccionario_productos[producto]
-                    user_data[user_number]["product"] = (producto, precio_producto)
-                    texto = f"{producto} - \nElige tamaño (dimensional inches):\n"
-                    texto += "0. Agregar nuevo tamaño (Ej: 20x10)\n"
-                    texto += "\n".join([f"{i+1}. {dim}" for i, dim in enumerate(diccionario_dimensiones.keys())])
-                    response_message = texto
-                    user_data[user_number]["step"] = "dimensiones"
-        elif step == "nuevo_producto":
-            new_product_name = incoming_message.strip()
-            cursor.execute("INSERT INTO products (name, price) VALUES (?, ?)", (new_product_name, 0.0))
-            conn.commit()
-            response_message = f"Producto '{new_product_name}' agregado con éxito.\nSelecciona el producto:\n"
-            cursor.execute("SELECT * FROM products;")
-            products = cursor.fetchall()
-            diccionario_productos = {fila[1]: fila[2] for fila in products}
-            texto = "0. Agregar nuevo producto\n"
-            texto += "\n".join([f"{i+1}. {prod}" for i, prod in enumerate(diccionario_productos.keys())])
-            response_message += texto
-            user_data[user_number]["step"] = "productos"
-        elif step == "dimensiones":
-            try:
-                opcion = incoming_message.strip()
-                if opcion == "0":
-                    response_message = "Ingresa el tamaño en formato anchoxalto (Ej: 20x10):"
-                    user_data[user_number]["step"] = "dimension_specific"
-                    return update.message.reply_text(response_message)
-                else:
-                    opcion_int = int(opcion)
-                    dims_list = list(diccionario_dimensiones.keys())
-                    if opcion_int > len(dims_list):
-                        response_message = "Tamaño no válido."
-                    else:
-                        dim = dims_list[opcion_int - 1]
-                        precio_dim = diccionario_dimensiones[dim]
-                        texto = f"Tamaño: {dim} - \nSelecciona material:\n"
-                        texto += "\n".join([f"{i}. {mat}" for i, mat in materiales.items()])
-                        response_message = texto
-                        user_data[user_number].update({"step": "material", "dimensiones": (dim, precio_dim)})
-            except Exception as e:
-                logging.error(f"Error en selección de dimensión: {e}")
-                response_message = "Error, ingresa un tamaño válido."
-        elif step == "dimension_specific":
-            pattern = r'^\s*(\d+(?:\.\d+)?)\s*x\s*(\d+(?:\.\d+)?)\s*$'
-            match = re.fullmatch(pattern, incoming_message)
-            if match:
-                width, height = match.groups()
-                width, height = float(width), float(height)
-                if width <= 0 or height <= 0:
-                    response_message = "Las dimensiones deben ser mayores a 0. Ingresa el tamaño nuevamente (Ej: 20x10):"
-                    return update.message.reply_text(response_message)
-                dim_str = f"{width}x{height}"
-                cursor.execute("INSERT INTO dimensions_volante (dimension, price) VALUES (?, ?)", (dim_str, 0.0))
-                conn.commit()
-                texto = f"Tamaño: {dim_str} - \nSelecciona material:\n"
-                texto += "\n".join([f"{i}. {mat}" for i, mat in enumerate(materiales.values())])
-                response_message = texto
-                user_data[user_number].update({"step": "material", "dimensiones": (dim_str, 0.0)})
-                logging.info(f"Dimensión específica ingresada: {dim_str} por {user_number}")
-            else:
-                response_message = "Formato inválido. Usa el formato 'ancho x alto' (Ej: 20x10)."
-        elif step == "material":
-            try:
-                material = materiales[int(incoming_message)]
-            except Exception as e:
-                response_message = "Selecciona un material válido."
-                return update.message.reply_text(response_message)
-            if material in diccionario_material:
-                precio_mat, medida_mat = diccionario_material[material]
-            else:
-                precio_mat, medida_mat = (0, "0x0")
-            user_data[user_number]["material"] = (material, precio_mat, medida_mat)
-            response_message = "¿Cuántos volantes deseas cotizar? (debe ser mayor a 0)"
-            user_data[user_number]["step"] = "cantidad"
-        elif step == "cantidad":
-            try:
-                cantidad = int(incoming_message)
-                if cantidad <= 0:
-                    response_message = "La cantidad debe ser mayor a 0. Ingresa la cantidad:"
-                    return update.message.reply_text(response_message)
-                user_data[user_number]["cantidad"] = cantidad
-                response_message = "¿Es impresión digital? (si/no):"
-                user_data[user_number]["step"] = "digital"
-            except:
-                response_message = "Ingresa una cantidad válida (número mayor a 0)."
-        # Paso: determinar si es digital y luego preparar cargos adicionales
-        elif step == "digital":
-            if incoming_message.lower() in ["si", "sí", "no"]:
-                # Se guarda True si es digital, False en caso contrario
-                user_data[user_number]["digital"] = (incoming_message.lower() in ["si", "sí"])
-                cursor.execute("SELECT id, name, description FROM additional_charges")
-                additional_list = cursor.fetchall()
-                # Si es digital se eliminan los cargos de "clicks"; si no, se incluyen
-                # print(user_data[user_number]["digital"])
-                if not user_data[user_number]["digital"]:
-                    logging.warning("ENTRO")
-                    print(charge for charge in additional_list if charge[2].lower() != "clicks")
-                    
-                    additional_list = [charge for charge in additional_list if charge[2].lower() != "clicks"]
-                    logging.warning(additional_list)
-                user_data[user_number]["additional_list"] = additional_list
-                user_data[user_number]["current_charge_index"] = 0
-                user_data[user_number]["additional_values"] = []
-                if additional_list:
-                    charge = additional_list[0]
-                    response_message = f"Ingrese el precio para {charge[1]} ({charge[2]}): "
-                    user_data[user_number]["step"] = "ask_additional"
-                else:
-                    response_message = "No hay cargos adicionales. ¿Desea agregar algún costo extra? (si/no):"
-                    user_data[user_number]["step"] = "ask_extra_cost"
-            else:
-                response_message = "Respuesta no válida, ingresa 'si' o 'no'."
-        elif step == "ask_additional":
-            try:
-                price = float(incoming_message)
-                if price < 0:
-                    response_message = "El precio no puede ser negativo. Ingresa un valor >= 0:"
-                    return update.message.reply_text(response_message)
-                additional_values = user_data[user_number].get("additional_values", [])
-                additional_values.append(price)
-                user_data[user_number]["additional_values"] = additional_values
-                current_index = user_data[user_number]["current_charge_index"] + 1
-                additional_list = user_data[user_number]["additional_list"]
-                if current_index < len(additional_list):
-                    user_data[user_number]["current_charge_index"] = current_index
-                    charge = additional_list[current_index]
-                    response_message = f"Ingrese el precio para {charge[1]} ({charge[2]}): "
-                else:
-                    response_message = "Todos los cargos adicionales han sido registrados. ¿Desea agregar algún costo extra? (si/no):"
-                    user_data[user_number]["step"] = "ask_extra_cost"
-            except:
-                response_message = "Ingresa un valor numérico para el precio (valor >= 0)."
-        # Flujo para agregar costos extras (no predefinidos)
-        elif step == "ask_extra_cost":
-            if incoming_message.lower() in ["si", "sí"]:
-                response_message = "Ingresa el monto del costo extra:"
-                user_data[user_number]["step"] = "extra_cost_amount"
-            elif incoming_message.lower() in ["no"]:
-                # EN LUGAR de ir directamente a ask_margin, preguntamos por días hábiles
-                response_message = "¿En cuántos días hábiles requieres la entrega?"
-                user_data[user_number]["step"] = "ask_days"
-            else:
-                response_message = "Respuesta no válida. Ingresa 'si' o 'no'."
-        elif step == "ask_days":
-            try:
-                dias = int(incoming_message)
-                user_data[user_number]["dias_habiles"] = dias
-                response_message = "¿Es servicio tiro-retiro? (si/no):"
-                user_data[user_number]["step"] = "ask_tiro_retiro"
-            except:
-                response_message = "Por favor ingresa un número entero de días hábiles."
-        elif step == "ask_tiro_retiro":
-            if incoming_message.lower() in ["si", "sí"]:
-                response_message = "¿Cuál es el costo extra de tiro-retiro?"
-                user_data[user_number]["step"] = "ask_tiro_retiro_cost"
-            elif incoming_message.lower() in ["no"]:
-                user_data[user_number]["tirretiro_cost"] = 0.0
-                response_message = "Por defecto, el margen de ganancia es del 50%. ¿Desea modificarlo? (si/no):"
-                user_data[user_number]["step"] = "ask_margin"
-            else:
-                response_message = "Respuesta no válida. Ingresa 'si' o 'no'."
-
-        elif step == "ask_tiro_retiro_cost":
-            try:
-                cost_tr = float(incoming_message)
-                user_data[user_number]["tirretiro_cost"] = cost_tr
-                response_message = "Por defecto, el margen de ganancia es del 50%. ¿Desea modificarlo? (si/no):"
-                user_data[user_number]["step"] = "ask_margin"
-            except:
-                response_message = "Ingresa un valor numérico para el costo extra."
-        elif step == "extra_cost_amount":
-            try:
-                extra_cost = float(incoming_message)
-                if extra_cost < 0:
-                    response_message = "El monto no puede ser negativo. Ingresa un valor mayor o igual a 0:"
-                    return update.message.reply_text(response_message)
-                user_data[user_number]["temp_extra_cost"] = extra_cost
-                response_message = "Ingresa la descripción para el costo extra:"
-                user_data[user_number]["step"] = "extra_cost_description"
-            except:
-                response_message = "Ingresa un valor numérico para el costo extra."
-        elif step == "extra_cost_description":
-            extra_cost = user_data[user_number].pop("temp_extra_cost", 0)
-            extra_desc = incoming_message.strip()
-            nombre = f"costo"
-            agregar_cobro(nombre, extra_desc)
-            additional_values = user_data[user_number].get("additional_values", [])
-            additional_values.append(extra_cost)
-            user_data[user_number]["additional_values"] = additional_values
-            response_message = "Costo extra agregado. ¿Desea agregar otro costo extra? (si/no):"
-            user_data[user_number]["step"] = "ask_extra_cost"
-        # Preguntar por el margen justo antes de confirmar
-        elif step == "ask_margin":
-            if incoming_message.lower() in ["si", "sí"]:
-                response_message = "Ingresa el porcentaje de margen de ganancia (ej: 50 para 50%):"
-                user_data[user_number]["step"] = "set_margin"
-            elif incoming_message.lower() in ["no"]:
-                user_data[user_number]["margin"] = 50  # Valor por defecto
-                response_message = "Confirma tu pedido respondiendo 'si' o 'no':"
-                user_data[user_number]["step"] = "confirmacion"
-            else:
-                response_message = "Respuesta no válida. Ingresa 'si' o 'no'."
-        elif step == "set_margin":
-            try:
-                margin_val = float(incoming_message)
-                if margin_val < 0:
-                    response_message = "El margen no puede ser negativo. Ingresa un valor válido:"
-                    return update.message.reply_text(response_message)
-                user_data[user_number]["margin"] = margin_val
-                response_message = "Confirma tu pedido respondiendo 'si' o 'no':"
-                user_data[user_number]["step"] = "confirmacion"
-            except Exception as e:
-                logging.error(f"Error al establecer margen: {e}")
-                response_message = "Por favor, ingresa un número válido para el margen."
-        elif step == "confirmacion":
-            if "si" in incoming_message.lower():
-                cantidad = user_data[user_number]["cantidad"]
-                dim_str, _precio_dim = user_data[user_number]["dimensiones"]
-                flyer_width, flyer_height = parse_dimension(dim_str)
-                if flyer_width <= 0 or flyer_height <= 0:
-                    logging.warning(f"No se pudo parsear la dimensión {dim_str}, se usará 0,0")
-                    flyer_width, flyer_height = (0, 0)
-                material, mat_price, mat_medida = user_data[user_number]["material"]
-                mat_w, mat_h = (0, 0)
-                try:
-                    if "x" in mat_medida:
-                        mw, mh = mat_medida.lower().split("x")
-                        mat_w, mat_h = float(mw), float(mh)
-                        if mat_w <= 0 or mat_h <= 0:
-                            mat_w, mat_h = (0, 0)
-                    else:
-                        mat_w, mat_h = parse_dimension(mat_medida)
-                except:
-                    mat_w, mat_h = (0, 0)
-                flyer_area = flyer_width * flyer_height
-                material_area = mat_w * mat_h
-                if flyer_area <= 0 or material_area <= 0:
-                    flyers_per_sheet = 1
-                else:
-                    flyers_per_sheet = max(math.floor(material_area / flyer_area) - 1, 1)
-                required_sheets = math.ceil(cantidad / flyers_per_sheet) + 2
-                cost_per_sheet = mat_price / 500.0
-                paper_cost = required_sheets * cost_per_sheet
-                dias = user_data[user_number].get("dias_habiles", 1)
-                costo_tr = user_data[user_number].get("tirretiro_cost", 0.0)
-                additional_costs = sum(user_data[user_number].get("additional_values", []))+costo_tr
-                total_cost = paper_cost + additional_costs
-                margin = user_data[user_number].get("margin", 50)
-                final_cost = (total_cost * (1 + margin / 100.0) + costo_tr) * 1.17
-                client_name = user_data[user_number].get("client_name", "Cliente")
-                descripcion_producto = f"{user_data[user_number]['product'][0]}, Tamaño: {dim_str}, Material: {user_data[user_number]['material'][0]}"
-                quote_name = client_name
-                timestamp = time.strftime('%Y%m%d_%H%M%S')
-                quote_folder = f"/var/www/db_serigraph/cotis/{quote_name}_{timestamp}"
-                if not os.path.exists(quote_folder):
-                    os.makedirs(quote_folder)
-                    logging.info(f"Carpeta creada: {quote_folder}")
-                file_path = generar_pdf(client_name, user_data[user_number]["material"][0],
-                                        flyer_width, cantidad, final_cost, descripcion_producto,
-                                        quote_folder,dias)
-                context.bot.send_document(chat_id=user_number, document=open(file_path, 'rb'),
-                                          filename=os.path.basename(file_path))
-                response_message = "¡Cotización generada!"
-                logging.info(f"Cotización generada para {client_name} en carpeta {quote_folder}")
-                del user_data[user_number]
-            elif "no" in incoming_message.lower():
-                response_message = "Cotización cancelada."
-                logging.info(f"Cotización cancelada por {user_number}")
-                del user_data[user_number]
-            else:
-                response_message = "Debes ingresar 'si' o 'no'."
-        else:
-            response_message = "No te entendí. Intenta de nuevo."
+def chat_restringido(chat_id):
+    """
+    None si el chat puede ver todo el historial; si no, su propio id para filtrar.
+    """
+    return None if str(chat_id) in HISTORIAL_CHATS else chat_id
+
+def texto_historial(busqueda):
+    if not busqueda["resultados"]:
+        return "No se encontraron cotizaciones."
+    lineas = [f"#{c['id']} {c['fecha']} {c['cliente']}: {c['descripcion']}, "
+              f"{c['cantidad']} u., {formato_monetario(c['costo_total'])}" for c in busqueda["resultados"]]
+    if busqueda["hay_mas"]:
+        lineas.append(f"Hay más resultados: agrega pagina:{busqueda['pagina'] + 1}")
+    lineas.append("Envía /reenviar <número> para recibir el PDF.")
+    return "\n".join(lineas)
+
+def comando_buscar(update, context):
+    argumentos = update.message.text.partition(" ")[2].strip()
+    if not argumentos:
+        enviador.enviar_mensaje(update.message.chat.id, AYUDA_BUSCAR)
+        return
+    try:
+        filtros = historial.leer_filtros(argumentos)
+        busqueda = historial.buscar(cliente=filtros.get("cliente"), texto=filtros["texto"],
+                                    desde=filtros.get("desde"), hasta=filtros.get("hasta"),
+                                    producto=filtros.get("producto"), pagina=filtros.get("pagina", 1),
+                                    chat_id=chat_restringido(update.message.chat.id))
+    except historial.FiltroInvalido as e:
+        enviador.enviar_mensaje(update.message.chat.id, str(e))
+        return
+    enviador.enviar_mensaje(update.message.chat.id, texto_historial(busqueda))
+
+def reenviar_cotizacion(chat_id, cotizacion):
+    """
+    Envía una cotización del libro sin volver a generarla: por file_id si Telegram ya
+    la tiene y, si no, sube el PDF archivado (solo se regenera si no se archivó).
+    """
+    if cotizacion["clave"] and reenviar_por_file_id(chat_id, cotizacion["clave"]):
+        return
+    pdf_bytes = pdf_de_cotizacion(cotizacion)
+    enviado = enviador.enviar_documento(chat_id, pdf_bytes, nombre_pdf(cotizacion["cliente"])).result()
+    file_id = ((enviado or {}).get("document") or {}).get("file_id")
+    # Un PDF regenerado no es el documento original; solo se guarda el file_id del archivado
+    if file_id and cotizacion["clave"] and cotizacion["pdf_hash"]:
+        db.ejecutar("guardar_file_id", (cotizacion["clave"], file_id, time.time()))
+
+def comando_reenviar(update, context):
+    chat_id = update.message.chat.id
+    argumentos = update.message.text.split()[1:]
+    if not argumentos or not argumentos[0].lstrip("#").isdigit():
+        enviador.enviar_mensaje(chat_id, "Uso: /reenviar <número de cotización>")
+        return
+    cotizacion_id = int(argumentos[0].lstrip("#"))
+    if chat_restringido(chat_id) is None:
+        filas = db.consultar_filas("cotizacion", (cotizacion_id,))
     else:
-        response_message = "Envía 'hola' para comenzar."
-    update.message.reply_text(response_message)
+        filas = db.consultar_filas("cotizacion_de_chat", (cotizacion_id, str(chat_id)))
+    if not filas:
+        enviador.enviar_mensaje(chat_id, f"No se encontró la cotización #{cotizacion_id}.")
+        return
+    try:
+        reenviar_cotizacion(chat_id, filas[0])
+    except admision.Ocupado:
+        enviador.enviar_mensaje(chat_id, "Estamos generando muchos PDFs en este momento; "
+                                         "intenta de nuevo en unos segundos.")
+        return
+    logging.info(f"Cotización {cotizacion_id} reenviada a {chat_id}")
+
+def etiqueta_perfil(mensaje):
+    """
+    Comando o paso de la conversación en que estaba el chat (solo se lee al perfilar).
+    """
+    texto = mensaje.text or ""
+    if texto.startswith("/"):
+        return texto.split()[0].split("@")[0]
+    sesion = sesiones.obtener(mensaje.chat.id)
+    return (sesion or {}).get("step") or "ninguno"
+
+def comando_perfilar(update, context):
+    """
+    /perfilar [minutos] [chat_id]: perfila los mensajes y PDFs del chat (por defecto el
+    propio, 10 minutos); /perfilar no quita la marca. La marca vale en el proceso que
+    recibe el comando.
+    """
+    chat_id = update.message.chat.id
+    if str(chat_id) not in ADMIN_CHATS:
+        enviador.enviar_mensaje(chat_id, "No tienes permiso para usar /perfilar.")
+        return
+    argumentos = update.message.text.split()[1:]
+    if argumentos and argumentos[0].lower() in ("no", "off"):
+        minutos = 0
+    elif argumentos and argumentos[0].isdigit():
+        minutos = int(argumentos[0])
+    else:
+        minutos = 10
+    objetivo = int(argumentos[1]) if len(argumentos) > 1 and argumentos[1].lstrip("-").isdigit() else chat_id
+    perfilador.marcar(objetivo, minutos)
+    logging.info(f"Perfilado de {objetivo} por {minutos} minutos, pedido por {chat_id}")
+    if minutos:
+        enviador.enviar_mensaje(chat_id, f"Perfilando el chat {objetivo} por {minutos} minutos.")
+    else:
+        enviador.enviar_mensaje(chat_id, f"Perfilado del chat {objetivo} desactivado.")
+
+# Cotización rápida: un solo mensaje, con el precio de la matriz (ver matriz_precios.py)
+COTIZACIONES_RAPIDAS = metricas.Contador("seri_cotizaciones_rapidas_total",
+                                         "Cotizaciones rápidas por origen del precio", "origen")
+AYUDA_RAPIDA = ("Uso:\n/rapida: repite tu última cotización con los precios de hoy\n"
+                "/rapida <cantidad>: la repite con otra cantidad\n"
+                "/rapida <producto>, <tamaño>, <material>, <cantidad>: cotiza sin cobros adicionales "
+                "y con margen del 50%. Producto, tamaño y material pueden ser el número del menú "
+                "o el inicio del nombre.")
+
+def elegir_opcion(opciones, texto):
+    """
+    Opción del catálogo por número de menú, nombre exacto o inicio único del nombre.
+    """
+    texto = texto.strip()
+    opciones = list(opciones)
+    if texto.isdigit():
+        indice = int(texto)
+        return opciones[indice - 1] if 1 <= indice <= len(opciones) else None
+    exactas = [o for o in opciones if o.lower() == texto.lower()]
+    if exactas:
+        return exactas[0]
+    prefijos = [o for o in opciones if o.lower().startswith(texto.lower())]
+    return prefijos[0] if len(prefijos) == 1 else None
+
+def pedido_rapido(chat_id, argumentos, catalogo, nombre_chat):
+    """
+    Datos de la cotización rápida a partir de los argumentos de /rapida. Devuelve
+    (datos, None) o (None, mensaje de error).
+    """
+    filas = db.consultar_filas("ultima_cotizacion_chat", (str(chat_id),))
+    ultima = filas[0] if filas else None
+    if "," in argumentos:
+        partes = argumentos.split(",")
+        if len(partes) != 4 or not partes[3].strip().isdigit():
+            return None, AYUDA_RAPIDA
+        producto = elegir_opcion(catalogo["productos"], partes[0])
+        dimension = elegir_opcion(catalogo["dimensiones"], partes[1])
+        material = elegir_opcion(catalogo["material"], partes[2])
+        if not (producto and dimension and material):
+            return None, "No encontré ese producto, tamaño o material en el catálogo.\n" + AYUDA_RAPIDA
+        return {"cliente": ultima["cliente"] if ultima else nombre_chat, "producto": producto,
+                "dimension": dimension, "material": material, "cantidad": int(partes[3]),
+                "adicionales": [], "margen": 50, "tiro_retiro": 0.0, "dias": 1}, None
+    if argumentos and not argumentos.isdigit():
+        return None, AYUDA_RAPIDA
+    if ultima is None:
+        return None, "Todavía no tienes cotizaciones para repetir.\n" + AYUDA_RAPIDA
+    if ultima["material"] not in catalogo["material"]:
+        return None, f"El material {ultima['material']} ya no está en el catálogo."
+    # Se repiten los términos de la última cotización: cobros, margen, tiro-retiro y días
+    return {"cliente": ultima["cliente"], "producto": ultima["producto"], "dimension": ultima["dimension"],
+            "material": ultima["material"], "cantidad": int(argumentos or ultima["cantidad"]),
+            "adicionales": json.loads(ultima["adicionales"] or "[]"), "margen": ultima["margen"],
+            "tiro_retiro": ultima["tiro_retiro"] or 0.0, "dias": ultima["dias"] or 1}, None
 
-dispatcher.add_handler(MessageHandler(Filters.text, telegram_webhook))
+def comando_rapida(update, context):
+    chat_id = update.message.chat.id
+    catalogo = obtener_catalogo()
+    nombre_chat = getattr(update.message.from_user, "first_name", None) or "Cliente"
+    datos, error = pedido_rapido(chat_id, update.message.text.partition(" ")[2].strip(), catalogo, nombre_chat)
+    if error:
+        enviador.enviar_mensaje(chat_id, error)
+        return
+    if datos["cantidad"] <= 0:
+        enviador.enviar_mensaje(chat_id, "La cantidad debe ser mayor a 0.")
+        return
+    mat_price, mat_medida = catalogo["material"][datos["material"]]
+    fila = matriz_precios.buscar(datos["dimension"], datos["material"], datos["cantidad"], mat_price, mat_medida)
+    if fila is not None:
+        precio = matriz_precios.precio(fila, datos["adicionales"], datos["margen"], datos["tiro_retiro"])
+        COTIZACIONES_RAPIDAS.incrementar("matriz")
+    else:
+        # Cantidad fuera de las estándar o matriz sin sincronizar: misma fórmula, en el momento
+        precio = cotizar(datos["dimension"], mat_price, mat_medida, datos["cantidad"],
+                         adicionales=datos["adicionales"], margin=datos["margen"], costo_tr=datos["tiro_retiro"])
+        COTIZACIONES_RAPIDAS.incrementar("calculo")
+    trabajo = armar_trabajo(chat_id, datos["cliente"], datos["producto"], datos["dimension"], datos["material"],
+                            mat_price, mat_medida, datos["cantidad"], datos["dias"], datos["adicionales"],
+                            datos["margen"], datos["tiro_retiro"], precio)
+    texto = f"{trabajo['descripcion_producto']}, {datos['cantidad']} u.: {formato_monetario(precio['final_cost'])}"
+    if encolar_cotizacion(trabajo):
+        texto += "\nGenerando tu cotización, te la enviaremos en un momento."
+    else:
+        texto += "\nEstamos generando muchas cotizaciones; envía /rapida de nuevo en unos segundos para recibir el PDF."
+    enviador.enviar_mensaje(chat_id, texto)
 
-@app.route(f"/{TOKEN}", methods=['POST'])
+# El webhook solo encola; los updates se procesan en orden por chat (ver ingesta.py)
+ingesta = PorProceso(lambda: Ingesta(procesar_update))
+UPDATES = metricas.Contador("seri_updates_total", "Updates recibidos en el webhook por resultado", "resultado")
+
+@rutas.route(f"/{TOKEN}", methods=['POST'])
 def webhook_telegram():
-    update = Update.de_json(request.get_json(force=True), bot)
-    dispatcher.process_update(update)
+    from telegram import Update
+
+    update = Update.de_json(request.get_json(force=True), obtener_bot())
+    chat = update.effective_chat
+    chat_id = chat.id if chat else None
+    # Un reintento de un update ya aceptado no pasa por la admisión: no gasta tokens
+    # del chat ni provoca avisos de "ocupado"
+    if ingesta.visto(update.update_id):
+        UPDATES.incrementar(DUPLICADO)
+        logging.info(f"Update {update.update_id} repetido, se ignora")
+        return 'ok'
+    decision = control_admision.admitir(chat_id, ingesta.pendientes(), enviador.pendientes())
+    if decision != admision.ADMITIDO:
+        UPDATES.incrementar(decision)
+        if chat_id is not None and control_admision.avisar(chat_id):
+            logging.warning(f"Update {update.update_id} de {chat_id} descartado ({decision})")
+            enviador.enviar_mensaje(chat_id, admision.AVISO_LIMITADO if decision == admision.LIMITADO
+                                    else admision.AVISO_OCUPADO)
+        # 200 aunque se descarte: un 503 haría que Telegram lo reintente y sume carga
+        return 'ok'
+    resultado = ingesta.recibir(update.update_id, chat_id, update)
+    UPDATES.incrementar(resultado)
+    if resultado == DUPLICADO:
+        logging.info(f"Update {update.update_id} repetido, se ignora")
+    elif resultado == LLENO:
+        # Telegram reintenta los updates que no reciben 2xx
+        logging.warning(f"Ingesta llena, se rechaza el update {update.update_id}")
+        return 'busy', 503
     return 'ok'
 
-@app.route('/temp_pdfs/<path:filename>')
-def descargar_pdf(filename):
-    return send_from_directory(TEMP_PDF_DIR, filename, as_attachment=True)
+# Rutas de administración (lote, historial y perfiles); sin LOTE_API_KEY quedan deshabilitadas
+LOTE_API_KEY = os.getenv("LOTE_API_KEY")
+
+def api_autorizada():
+    clave = request.headers.get("X-Api-Key", "")
+    return bool(LOTE_API_KEY) and hmac.compare_digest(clave, LOTE_API_KEY)
+
+@rutas.route('/cotizaciones/lote', methods=['POST'])
+def cotizaciones_lote():
+    """
+    Recibe un lote de cotizaciones (JSON o CSV) y devuelve un ZIP con todos los PDFs.
+    """
+    if not api_autorizada():
+        return jsonify({"error": "No autorizado"}), 403
+    try:
+        if "archivo" in request.files:
+            filas = lote.leer_especificaciones(request.files["archivo"].read(), "csv")
+        elif request.mimetype == "text/csv":
+            filas = lote.leer_especificaciones(request.get_data(), "csv")
+        else:
+            filas = lote.leer_especificaciones(request.get_json(force=True), "json")
+        especificaciones = lote.validar(filas, obtener_catalogo())
+    except lote.LoteInvalido as e:
+        return jsonify({"error": str(e), "errores": e.errores}), 400
+    totales = lote.precios_lote(especificaciones)
+    logging.info(f"Lote de {len(especificaciones)} cotizaciones recibido")
+    return Response(lote.generar_zip(especificaciones, totales), mimetype="application/zip",
+                    headers={"Content-Disposition": "attachment; filename=cotizaciones.zip"})
+
+@rutas.route('/cotizaciones/historial')
+def historial_cotizaciones():
+    """
+    Busca en el libro: ?cliente=prefijo&q=texto&producto=&desde=&hasta=&pagina=&por_pagina=
+    """
+    if not api_autorizada():
+        return jsonify({"error": "No autorizado"}), 403
+    argumentos = request.args
+    try:
+        busqueda = historial.buscar(cliente=argumentos.get("cliente"), texto=argumentos.get("q"),
+                                    desde=argumentos.get("desde"), hasta=argumentos.get("hasta"),
+                                    producto=argumentos.get("producto"),
+                                    pagina=argumentos.get("pagina", 1, type=int),
+                                    por_pagina=argumentos.get("por_pagina", historial.POR_PAGINA, type=int))
+    except historial.FiltroInvalido as e:
+        return jsonify({"error": str(e)}), 400
+    for cotizacion in busqueda["resultados"]:
+        cotizacion["url"] = descargas.url_descarga(cotizacion["id"])
+    return jsonify(busqueda)
+
+# Descarga de cotizaciones por id: con enlace firmado (ver descargas.py) o X-Api-Key.
+# Los PDF archivados no cambian nunca (el libro solo agrega filas), así que el hash
+# sirve de ETag fuerte y el navegador puede guardarlos mucho tiempo.
+DESCARGAS_MAX_AGE = int(os.getenv("DESCARGAS_MAX_AGE", str(7 * 24 * 3600)))
+DESCARGAS = metricas.Contador("seri_descargas_total", "Descargas de cotizaciones por código HTTP", "codigo")
+
+@rutas.route('/cotizaciones/<int:cotizacion_id>.pdf')
+def descargar_cotizacion(cotizacion_id):
+    if not (descargas.verificar(cotizacion_id, request.args.get("exp"), request.args.get("firma"))
+            or api_autorizada()):
+        return jsonify({"error": "Enlace inválido o vencido"}), 403
+    filas = db.consultar_filas("cotizacion", (cotizacion_id,))
+    if not filas:
+        return jsonify({"error": "Cotización no encontrada"}), 404
+    cotizacion = filas[0]
+    nombre = f"cotizacion_{cotizacion_id}.pdf"
+    ruta = almacen_pdf.ruta(cotizacion["pdf_hash"]) if cotizacion["pdf_hash"] else None
+    if ruta and os.path.exists(ruta):
+        # Con una ruta, send_file entrega el archivo por wsgi.file_wrapper (sendfile en gunicorn)
+        respuesta = send_file(ruta, mimetype="application/pdf", as_attachment=True, download_name=nombre,
+                              conditional=True, etag=cotizacion["pdf_hash"], max_age=DESCARGAS_MAX_AGE)
+    else:
+        # No se archivó: se regenera (la caché de render lo mantiene igual durante el día)
+        try:
+            pdf_bytes = pdf_de_cotizacion(cotizacion)
+        except admision.Ocupado:
+            DESCARGAS.incrementar(503)
+            return jsonify({"error": "Ocupado, intenta de nuevo"}), 503, {"Retry-After": "5"}
+        respuesta = send_file(io.BytesIO(pdf_bytes), mimetype="application/pdf", as_attachment=True,
+                              download_name=nombre, conditional=True,
+                              etag=hashlib.sha256(pdf_bytes).hexdigest(), max_age=DESCARGAS_MAX_AGE)
+    # Datos de un cliente: solo la caché del navegador, no la de proxies compartidos
+    respuesta.cache_control.public = False
+    respuesta.cache_control.private = True
+    respuesta.cache_control.immutable = bool(cotizacion["pdf_hash"])
+    DESCARGAS.incrementar(respuesta.status_code)
+    return respuesta
+
+# Indicadores que se calculan al pedir /metrics
+# (con lambda: leer sesiones.activas aquí crearía el almacén al importar)
+metricas.Indicador("seri_sesiones_activas", "Sesiones de conversación sin expirar", lambda: sesiones.activas())
+metricas.Indicador("seri_cola_cotizaciones", "Cotizaciones esperando un trabajador", cola_cotizaciones.qsize)
+metricas.Indicador("seri_ingesta_pendientes", "Updates aceptados sin procesar", lambda: ingesta.pendientes())
+metricas.Indicador("seri_envios_pendientes", "Envíos a Telegram en cola", lambda: enviador.pendientes())
+metricas.Indicador("seri_ingesta_chats_activos", "Chats con updates en proceso", lambda: ingesta.chats_activos())
+metricas.Indicador("seri_cache_pdf_aciertos_total", "Aciertos de la caché de PDFs",
+                   lambda: cache_pdf.estadisticas()["aciertos"], tipo="counter")
+metricas.Indicador("seri_cache_pdf_fallos_total", "Fallos de la caché de PDFs",
+                   lambda: cache_pdf.estadisticas()["fallos"], tipo="counter")
+metricas.Indicador("seri_logs_descartados_total", "Registros de log descartados por cola llena",
+                   lambda: registro.ColaSinBloqueo.descartados, tipo="counter")
+
+@rutas.route('/metrics')
+def exportar_metricas():
+    return Response(metricas.exportar(), mimetype="text/plain; version=0.0.4")
+
+@rutas.route('/perfiles')
+def resumen_perfiles():
+    """
+    Funciones con más tiempo propio por tipo (mensaje, pdf) y paso: ?top=15&tipo=mensaje
+    """
+    if not api_autorizada():
+        return jsonify({"error": "No autorizado"}), 403
+    top = request.args.get("top", "15")
+    return jsonify(perfilador.resumen(int(top) if top.isdigit() else 15, request.args.get("tipo")))
+
+@rutas.route('/pasos/tiempos')
+def tiempos_pasos():
+    return jsonify(conversacion_telegram.tiempos())
+
+def _precargar_plantilla():
+    try:
+        cargar_plantilla()
+    except Exception as e:
+        logging.error(f"No se pudo precargar la plantilla de cotización: {e}")
+
+def crear_app():
+    """
+    Fábrica de la aplicación: configura el logging y registra las rutas. Para gunicorn
+    la entrada es "app:crear_app()" (o "app:app", que la llama con el primer acceso).
+    Con PRECARGAR_PLANTILLA=1 el membrete (y ReportLab) se carga en segundo plano
+    para que la primera cotización no pague ese costo.
+    """
+    # Configuración de logging: cola + JSON + rotación (ver registro.py)
+    registro.configurar()
+    nueva = Flask(__name__)
+    nueva.register_blueprint(rutas)
+    if PRECARGAR_PLANTILLA:
+        threading.Thread(target=_precargar_plantilla, name="plantilla", daemon=True).start()
+    return nueva
+
+_app = None
+
+def __getattr__(nombre):
+    # "app:app" sigue funcionando, pero la app se arma al pedirla y no al importar
+    global _app
+    if nombre == "app":
+        if _app is None:
+            _app = crear_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {nombre!r}")
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    crear_app().run(debug=True)
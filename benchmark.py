@@ -0,0 +1,340 @@
+"""
+Benchmark del flujo de cotización.
+
+Reproduce conversaciones completas (hola → nombre → menú → producto → tamaño →
+material → cantidad → cobros → margen → confirmación) contra una base SQLite en
+memoria y una Bot API local (stub_telegram.py), y mide:
+
+- latencia por paso de telegram_webhook (p50/p90/p99/max),
+- mensajes por segundo del enviador (envios.py) contra envíos uno por uno, con
+  latencia de red simulada en el stub,
+- PDFs por segundo de generar_pdf y costo de parse_dimension / cotizar / cotizar_lote,
+- consultas SQL por mensaje y RSS máximo del proceso,
+- tiempo de `import app` en un proceso limpio contra un presupuesto
+  (--presupuesto-import-ms); si se pasa o si la importación carga un módulo
+  pesado que debería ser diferido, el benchmark termina con código 1.
+
+Los resultados se escriben en JSON para comparar entre versiones:
+
+    python benchmark.py --conversaciones 200 --pdfs 300 --salida bench_results.json
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+import logging
+import resource
+import sqlite3
+import platform
+import subprocess
+from collections import defaultdict
+
+BENCH_DB = "file:bench_seri?mode=memory&cache=shared"
+BENCH_SESIONES = "file:bench_sesiones?mode=memory&cache=shared"
+
+# Módulos que app.py solo debe cargar con el primer uso, nunca al importarse
+MODULOS_DIFERIDOS = ("reportlab", "PIL", "telegram", "numpy", "urllib3")
+
+CATALOGO = """
+CREATE TABLE products (id INTEGER PRIMARY KEY, name TEXT, price REAL);
+CREATE TABLE dimensions_volante (id INTEGER PRIMARY KEY, dimension TEXT, price REAL);
+CREATE TABLE material (id INTEGER PRIMARY KEY, name TEXT, price REAL, medida TEXT);
+CREATE TABLE additional_charges (id INTEGER PRIMARY KEY, name TEXT, description TEXT);
+INSERT INTO products (name, price) VALUES ('Volante', 0), ('Afiche', 0), ('Tarjeta', 0);
+INSERT INTO dimensions_volante (dimension, price) VALUES
+    ('carta 8.5x11', 0), ('media carta 8.5x5.5', 0), ('4x6', 0), ('2x3.5', 0);
+INSERT INTO material (name, price, medida) VALUES
+    ('Bond 80', 450, '26x40'), ('Couche 100', 900, '26x40'), ('Husky', 1200, '18x24');
+INSERT INTO additional_charges (name, description) VALUES
+    ('Impresión', 'clicks'), ('Corte', 'guillotina'), ('Empaque', 'bolsa');
+"""
+
+
+def percentiles(muestras):
+    if not muestras:
+        return {}
+    orden = sorted(muestras)
+
+    def p(q):
+        return orden[min(int(q * len(orden)), len(orden) - 1)] * 1000
+    return {
+        "n": len(orden),
+        "p50_ms": round(p(0.50), 3),
+        "p90_ms": round(p(0.90), 3),
+        "p99_ms": round(p(0.99), 3),
+        "max_ms": round(orden[-1] * 1000, 3),
+    }
+
+
+def preparar_entorno(tmp):
+    """
+    Variables de entorno y fixtures que app.py lee al importarse.
+    """
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:BENCHMARK")
+    os.environ["SERI_DB"] = BENCH_DB
+    os.environ["SESIONES_DB"] = BENCH_SESIONES
+    os.environ["SESIONES_BACKEND"] = "sqlite"
+    os.environ["ARCHIVAR_COTIZACIONES"] = "0"
+    os.environ["SERI_COTIS_DIR"] = tmp
+    # Sin límites de tasa: el guion manda los mensajes de un chat sin pausas
+    os.environ["ENVIOS_POR_SEGUNDO"] = "1000000"
+    os.environ["ENVIOS_POR_CHAT"] = "1000000"
+    os.environ["ENVIOS_RAFAGA_CHAT"] = "1000000"
+    # Ni cuotas por chat (admision.py): se mide la capacidad, no el control de admisión
+    os.environ.setdefault("ADMISION_POR_CHAT", "1000000")
+    os.environ.setdefault("ADMISION_RAFAGA", "1000000")
+    os.environ.setdefault("ADMISION_COTIZACIONES_POR_MINUTO", "1000000")
+    os.environ.setdefault("ADMISION_RAFAGA_COTIZACIONES", "1000000")
+    logo = os.path.join(tmp, "seri.png")
+    from PIL import Image
+    Image.new("RGB", (1200, 780), (230, 40, 40)).save(logo)
+    os.environ["SERI_LOGO"] = logo
+    # app.py configura logging a un archivo del servidor; con un handler previo no lo hace
+    logging.basicConfig(level=logging.WARNING, handlers=[logging.NullHandler()])
+
+    # Mantener viva la base en memoria compartida mientras dure el benchmark
+    fijas = [sqlite3.connect(BENCH_DB, uri=True), sqlite3.connect(BENCH_SESIONES, uri=True)]
+    fijas[0].executescript(CATALOGO)
+    return fijas
+
+
+class ContadorSQL:
+    def __init__(self):
+        self.total = 0
+
+    def __call__(self, sentencia):
+        self.total += 1
+
+
+class _Chat:
+    def __init__(self, chat_id):
+        self.id = chat_id
+
+
+class _Mensaje:
+    def __init__(self, chat_id, texto):
+        self.chat = _Chat(chat_id)
+        self.text = texto
+
+
+class _Update:
+    def __init__(self, chat_id, texto):
+        self.message = _Mensaje(chat_id, texto)
+
+
+def guion(cobros, cliente):
+    # Una cotización completa; se responde un precio por cada cobro adicional
+    return (["hola", cliente, "1", "1", "1", "1", "1000", "si"]
+            + ["10"] * cobros
+            + ["no", "3", "no", "no", "si"])
+
+
+def medir_conversaciones(app, contador, conversaciones):
+    cobros = len(app.obtener_cobros())
+    por_paso = defaultdict(list)
+    consultas = []
+    inicio = time.perf_counter()
+    for n in range(conversaciones):
+        chat_id = 100000 + n
+        # Un cliente distinto por conversación para que cada una genere su PDF
+        for texto in guion(cobros, f"Cliente {n}"):
+            sesion = app.sesiones.obtener(chat_id)
+            paso = "hola" if texto == "hola" else (sesion or {}).get("step", "sin_sesion")
+            antes = contador.total
+            t0 = time.perf_counter()
+            app.telegram_webhook(_Update(chat_id, texto), None)
+            por_paso[paso].append(time.perf_counter() - t0)
+            consultas.append(contador.total - antes)
+    app.cola_cotizaciones.join()
+    app.enviador.esperar_vacio()
+    duracion = time.perf_counter() - inicio
+    todos = [t for tiempos in por_paso.values() for t in tiempos]
+    return {
+        "conversaciones": conversaciones,
+        "mensajes": len(todos),
+        "duracion_s": round(duracion, 3),
+        "conversaciones_por_s": round(conversaciones / duracion, 2),
+        "latencia_total": percentiles(todos),
+        "latencia_por_paso": {paso: percentiles(t) for paso, t in por_paso.items()},
+        "sql_por_mensaje": round(sum(consultas) / len(consultas), 3),
+        "sql_total": sum(consultas),
+    }
+
+
+def medir_pdfs(app, cantidad):
+    tiempos = []
+    inicio = time.perf_counter()
+    for i in range(cantidad):
+        t0 = time.perf_counter()
+        app.generar_pdf("Cliente Benchmark", "Bond 80", 8.5, 1000 + i, 1234.56,
+                        "Volante, Tamaño: carta 8.5x11, Material: Bond 80", None, 3, en_memoria=True)
+        tiempos.append(time.perf_counter() - t0)
+    duracion = time.perf_counter() - inicio
+    return {"pdfs": cantidad, "pdfs_por_s": round(cantidad / duracion, 2), "latencia": percentiles(tiempos)}
+
+
+def medir_arranque(presupuesto_ms, repeticiones=5):
+    """
+    Importa app.py en procesos nuevos (sin caché de módulos) y se queda con el menor
+    tiempo, que es el menos afectado por el ruido de la máquina.
+    """
+    directorio = os.path.dirname(os.path.abspath(__file__))
+    codigo = (
+        "import sys, time, json\n"
+        "t0 = time.perf_counter()\n"
+        "import app\n"
+        "app.app\n"
+        "ms = (time.perf_counter() - t0) * 1000\n"
+        f"cargados = [m for m in {MODULOS_DIFERIDOS!r} if m in sys.modules]\n"
+        "print(json.dumps({'ms': ms, 'cargados': cargados}))\n"
+    )
+    entorno = dict(os.environ, SERI_LOG_FILE=os.path.join(tempfile.gettempdir(), "seri_bench_import.log"))
+    tiempos = []
+    cargados = set()
+    for _ in range(repeticiones):
+        salida = subprocess.run([sys.executable, "-c", codigo], cwd=directorio, env=entorno,
+                                capture_output=True, text=True, check=True)
+        datos = json.loads(salida.stdout.strip().splitlines()[-1])
+        tiempos.append(datos["ms"])
+        cargados.update(datos["cargados"])
+    import_ms = min(tiempos)
+    return {
+        "import_ms": round(import_ms, 1),
+        "presupuesto_ms": presupuesto_ms,
+        "modulos_pesados_cargados": sorted(cargados),
+        "dentro_del_presupuesto": import_ms <= presupuesto_ms and not cargados,
+    }
+
+
+def medir_envios(mensajes, chats, latencia_ms):
+    """
+    Mensajes por segundo contra un stub con `latencia_ms` por llamada: uno por uno
+    (como reply_text en el hilo del webhook) y con el enviador repartido en `chats`.
+    Los límites de tasa se levantan para medir solo el transporte.
+    """
+    import envios
+    from stub_telegram import StubTelegram
+
+    stub = StubTelegram(latencia_ms=latencia_ms)
+    url = stub.iniciar()
+    enviador = envios.Enviador("123456:BENCHMARK", url=url, por_segundo=1e6, por_chat=1e6, rafaga_chat=1e6)
+    secuenciales = max(mensajes // 10, 1)
+    t0 = time.perf_counter()
+    for i in range(secuenciales):
+        enviador.llamar("sendMessage", {"chat_id": i % chats, "text": "hola"})
+    secuencial_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    futuros = [enviador.enviar_mensaje(i % chats, "hola") for i in range(mensajes)]
+    for futuro in futuros:
+        futuro.result()
+    pool_s = time.perf_counter() - t0
+    stub.detener()
+    return {
+        "latencia_stub_ms": latencia_ms,
+        "chats": chats,
+        "hilos": enviador.hilos,
+        "secuencial_por_s": round(secuenciales / secuencial_s, 1),
+        "enviador_por_s": round(mensajes / pool_s, 1),
+    }
+
+
+def medir_precios(iteraciones):
+    import precios
+    dims = ["carta 8.5x11", "20x30", "4 x 6", "oficio 8.5x14", "sin medida"]
+
+    t0 = time.perf_counter()
+    for i in range(iteraciones):
+        precios.parse_dimension(dims[i % len(dims)])
+    parse_us = (time.perf_counter() - t0) / iteraciones * 1e6
+
+    t0 = time.perf_counter()
+    for i in range(iteraciones):
+        precios.cotizar(dims[i % len(dims)], 450, "26x40", 1000 + i, [10, 5], 50, 0.0)
+    cotizar_us = (time.perf_counter() - t0) / iteraciones * 1e6
+
+    n = iteraciones * 10
+    t0 = time.perf_counter()
+    precios.cotizar_lote([dims[i % len(dims)] for i in range(n)], [450] * n, ["26x40"] * n,
+                         list(range(1, n + 1)), [15] * n, [50] * n, [0] * n)
+    lote_s = time.perf_counter() - t0
+    return {
+        "parse_dimension_us": round(parse_us, 3),
+        "cotizar_us": round(cotizar_us, 3),
+        "cotizar_lote_variantes": n,
+        "cotizar_lote_variantes_por_s": round(n / lote_s, 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark del flujo de cotización")
+    parser.add_argument("--conversaciones", type=int, default=50)
+    parser.add_argument("--pdfs", type=int, default=100)
+    parser.add_argument("--iteraciones", type=int, default=10000)
+    parser.add_argument("--salida", default="bench_results.json")
+    parser.add_argument("--presupuesto-import-ms", type=float, default=150.0)
+    parser.add_argument("--mensajes", type=int, default=2000)
+    parser.add_argument("--latencia-telegram-ms", type=float, default=20.0)
+    args = parser.parse_args(argv)
+
+    tmp = tempfile.mkdtemp(prefix="seri_bench_")
+    fijas = preparar_entorno(tmp)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from stub_telegram import StubTelegram
+    stub = StubTelegram()
+    os.environ["TELEGRAM_API_URL"] = stub.iniciar()
+    arranque = medir_arranque(args.presupuesto_import_ms)
+
+    import db
+    contador = ContadorSQL()
+    conectar_original = db.conectar
+
+    def conectar_con_conteo(ruta, *a, **kw):
+        conn = conectar_original(ruta, *a, **kw)
+        conn.set_trace_callback(contador)
+        return conn
+    db.conectar = conectar_con_conteo
+
+    t0 = time.perf_counter()
+    import app
+    import_s = time.perf_counter() - t0
+    app.cargar_plantilla()
+
+    resultados = {
+        "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "import_app_s": round(import_s, 3),
+        "arranque": arranque,
+        "conversacion": medir_conversaciones(app, contador, args.conversaciones),
+        "envios": medir_envios(args.mensajes, 100, args.latencia_telegram_ms),
+        "pdf": medir_pdfs(app, args.pdfs),
+        "precios": medir_precios(args.iteraciones),
+        "documentos_subidos": stub.documentos,
+        "documentos_reenviados_por_file_id": stub.reenviados,
+        # ru_maxrss viene en KB en Linux
+        "rss_max_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    with open(args.salida, "w") as f:
+        json.dump(resultados, f, indent=2, ensure_ascii=False)
+
+    conv = resultados["conversacion"]
+    print(f"Conversaciones: {conv['conversaciones']} ({conv['conversaciones_por_s']}/s), "
+          f"mensaje p50 {conv['latencia_total']['p50_ms']} ms, p99 {conv['latencia_total']['p99_ms']} ms, "
+          f"{conv['sql_por_mensaje']} SQL/mensaje")
+    env = resultados["envios"]
+    print(f"Envíos con {env['latencia_stub_ms']} ms de red: {env['secuencial_por_s']}/s uno por uno, "
+          f"{env['enviador_por_s']}/s con el enviador")
+    print(f"PDFs: {resultados['pdf']['pdfs_por_s']}/s, RSS máx {resultados['rss_max_mb']} MB")
+    print(f"import app: {arranque['import_ms']} ms (presupuesto {arranque['presupuesto_ms']} ms)"
+          + (f", carga {', '.join(arranque['modulos_pesados_cargados'])}" if arranque["modulos_pesados_cargados"] else ""))
+    print(f"Resultados en {args.salida}")
+    stub.detener()
+    for conn in fijas:
+        conn.close()
+    return resultados
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main()["arranque"]["dentro_del_presupuesto"] else 1)
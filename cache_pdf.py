@@ -0,0 +1,103 @@
+import os
+import json
+import hashlib
+import logging
+import tempfile
+import threading
+
+# Caché en disco de PDFs ya generados, direccionada por el hash de sus datos.
+# Los archivos se reparten en subcarpetas por los dos primeros caracteres del hash
+# y se expulsan los menos usados (por mtime) cuando se pasa del tamaño máximo.
+
+
+def clave_canonica(*datos):
+    """
+    Hash estable de una lista de datos (textos y números) serializados como JSON.
+    """
+    texto = json.dumps(list(datos), ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+
+class CachePDF:
+    def __init__(self, directorio, max_bytes):
+        self.directorio = directorio
+        self.max_bytes = max_bytes
+        self.aciertos = 0
+        self.fallos = 0
+        self._bytes = None  # se calcula al primer uso
+        self._lock = threading.Lock()
+
+    def _ruta(self, clave):
+        return os.path.join(self.directorio, clave[:2], f"{clave}.pdf")
+
+    def obtener(self, clave):
+        ruta = self._ruta(clave)
+        try:
+            with open(ruta, "rb") as f:
+                datos = f.read()
+            os.utime(ruta)  # marca de uso para la expulsión LRU
+        except OSError:
+            with self._lock:
+                self.fallos += 1
+            return None
+        with self._lock:
+            self.aciertos += 1
+        return datos
+
+    def guardar(self, clave, datos):
+        ruta = self._ruta(clave)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        # Escritura atómica: otro proceso nunca lee un PDF a medias
+        fd, temporal = tempfile.mkstemp(dir=os.path.dirname(ruta), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(datos)
+        os.replace(temporal, ruta)
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = self._medir()
+            else:
+                self._bytes += len(datos)
+            if self._bytes > self.max_bytes:
+                self._expulsar()
+
+    def _archivos(self):
+        for carpeta, _, nombres in os.walk(self.directorio):
+            for nombre in nombres:
+                if nombre.endswith(".pdf"):
+                    ruta = os.path.join(carpeta, nombre)
+                    try:
+                        info = os.stat(ruta)
+                    except OSError:
+                        continue
+                    yield info.st_mtime, info.st_size, ruta
+
+    def _medir(self):
+        return sum(tamano for _, tamano, _ in self._archivos())
+
+    def _expulsar(self):
+        # Deja la caché al 90% para no expulsar en cada escritura
+        objetivo = self.max_bytes * 0.9
+        archivos = sorted(self._archivos())
+        total = sum(tamano for _, tamano, _ in archivos)
+        expulsados = 0
+        for _, tamano, ruta in archivos:
+            if total <= objetivo:
+                break
+            try:
+                os.remove(ruta)
+            except OSError:
+                continue
+            total -= tamano
+            expulsados += 1
+        self._bytes = total
+        logging.info(f"Caché de PDFs: {expulsados} archivos expulsados, {total} bytes en uso")
+
+    def estadisticas(self):
+        with self._lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "tasa_aciertos": round(self.aciertos / consultas, 3) if consultas else 0.0,
+                "bytes": self._bytes,
+            }
@@ -0,0 +1,387 @@
+"""
+Prueba de carga con chats concurrentes.
+
+Levanta una Bot API local (stub_telegram.py) y maneja N chats virtuales por el flujo
+completo de cotización mandando updates con el formato de Telegram a /<TOKEN>, igual
+que el webhook real. Cada chat contesta según la última respuesta del bot (nombre,
+producto, tamaño, material, cantidad, cobros, días, margen y confirmación) y espera
+el mensaje siguiente en el stub, así que la latencia medida es de punta a punta:
+desde el POST del update hasta que la respuesta llega a la "Bot API".
+
+La concurrencia sube por niveles (--niveles) y por cada uno se reporta mensajes y
+cotizaciones por segundo, latencia p50/p90/p99 de los mensajes y de las cotizaciones
+(desde el "si" hasta "¡Cotización generada!") y tasa de errores (HTTP distinto de 200,
+respuestas 503 por ingesta llena, mensajes descartados por el control de admisión,
+cotizaciones rechazadas por la cola de PDFs llena, esperas vencidas, respuestas
+inesperadas). Al final
+se estima el punto de saturación: el primer nivel en el que el p99 pasa de --slo-p99-ms,
+los errores pasan de --max-errores o agregar chats ya no agrega rendimiento.
+
+Sin --url la app corre en este proceso (servidor WSGI con hilos de werkzeug) sobre
+bases SQLite en archivos temporales con el catálogo del benchmark y sin las cuotas por
+chat de admision.py. Para medir un worker de gunicorn real (con las cuotas subidas: los
+chats virtuales escriben mucho más rápido que una persona):
+
+    TELEGRAM_API_URL=http://127.0.0.1:8081 TELEGRAM_BOT_TOKEN=123456:CARGA \
+        ADMISION_POR_CHAT=1000 ADMISION_RAFAGA=1000 ADMISION_COTIZACIONES_POR_MINUTO=100000 \
+        gunicorn -w 1 app:app
+    python carga.py --url http://127.0.0.1:8000 --token 123456:CARGA --puerto-stub 8081
+
+    python carga.py --niveles 1,5,10,25,50 --duracion 20 --salida carga_results.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import itertools
+import threading
+from collections import defaultdict, deque
+
+from benchmark import CATALOGO, percentiles, preparar_entorno
+from stub_telegram import StubTelegram
+
+TOKEN_CARGA = "123456:CARGA"
+
+# Fragmento de la última respuesta del bot -> lo que contesta el chat virtual
+RESPUESTAS = (
+    ("Ingresa tu nombre", lambda chat: chat.cliente),
+    ("Bienvenido", "1"),
+    ("Selecciona el producto", "1"),
+    ("Elige tamaño", "1"),
+    ("Selecciona material", "1"),
+    ("Cuántos", lambda chat: str(chat.cantidad)),
+    ("impresión digital", "si"),
+    ("Ingrese el precio para", "10"),
+    ("agregar algún costo extra", "no"),
+    ("días hábiles", "3"),
+    ("tiro-retiro", "no"),
+    ("margen de ganancia", "no"),
+    ("Confirma tu pedido", "si"),
+)
+# Respuestas con las que la app descarta trabajo por carga o por cuota del chat
+# (cola de PDFs llena, admision.py)
+RECHAZOS = ("Estamos generando muchas cotizaciones",)
+DESCARTES = ("Estás enviando mensajes muy rápido", "Estamos atendiendo muchos mensajes")
+MAX_PASOS = 40
+
+
+class Buzon:
+    """
+    Lo que el stub entrega a cada chat, con una condición por chat para esperarlo.
+    """
+
+    def __init__(self):
+        self._colas = defaultdict(deque)
+        self._condiciones = {}
+        self._lock = threading.Lock()
+
+    def _condicion(self, chat_id):
+        with self._lock:
+            condicion = self._condiciones.get(chat_id)
+            if condicion is None:
+                condicion = self._condiciones[chat_id] = threading.Condition()
+            return condicion
+
+    def recibir(self, chat_id, contenido):
+        condicion = self._condicion(chat_id)
+        with condicion:
+            self._colas[chat_id].append((time.perf_counter(), contenido))
+            condicion.notify()
+
+    def esperar(self, chat_id, timeout):
+        """
+        Devuelve (instante de llegada, contenido) o None si no llegó nada a tiempo.
+        """
+        condicion = self._condicion(chat_id)
+        with condicion:
+            if not condicion.wait_for(lambda: self._colas[chat_id], timeout):
+                return None
+            return self._colas[chat_id].popleft()
+
+    def vaciar(self, chat_id):
+        with self._condicion(chat_id):
+            self._colas[chat_id].clear()
+
+
+class Resultados:
+    def __init__(self, chats):
+        self.chats = chats
+        self.mensajes = []        # latencias de punta a punta (s)
+        self.cotizaciones = []    # desde el "si" hasta "¡Cotización generada!" (s)
+        self.errores = defaultdict(int)
+        self.conversaciones = 0
+        self._lock = threading.Lock()
+
+    def mensaje(self, segundos):
+        with self._lock:
+            self.mensajes.append(segundos)
+
+    def cotizacion(self, segundos):
+        with self._lock:
+            self.cotizaciones.append(segundos)
+            self.conversaciones += 1
+
+    def error(self, tipo):
+        with self._lock:
+            self.errores[tipo] += 1
+
+    def resumen(self, duracion):
+        intentos = len(self.mensajes) + sum(self.errores.values())
+        return {
+            "chats": self.chats,
+            "duracion_s": round(duracion, 2),
+            "mensajes": len(self.mensajes),
+            "mensajes_por_s": round(len(self.mensajes) / duracion, 2),
+            "cotizaciones": self.conversaciones,
+            "cotizaciones_por_s": round(self.conversaciones / duracion, 2),
+            "latencia_mensaje": percentiles(self.mensajes),
+            "latencia_cotizacion": percentiles(self.cotizaciones),
+            "errores": dict(self.errores),
+            "tasa_errores": round(sum(self.errores.values()) / intentos, 4) if intentos else 0.0,
+        }
+
+
+class ChatVirtual:
+    _update_ids = itertools.count(int(time.time()))
+
+    def __init__(self, chat_id, http, url_webhook, buzon, timeout, pausa):
+        self.chat_id = chat_id
+        self.http = http
+        self.url_webhook = url_webhook
+        self.buzon = buzon
+        self.timeout = timeout
+        self.pausa = pausa
+        self.cliente = f"Cliente {chat_id}"
+        self.cantidad = 1000
+        self.inicio_cotizacion = None
+
+    def update(self, texto):
+        update_id = next(self._update_ids)
+        return {"update_id": update_id, "message": {
+            "message_id": update_id, "date": int(time.time()), "text": texto,
+            "chat": {"id": self.chat_id, "type": "private"},
+            "from": {"id": self.chat_id, "is_bot": False, "first_name": self.cliente}}}
+
+    def decir(self, texto, resultados):
+        """
+        Manda el texto y espera la respuesta del bot. Devuelve (llegada, contenido) o None.
+        """
+        import urllib3
+
+        if self.pausa:
+            time.sleep(self.pausa)
+        inicio = time.perf_counter()
+        try:
+            respuesta = self.http.request("POST", self.url_webhook, json=self.update(texto))
+        except urllib3.exceptions.HTTPError:
+            resultados.error("conexion")
+            return None
+        if respuesta.status != 200:
+            resultados.error(f"http_{respuesta.status}")
+            return None
+        recibido = self.buzon.esperar(self.chat_id, self.timeout)
+        if recibido is None:
+            resultados.error("timeout")
+            return None
+        resultados.mensaje(recibido[0] - inicio)
+        return recibido
+
+    def conversacion(self, resultados):
+        """
+        Una cotización completa desde "hola". Termina antes si algo falla.
+        """
+        self.buzon.vaciar(self.chat_id)
+        self.inicio_cotizacion = None
+        # Cantidades distintas para que no todas salgan del caché de PDFs o por file_id
+        self.cantidad = random.randrange(100, 10000, 50)
+        recibido = self.decir("hola", resultados)
+        for _ in range(MAX_PASOS):
+            if recibido is None:
+                return
+            texto = recibido[1]
+            if texto.startswith("Generando") and self.inicio_cotizacion is not None:
+                return self.esperar_cotizacion(resultados)
+            if texto.startswith(DESCARTES):
+                resultados.error("mensaje_descartado")
+                return
+            if texto.startswith(RECHAZOS):
+                resultados.error("cotizacion_rechazada")
+                return
+            respuesta = next((r for fragmento, r in RESPUESTAS if fragmento in texto), None)
+            if respuesta is None:
+                resultados.error("respuesta_inesperada")
+                return
+            if texto.startswith("Confirma"):
+                self.inicio_cotizacion = time.perf_counter()
+            recibido = self.decir(respuesta(self) if callable(respuesta) else respuesta, resultados)
+        resultados.error("respuesta_inesperada")
+
+    def esperar_cotizacion(self, resultados):
+        documento = False
+        while True:
+            recibido = self.buzon.esperar(self.chat_id, self.timeout)
+            if recibido is None:
+                resultados.error("timeout_cotizacion")
+                return
+            llegada, contenido = recibido
+            if contenido.startswith("[documento"):
+                documento = True
+            elif contenido.startswith("¡Cotización generada!"):
+                if documento:
+                    resultados.cotizacion(llegada - self.inicio_cotizacion)
+                else:
+                    resultados.error("sin_documento")
+                return
+            elif contenido.startswith("No se pudo generar"):
+                resultados.error("cotizacion_fallida")
+                return
+
+
+def medir_nivel(chats, duracion, http, url_webhook, buzon, timeout, pausa, base_id):
+    resultados = Resultados(chats)
+    fin = time.monotonic() + duracion
+
+    def correr(chat):
+        while time.monotonic() < fin:
+            chat.conversacion(resultados)
+
+    # Ids nuevos por nivel: ninguna sesión ni respuesta atrasada se cruza entre niveles
+    hilos = [threading.Thread(target=correr, daemon=True,
+                              args=(ChatVirtual(base_id + i, http, url_webhook, buzon, timeout, pausa),))
+             for i in range(chats)]
+    inicio = time.perf_counter()
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    return resultados.resumen(time.perf_counter() - inicio)
+
+
+def analizar_saturacion(niveles, slo_p99_ms, max_errores, ganancia_minima=0.10):
+    """
+    Primer nivel que rompe el SLO de p99, pasa la tasa de errores o no mejora el
+    rendimiento del nivel anterior en al menos `ganancia_minima`.
+    """
+    capacidad = None
+    anterior = None
+    for nivel in niveles:
+        p99 = nivel["latencia_mensaje"].get("p99_ms", float("inf"))
+        motivo = None
+        if nivel["tasa_errores"] > max_errores:
+            motivo = f"tasa de errores {nivel['tasa_errores']:.2%} > {max_errores:.2%}"
+        elif p99 > slo_p99_ms:
+            motivo = f"p99 {p99:.0f} ms > {slo_p99_ms:.0f} ms"
+        elif anterior and nivel["mensajes_por_s"] < anterior["mensajes_por_s"] * (1 + ganancia_minima):
+            motivo = (f"{nivel['mensajes_por_s']} msg/s con {nivel['chats']} chats contra "
+                      f"{anterior['mensajes_por_s']} msg/s con {anterior['chats']}")
+        if motivo:
+            return {"saturacion_chats": nivel["chats"], "motivo": motivo,
+                    "capacidad": capacidad, "dentro_del_slo": capacidad is not None}
+        capacidad = {"chats": nivel["chats"], "mensajes_por_s": nivel["mensajes_por_s"],
+                     "cotizaciones_por_s": nivel["cotizaciones_por_s"], "p99_ms": p99}
+        anterior = nivel
+    return {"saturacion_chats": None, "motivo": "no se saturó en los niveles probados",
+            "capacidad": capacidad, "dentro_del_slo": capacidad is not None}
+
+
+def servir_en_proceso(tmp):
+    """
+    Importa app.py con el entorno del benchmark y la sirve con werkzeug.
+    """
+    import sqlite3
+    from werkzeug.serving import make_server
+
+    fijas = preparar_entorno(tmp)
+    # Archivos en WAL como en producción: la base en memoria compartida del benchmark
+    # bloquea por tabla y con varios hilos falla con "database table is locked"
+    os.environ["SERI_DB"] = os.path.join(tmp, "seri.db")
+    os.environ["SESIONES_DB"] = os.path.join(tmp, "sesiones.db")
+    with sqlite3.connect(os.environ["SERI_DB"]) as conn:
+        conn.executescript(CATALOGO)
+    import app
+    servidor = make_server("127.0.0.1", 0, app.app, threaded=True)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name="carga-wsgi", daemon=True).start()
+    return f"http://127.0.0.1:{servidor.server_port}", app.TOKEN, (servidor, fijas)
+
+
+def imprimir(reporte):
+    print(f"{'chats':>6} {'msg/s':>8} {'cot/s':>7} {'p50 ms':>8} {'p99 ms':>8} {'cot p99':>8} {'errores':>8}")
+    for nivel in reporte["niveles"]:
+        mensaje = nivel["latencia_mensaje"]
+        cotizacion = nivel["latencia_cotizacion"]
+        print(f"{nivel['chats']:>6} {nivel['mensajes_por_s']:>8} {nivel['cotizaciones_por_s']:>7} "
+              f"{mensaje.get('p50_ms', '-'):>8} {mensaje.get('p99_ms', '-'):>8} "
+              f"{cotizacion.get('p99_ms', '-'):>8} {nivel['tasa_errores']:>8.2%}")
+    saturacion = reporte["saturacion"]
+    if saturacion["saturacion_chats"]:
+        print(f"Saturación con {saturacion['saturacion_chats']} chats: {saturacion['motivo']}")
+    else:
+        print(saturacion["motivo"])
+    if saturacion["capacidad"]:
+        capacidad = saturacion["capacidad"]
+        print(f"Capacidad: {capacidad['chats']} chats, {capacidad['mensajes_por_s']} msg/s, "
+              f"{capacidad['cotizaciones_por_s']} cotizaciones/s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prueba de carga del webhook con chats concurrentes")
+    parser.add_argument("--niveles", default="1,5,10,25,50", help="chats concurrentes por nivel")
+    parser.add_argument("--duracion", type=float, default=15.0, help="segundos por nivel")
+    parser.add_argument("--url", default=None, help="app ya levantada (por defecto corre en este proceso)")
+    parser.add_argument("--token", default=None)
+    parser.add_argument("--puerto-stub", type=int, default=0)
+    parser.add_argument("--latencia-telegram-ms", type=float, default=20.0)
+    parser.add_argument("--limite-telegram", type=float, default=None,
+                        help="mensajes por segundo antes de que el stub responda 429")
+    parser.add_argument("--pausa-ms", type=float, default=0.0, help="tiempo de \"escritura\" entre mensajes")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--slo-p99-ms", type=float, default=1000.0)
+    parser.add_argument("--max-errores", type=float, default=0.01)
+    parser.add_argument("--salida", default="carga_results.json")
+    args = parser.parse_args(argv)
+    niveles = [int(n) for n in args.niveles.split(",") if n.strip()]
+
+    buzon = Buzon()
+    stub = StubTelegram(args.puerto_stub, args.latencia_telegram_ms, args.limite_telegram, buzon.recibir)
+    os.environ["TELEGRAM_API_URL"] = stub.iniciar()
+    tmp = tempfile.mkdtemp(prefix="seri_carga_")
+    if args.url:
+        url, token = args.url.rstrip("/"), args.token or TOKEN_CARGA
+    else:
+        os.environ.setdefault("TELEGRAM_BOT_TOKEN", args.token or TOKEN_CARGA)
+        url, token, _vivos = servir_en_proceso(tmp)
+
+    import urllib3
+    http = urllib3.PoolManager(maxsize=max(niveles), block=True, retries=False,
+                               timeout=urllib3.Timeout(connect=5.0, read=args.timeout))
+    url_webhook = f"{url}/{token}"
+
+    # Calentamiento: plantilla del PDF, catálogo en caché, conexiones abiertas
+    ChatVirtual(1, http, url_webhook, buzon, args.timeout, 0.0).conversacion(Resultados(1))
+
+    reporte = {"url": url, "stub": stub.url, "latencia_telegram_ms": args.latencia_telegram_ms,
+               "duracion_por_nivel_s": args.duracion, "niveles": []}
+    for i, chats in enumerate(niveles, start=1):
+        nivel = medir_nivel(chats, args.duracion, http, url_webhook, buzon, args.timeout,
+                            args.pausa_ms / 1000, i * 1000000)
+        reporte["niveles"].append(nivel)
+        print(f"{chats} chats: {nivel['mensajes_por_s']} msg/s, "
+              f"p99 {nivel['latencia_mensaje'].get('p99_ms', '-')} ms, errores {nivel['tasa_errores']:.2%}",
+              file=sys.stderr)
+    reporte["saturacion"] = analizar_saturacion(reporte["niveles"], args.slo_p99_ms, args.max_errores)
+    reporte["telegram"] = stub.resumen()
+    stub.detener()
+
+    with open(args.salida, "w") as f:
+        json.dump(reporte, f, indent=2, ensure_ascii=False)
+    imprimir(reporte)
+    print(f"Resultados escritos en {args.salida}")
+    return reporte
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+import os
+import io
+import copy
+import time
+import logging
+import threading
+
+# Hoja de cotización en PDF. Este módulo no depende del bot ni de la base de datos
+# para que los procesos de generación en lote solo carguen ReportLab. ReportLab y
+# Pillow se importan con el primer PDF, no al importar el módulo.
+
+LOGO_PATH = os.getenv("SERI_LOGO", "/var/www/db_serigraph/seri.png")
+# El logo se dibuja a 140x90 pt; a ~300 dpi no hace falta más resolución que esta.
+LOGO_MAX_PX = (600, 380)
+
+# Geometría fija de la hoja de cotización
+TABLA_X0, TABLA_Y0 = 50, 150      # esquina inferior izquierda del recuadro
+TABLA_W, TABLA_H = 500, 470       # ancho y alto del recuadro
+COL_DESCRIPCION_X = TABLA_X0 + 80
+COL_TOTAL_X = TABLA_X0 + 430
+PIE_X, PIE_Y, PIE_LEADING = 60, 140, 13
+CUADRO_PAD, CUADRO_H = 5, 50
+
+# Subir este número cuando cambie el diseño de la hoja (invalida las cachés de documentos)
+PLANTILLA_VERSION = 1
+
+# Plantilla: recursos estáticos del membrete preparados una sola vez por proceso
+_plantilla = None
+_plantilla_lock = threading.Lock()
+
+def _despues_de_fork():
+    # La precarga en segundo plano pudo quedar a medias con el lock tomado en el padre
+    global _plantilla_lock
+    _plantilla_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_despues_de_fork)
+
+# Fuentes del membrete, en el orden en que se registran en cada documento: el código
+# precalculado las nombra por su nombre interno (/F1, /F2), que depende de ese orden.
+FUENTES = ("Helvetica", "Helvetica-Bold")
+
+def cargar_plantilla():
+    """
+    Decodifica el logo (reducido al tamaño de impresión), precalcula las medidas del
+    membrete y lo dibuja una vez (ver _preparar_membrete). Cada cotización estampa
+    ese membrete y encima solo los campos variables.
+    """
+    global _plantilla
+    with _plantilla_lock:
+        if _plantilla is not None:
+            return _plantilla
+        from PIL import Image
+        from reportlab.lib.utils import ImageReader
+        from reportlab.pdfbase import pdfmetrics
+        with Image.open(LOGO_PATH) as im:
+            im.load()
+            im.thumbnail(LOGO_MAX_PX)
+            logo = ImageReader(im.copy())
+        # Fuerza la decodificación ahora y no en la primera cotización
+        logo.getRGBData()
+        _plantilla = {
+            "logo": logo,
+            "ancho_prefijo": pdfmetrics.stringWidth("Hoja de cotización: ", "Helvetica-Bold", 13),
+            "ancho_cantidad": pdfmetrics.stringWidth("CANTIDAD", "Helvetica-Bold", 12),
+            "ancho_descripcion": pdfmetrics.stringWidth("DESCRIPCION", "Helvetica-Bold", 12),
+            "ancho_total": pdfmetrics.stringWidth("TOTAL:", "Helvetica-Bold", 12),
+            "ancho_base_correo": pdfmetrics.stringWidth("Si cuenta con el diseño de la impresión, mandar a ", "Helvetica", 9),
+            "ancho_correo": pdfmetrics.stringWidth("jjdahud@gmail.com", "Helvetica", 9),
+        }
+        _plantilla["membrete"] = _preparar_membrete(_plantilla)
+        logging.info("Plantilla de cotización cargada")
+        return _plantilla
+
+def _preparar_membrete(plantilla):
+    """
+    Dibuja el membrete en un canvas de trabajo y guarda lo que queda de él: los
+    operadores de la página y el XObject del logo ya comprimido. Usa la representación
+    interna del canvas de ReportLab (_code, _doc), que no tiene API para importar páginas.
+    """
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
+    c = canvas.Canvas(io.BytesIO(), pagesize=A4)
+    fuentes = [c._doc.getInternalFontName(fuente) for fuente in FUENTES]
+    inicio = len(c._code)
+    _dibujar_membrete(c, plantilla)
+    nombre_logo = c._formsinuse[-1]
+    return {
+        # q ... Q: el estado gráfico (colores, grosor de línea) vuelve al inicial
+        "codigo": "q\n" + "\n".join(c._code[inicio:]) + "\nQ",
+        "fuentes": fuentes,
+        "nombre_logo": nombre_logo,
+        "logo": c._doc.idToObject[c._doc.getXObjectName(nombre_logo)],
+    }
+
+def _estampar_membrete(c, plantilla):
+    """
+    Copia en la página actual el membrete de _preparar_membrete: sin volver a dibujar
+    ni a comprimir el logo, que se agrega al documento como el mismo XObject.
+    """
+    membrete = plantilla["membrete"]
+    fuentes = [c._doc.getInternalFontName(fuente) for fuente in FUENTES]
+    if fuentes != membrete["fuentes"]:
+        # Otro orden de fuentes en este documento: el código guardado no sirve aquí
+        _dibujar_membrete(c, plantilla)
+        return
+    nombre = membrete["nombre_logo"]
+    referencia = c._doc.getXObjectName(nombre)
+    if referencia not in c._doc.idToObject:
+        # Copia superficial: comparte el contenido comprimido, no el registro en el otro documento
+        logo = copy.copy(membrete["logo"])
+        vars(logo).pop("__InternalName__", None)
+        c._doc.Reference(logo, referencia)
+        c._doc.addForm(nombre, logo)
+    c._currentPageHasImages = 1
+    c._formsinuse.append(nombre)
+    c._code.append(membrete["codigo"])
+
+def _dibujar_membrete(c, plantilla):
+    """
+    Dibuja las partes fijas de la hoja: logo, datos de la empresa, recuadro,
+    encabezados, cuadros de P/U y TOTAL y el pie de página.
+    """
+    from reportlab.lib import colors
+    from reportlab.lib.colors import HexColor
+    # Logo y datos de la empresa
+    c.drawImage(plantilla["logo"], 4, 725, width=140, height=90, preserveAspectRatio=True)
+    c.setFont("Helvetica-Bold", 12)
+    c.drawString(220, 735, "Hoja de cotización: ")
+    c.setFont("Helvetica", 12)
+    c.drawString(130, 715, "Serigráfica Internacional, S.A.")
+    c.drawString(130, 700, "10 avenida 25-63 zona 13")
+    c.drawString(130, 685, "Complejo Industrial Aurora Bodega 13")
+    c.drawString(130, 670, "Tel: (502) 2319-2900")
+    c.drawString(130, 655, "NIT: 528440-6")
+
+    # Recuadro exterior y divisiones CANTIDAD | DESCRIPCIÓN | TOTAL
+    x0, y0, w, h = TABLA_X0, TABLA_Y0, TABLA_W, TABLA_H
+    c.setLineWidth(1.5)
+    c.rect(x0, y0, w, h)
+    c.line(COL_DESCRIPCION_X, y0, COL_DESCRIPCION_X, y0 + h)
+    c.line(COL_TOTAL_X, y0, COL_TOTAL_X, y0 + h)
+
+    # Encabezados subrayados
+    y_header = y0 + h - 20
+    underline_gap = 3  # cuantos puntos por debajo de la “baseline”
+    c.setFont("Helvetica-Bold", 12)
+    c.setLineWidth(1)
+    for x_text, titulo, ancho in [(x0 + 10, "CANTIDAD", plantilla["ancho_cantidad"]),
+                                  (x0 + 220, "DESCRIPCION", plantilla["ancho_descripcion"]),
+                                  (x0 + 440, "TOTAL:", plantilla["ancho_total"])]:
+        c.drawString(x_text, y_header, titulo)
+        c.line(x_text, y_header - underline_gap, x_text + ancho, y_header - underline_gap)
+
+    c.setFont("Helvetica-Bold", 8)
+    c.drawString(x0 + 25, y0 + h - 60, "Unidades")
+
+    # Mini cuadros de la columna TOTAL
+    pad = CUADRO_PAD
+    box_x = COL_TOTAL_X + pad
+    box_w = (x0 + w) - COL_TOTAL_X - 2*pad
+    box1_y = y0 + h - pad - CUADRO_H
+    box2_y = box1_y - pad - CUADRO_H
+    c.rect(box_x, box1_y-40, box_w, CUADRO_H)
+    c.rect(box_x, box2_y-50, box_w, CUADRO_H)
+    c.setFont("Helvetica-Bold", 10)
+    c.drawString(box_x + pad, box1_y + CUADRO_H - 55, "P/U:")
+    c.drawString(box_x + pad, box2_y + CUADRO_H - 70, "TOTAL:")
+
+    # Pie de página (la primera línea lleva los días y la estampa generar_pdf)
+    c.setFillColor(colors.black)
+    c.setFont("Helvetica", 9)
+    c.drawString(PIE_X, PIE_Y - PIE_LEADING, "Si el proyecto está antes, se le llamará para notificarle.")
+    c.drawString(PIE_X, PIE_Y - 2 * PIE_LEADING, "El pago es a contra entrega, salvo que se pacte lo contrario.")
+
+    y_despues = PIE_Y - 3 * PIE_LEADING
+    c.drawString(PIE_X, y_despues, "Si cuenta con el diseño de la impresión, mandar a ")
+
+    # Correo en AZUL y subrayado
+    x_correo = PIE_X + plantilla["ancho_base_correo"]
+    gap = 2  # separación desde la baseline
+    c.setFillColor(colors.blue)
+    c.drawString(x_correo, y_despues, "jjdahud@gmail.com")
+    c.setStrokeColor(colors.blue)
+    c.setLineWidth(0.5)
+    c.line(x_correo, y_despues - gap, x_correo + plantilla["ancho_correo"], y_despues - gap)
+    c.setStrokeColor(colors.black)
+
+    # “Muchas gracias…” en AMBAR
+    y_gracias = y_despues - PIE_LEADING - 5
+    c.setFont("Helvetica-Bold", 9)
+    c.setFillColor(HexColor("#FFBF00"))   # amber
+    c.drawString(PIE_X, y_gracias, "Muchas gracias por contactar a Zerigráfica Internacional")
+    c.setFont("Helvetica-Bold", 12)
+    c.drawString(PIE_X+200, y_gracias-30, "Att: José David")
+    c.drawString(PIE_X+200, y_gracias-45, "Gerente General")
+    c.setFillColor(colors.black)
+
+def nombre_pdf(client_name):
+    return f"cotizacion_{client_name}_{int(time.time())}.pdf"
+
+def generar_pdf(client_name, material, flyer_width, cantidad, costo_total, descripcion_producto, quote_folder,day,
+                en_memoria=False, fecha=None, numero=None):
+    """
+    Genera un PDF de cotización con información esencial y lo guarda en el folder quote_folder.
+    El membrete se estampa ya dibujado desde la plantilla; aquí solo se dibujan los campos variables.
+    Con en_memoria=True no toca el disco: devuelve los bytes del PDF (quote_folder se ignora).
+    `fecha` (YYYY-MM-DD) y `numero` reimprimen una cotización ya enviada; sin ellos van
+    la fecha de hoy y un número tomado de la hora.
+    """
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
+    plantilla = cargar_plantilla()
+    if en_memoria:
+        buffer = io.BytesIO()
+        file_path = None
+        c = canvas.Canvas(buffer, pagesize=A4)
+    else:
+        file_path = os.path.join(quote_folder, nombre_pdf(client_name))
+        c = canvas.Canvas(file_path, pagesize=A4)
+    _estampar_membrete(c, plantilla)
+
+    x0, y0, h = TABLA_X0, TABLA_Y0, TABLA_H
+    c.setFillColor(colors.black)
+
+    # Número de hoja, fecha y cliente
+    c.setFont("Helvetica", 15)
+    if numero is None:
+        numero = int(time.time()) % 100000
+    c.drawString(220 + plantilla["ancho_prefijo"], 735, f"No. {numero}")
+    c.setFont("Helvetica", 12)
+    fecha_impresa = time.strptime(fecha, '%Y-%m-%d') if fecha else time.localtime()
+    c.drawString(130, 640, f"Fecha: {time.strftime('%d/%m/%Y', fecha_impresa)}")
+    c.drawString(130, 625, f"Dirigido a: {client_name}")
+
+    # Cantidad y descripción del producto
+    c.setFont("Helvetica-Bold", 8)
+    c.drawString(x0 + 35, y0 + h - 50, f"{cantidad}")
+    c.setFont("Helvetica-Bold", 9)
+    c.drawString(x0 + 90, y0 + h - 50, f"{descripcion_producto}")
+
+    # Valores de P/U y TOTAL dentro de los mini cuadros
+    box_x = COL_TOTAL_X + CUADRO_PAD
+    box1_y = y0 + h - CUADRO_PAD - CUADRO_H
+    box2_y = box1_y - CUADRO_PAD - CUADRO_H
+    c.setFont("Helvetica-Bold", 10)
+    c.drawString(box_x + CUADRO_PAD, box1_y + CUADRO_H - 70, f"Q{costo_total/cantidad:.2f}")
+    c.drawString(box_x + CUADRO_PAD, box2_y + CUADRO_H - 85, f"Q{costo_total:.2f}")
+
+    # Tiempo de entrega
+    c.setFont("Helvetica", 9)
+    c.drawString(PIE_X, PIE_Y, f"El tiempo de entrega es de {day} día hábil, desde el momento de la aprobación del proyecto y arte.")
+
+    c.save()
+    if en_memoria:
+        logging.info(f"PDF generado en memoria para {client_name}")
+        return buffer.getvalue()
+    logging.info(f"PDF generado para {client_name} en {file_path}")
+    return file_path
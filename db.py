@@ -0,0 +1,299 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+
+import metricas
+
+# Acceso a la base de datos: una conexión por hilo, modo WAL y consultas con nombre.
+
+DB_PATH = os.getenv("SERI_DB", "/var/www/db_serigraph/seri.db")
+BUSY_TIMEOUT = float(os.getenv("SERI_DB_TIMEOUT", "5"))  # segundos esperando un bloqueo
+REINTENTOS = 3
+
+# Sentencias parametrizadas; sqlite3 reutiliza la sentencia preparada mientras el texto sea idéntico.
+CONSULTAS = {
+    "productos": "SELECT * FROM products",
+    "dimensiones": "SELECT * FROM dimensions_volante",
+    "materiales": "SELECT * FROM material",
+    "cobros": "SELECT id, name, description FROM additional_charges",
+    "agregar_producto": "INSERT INTO products (name, price) VALUES (?, ?)",
+    "agregar_dimension": "INSERT INTO dimensions_volante (dimension, price) VALUES (?, ?)",
+    "agregar_cobro": "INSERT INTO additional_charges (name, description) VALUES (?, ?)",
+    "eliminar_cobro": "DELETE FROM additional_charges WHERE id=?",
+    "buscar_file_id": "SELECT file_id FROM telegram_archivos WHERE clave=?",
+    "guardar_file_id": "INSERT OR REPLACE INTO telegram_archivos (clave, file_id, creado) VALUES (?, ?, ?)",
+    "borrar_file_id": "DELETE FROM telegram_archivos WHERE clave=?",
+    "registrar_cotizacion": """
+        INSERT INTO quotes (creado, fecha, chat_id, cliente, producto, dimension, material,
+                            precio_material, medida_material, cantidad, adicionales, margen,
+                            tiro_retiro, dias, piezas_por_pliego, pliegos, costo_total,
+                            descripcion, plantilla_version, clave, pdf_hash)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """,
+    "cotizacion": "SELECT * FROM quotes WHERE id=?",
+    "cotizacion_de_chat": "SELECT * FROM quotes WHERE id=? AND chat_id=?",
+    "pdf_por_clave": "SELECT pdf_hash FROM quotes WHERE clave=? AND pdf_hash IS NOT NULL ORDER BY id DESC LIMIT 1",
+    "cotizaciones_cliente": "SELECT * FROM quotes WHERE cliente=? COLLATE NOCASE ORDER BY fecha DESC, id DESC LIMIT ?",
+    "ultima_cotizacion_chat": "SELECT * FROM quotes WHERE chat_id=? ORDER BY id DESC LIMIT 1",
+    "matriz_combinaciones": """
+        SELECT dimension, material, precio_material, medida_material, group_concat(cantidad)
+        FROM matriz_precios GROUP BY dimension, material
+    """,
+    "matriz_precio": "SELECT * FROM matriz_precios WHERE dimension=? AND material=? AND cantidad=?",
+    "matriz_borrar": "DELETE FROM matriz_precios WHERE dimension=? AND material=?",
+    "matriz_insertar": """
+        INSERT OR REPLACE INTO matriz_precios (dimension, material, cantidad, precio_material,
+                                               medida_material, ancho, alto, piezas_por_pliego,
+                                               pliegos, costo_papel, costo_base, actualizado)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """,
+}
+
+# Tablas propias de la aplicación (las del catálogo ya existen en seri.db)
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS telegram_archivos (
+    clave TEXT PRIMARY KEY,
+    file_id TEXT NOT NULL,
+    creado REAL NOT NULL
+);
+
+-- Libro de cotizaciones: una fila por cotización enviada con todos los datos del
+-- cálculo y el hash del PDF en almacen_pdf.py. Solo se agregan filas.
+CREATE TABLE IF NOT EXISTS quotes (
+    id INTEGER PRIMARY KEY,
+    creado REAL NOT NULL,
+    fecha TEXT NOT NULL,                -- YYYY-MM-DD, hora local
+    chat_id TEXT,
+    cliente TEXT NOT NULL,
+    producto TEXT,
+    dimension TEXT,
+    material TEXT,
+    precio_material REAL,
+    medida_material TEXT,
+    cantidad INTEGER NOT NULL,
+    adicionales TEXT,                   -- lista JSON de montos
+    margen REAL,
+    tiro_retiro REAL,
+    dias INTEGER,
+    piezas_por_pliego INTEGER,
+    pliegos INTEGER,
+    costo_total REAL NOT NULL,
+    descripcion TEXT,
+    plantilla_version INTEGER,
+    clave TEXT,                         -- clave de render (cache_pdf / telegram_archivos)
+    pdf_hash TEXT                       -- NULL si no se archivó; se regenera desde esta fila
+);
+CREATE INDEX IF NOT EXISTS idx_quotes_cliente ON quotes (cliente COLLATE NOCASE, fecha);
+CREATE INDEX IF NOT EXISTS idx_quotes_fecha ON quotes (fecha);
+CREATE INDEX IF NOT EXISTS idx_quotes_producto ON quotes (producto, fecha);
+CREATE INDEX IF NOT EXISTS idx_quotes_clave ON quotes (clave);
+CREATE INDEX IF NOT EXISTS idx_quotes_chat ON quotes (chat_id, id);
+CREATE TRIGGER IF NOT EXISTS quotes_sin_update BEFORE UPDATE ON quotes
+BEGIN SELECT RAISE(ABORT, 'quotes solo admite inserciones'); END;
+CREATE TRIGGER IF NOT EXISTS quotes_sin_delete BEFORE DELETE ON quotes
+BEGIN SELECT RAISE(ABORT, 'quotes solo admite inserciones'); END;
+
+-- Índice de texto completo sobre cliente y descripción (contenido externo: quotes)
+CREATE VIRTUAL TABLE IF NOT EXISTS quotes_fts USING fts5(
+    cliente, descripcion, content='quotes', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+);
+CREATE TRIGGER IF NOT EXISTS quotes_fts_insertar AFTER INSERT ON quotes
+BEGIN INSERT INTO quotes_fts (rowid, cliente, descripcion) VALUES (new.id, new.cliente, new.descripcion); END;
+
+-- Matriz de precios (ver matriz_precios.py): costo de papel precalculado por tamaño,
+-- material y cantidad estándar, con los datos del catálogo con que se calculó.
+CREATE TABLE IF NOT EXISTS matriz_precios (
+    dimension TEXT NOT NULL,
+    material TEXT NOT NULL,
+    cantidad INTEGER NOT NULL,
+    precio_material REAL NOT NULL,
+    medida_material TEXT NOT NULL,
+    ancho REAL NOT NULL,
+    alto REAL NOT NULL,
+    piezas_por_pliego INTEGER NOT NULL,
+    pliegos INTEGER NOT NULL,
+    costo_papel REAL NOT NULL,
+    costo_base REAL NOT NULL,           -- sin cobros adicionales, margen por defecto, con IVA
+    actualizado REAL NOT NULL,
+    PRIMARY KEY (dimension, material, cantidad)
+) WITHOUT ROWID;
+
+-- Revisión del catálogo: la suben los triggers que crea asegurar_esquema en las tablas
+-- del catálogo, así las escrituras de quotes, telegram_archivos o la matriz no lo invalidan.
+CREATE TABLE IF NOT EXISTS catalogo_revision (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    revision INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO catalogo_revision (id, revision) VALUES (1, 0);
+"""
+
+TABLAS_CATALOGO = ("products", "dimensions_volante", "material", "additional_charges")
+
+SQL_SEGUNDOS = metricas.Histograma("seri_sql_segundos", "Duración de las consultas SQL con nombre", "consulta")
+
+_local = threading.local()
+_esquema_listo = False
+_esquema_lock = threading.Lock()
+_version_conn = None
+_version_lock = threading.Lock()
+_revision = None                # (data_version, revisión) de la última lectura
+_catalogo_con_revision = False  # todas las tablas del catálogo tienen sus triggers
+
+
+def _despues_de_fork():
+    # Una conexión de SQLite no se puede usar en el hijo de un fork (gunicorn --preload)
+    global _local, _version_conn, _version_lock, _esquema_lock
+    _local = threading.local()
+    _version_conn = None
+    _version_lock = threading.Lock()
+    _esquema_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_despues_de_fork)
+
+
+def conectar(ruta, timeout=BUSY_TIMEOUT, compartida=False):
+    """
+    Abre una conexión con WAL, synchronous=NORMAL y espera ante bloqueos.
+    `ruta` puede ser un URI (file:...?mode=memory&cache=shared) para pruebas.
+    Con compartida=True la conexión se puede usar desde varios hilos (con un lock propio).
+    """
+    conn = sqlite3.connect(ruta, timeout=timeout, cached_statements=256, uri=True,
+                           check_same_thread=not compartida)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={int(timeout * 1000)}")
+    return conn
+
+
+def conexion():
+    """
+    Conexión propia del hilo actual (nunca se comparte un cursor entre hilos).
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = conectar(DB_PATH)
+        _local.conn = conn
+        asegurar_esquema(conn)
+    return conn
+
+
+def _con_reintentos(funcion):
+    for intento in range(REINTENTOS):
+        try:
+            return funcion()
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e) or intento == REINTENTOS - 1:
+                raise
+            logging.warning(f"Base de datos bloqueada, reintento {intento + 1}: {e}")
+            time.sleep(0.05 * (intento + 1))
+
+
+def consultar(nombre, parametros=()):
+    sql = CONSULTAS[nombre]
+    with SQL_SEGUNDOS.medir(nombre):
+        return _con_reintentos(lambda: conexion().execute(sql, parametros).fetchall())
+
+
+def consultar_filas(nombre, parametros=(), sql=None):
+    """
+    Como consultar, pero cada fila es un dict con los nombres de las columnas.
+    `sql` reemplaza la sentencia de CONSULTAS para búsquedas que arman su WHERE
+    (ver historial.py); `nombre` sigue siendo la etiqueta de la métrica.
+    """
+    sql = sql or CONSULTAS[nombre]
+
+    def _leer():
+        cursor = conexion().execute(sql, parametros)
+        columnas = [c[0] for c in cursor.description]
+        return [dict(zip(columnas, fila)) for fila in cursor.fetchall()]
+    with SQL_SEGUNDOS.medir(nombre):
+        return _con_reintentos(_leer)
+
+
+def ejecutar(nombre, parametros=()):
+    """
+    Ejecuta una escritura con nombre y la confirma. Devuelve el número de filas afectadas.
+    """
+    sql = CONSULTAS[nombre]
+
+    def _escribir():
+        conn = conexion()
+        with conn:
+            return conn.execute(sql, parametros).rowcount
+    with SQL_SEGUNDOS.medir(nombre):
+        return _con_reintentos(_escribir)
+
+
+def ejecutar_varios(operaciones):
+    """
+    Varias escrituras con nombre en una sola transacción. `operaciones` es una lista de
+    (nombre, lista de parámetros); cada una se ejecuta con executemany.
+    """
+    def _escribir():
+        conn = conexion()
+        with conn:
+            for nombre, filas in operaciones:
+                with SQL_SEGUNDOS.medir(nombre):
+                    conn.executemany(CONSULTAS[nombre], filas)
+    _con_reintentos(_escribir)
+
+
+def version_catalogo():
+    """
+    Revisión del catálogo: cambia con cualquier commit que toque sus tablas, sea de
+    este proceso o de otro. Mientras PRAGMA data_version no cambie (ningún commit de
+    otra conexión) no se vuelve a leer. Si faltaba alguna tabla del catálogo al crear
+    el esquema no hay triggers y se usa data_version directamente.
+    """
+    global _version_conn, _revision
+    asegurar_esquema()
+    with _version_lock:
+        if _version_conn is None:
+            _version_conn = conectar(DB_PATH, compartida=True)
+        datos = _version_conn.execute("PRAGMA data_version").fetchone()[0]
+        if not _catalogo_con_revision:
+            return ("datos", datos)
+        if _revision is None or _revision[0] != datos:
+            fila = _version_conn.execute("SELECT revision FROM catalogo_revision").fetchone()
+            _revision = (datos, fila[0])
+        return _revision[1]
+
+
+def _triggers_catalogo(conn):
+    """
+    Crea los triggers que suben catalogo_revision; False si falta alguna tabla del catálogo.
+    """
+    completas = True
+    for tabla in TABLAS_CATALOGO:
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (tabla,)).fetchone():
+            completas = False
+            continue
+        for evento in ("INSERT", "UPDATE", "DELETE"):
+            conn.execute(f"CREATE TRIGGER IF NOT EXISTS {tabla}_revision_{evento.lower()} AFTER {evento} ON {tabla} "
+                         "BEGIN UPDATE catalogo_revision SET revision = revision + 1; END")
+    return completas
+
+
+def asegurar_esquema(conn=None):
+    """
+    Crea las tablas propias si faltan. Corre una vez por proceso, con la primera
+    conexión, así importar la aplicación no abre la base.
+    """
+    global _esquema_listo, _catalogo_con_revision
+    if _esquema_listo:
+        return
+    conn = conn or conexion()
+    with _esquema_lock:
+        if not _esquema_listo:
+            fts_existia = conn.execute("SELECT 1 FROM sqlite_master WHERE name='quotes_fts'").fetchone()
+            conn.executescript(ESQUEMA)
+            if not fts_existia:
+                # Índice nuevo sobre un libro que ya tenía filas
+                conn.execute("INSERT INTO quotes_fts (quotes_fts) VALUES ('rebuild')")
+            _catalogo_con_revision = _triggers_catalogo(conn)
+            conn.commit()
+            _esquema_listo = True
@@ -0,0 +1,38 @@
+import os
+import hmac
+import time
+import hashlib
+
+# Enlaces firmados y con vencimiento para descargar una cotización por su id
+# (/cotizaciones/<id>.pdf?exp=...&firma=...), p. ej. para mandar el PDF por WhatsApp
+# como enlace en lugar de volver a subirlo. El vencimiento se redondea al final del
+# día, así los enlaces del mismo día son idénticos y los navegadores pueden revalidar
+# la misma URL (304) en lugar de bajar el PDF otra vez.
+
+DESCARGAS_SECRETO = os.getenv("DESCARGAS_SECRETO", "")
+DESCARGAS_VIGENCIA = int(os.getenv("DESCARGAS_VIGENCIA", str(7 * 24 * 3600)))   # segundos
+URL_PUBLICA = os.getenv("SERI_URL_PUBLICA", "").rstrip("/")
+REDONDEO = 24 * 3600
+
+
+def firmar(cotizacion_id, expira):
+    mensaje = f"{cotizacion_id}:{expira}".encode("utf-8")
+    return hmac.new(DESCARGAS_SECRETO.encode("utf-8"), mensaje, hashlib.sha256).hexdigest()[:32]
+
+
+def url_descarga(cotizacion_id, vigencia=DESCARGAS_VIGENCIA):
+    """
+    URL firmada de la cotización, o None si no hay DESCARGAS_SECRETO configurado.
+    """
+    if not DESCARGAS_SECRETO:
+        return None
+    expira = -(-(int(time.time()) + vigencia) // REDONDEO) * REDONDEO
+    return f"{URL_PUBLICA}/cotizaciones/{cotizacion_id}.pdf?exp={expira}&firma={firmar(cotizacion_id, expira)}"
+
+
+def verificar(cotizacion_id, expira, firma):
+    if not DESCARGAS_SECRETO or not expira or not firma or not expira.isdigit():
+        return False
+    if int(expira) < time.time():
+        return False
+    return hmac.compare_digest(firma, firmar(cotizacion_id, int(expira)))
@@ -0,0 +1,215 @@
+import os
+import json
+import time
+import heapq
+import logging
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import metricas
+from limites import CuboTokens, CubosPorClave
+
+# Envíos a la Bot API de Telegram fuera del hilo que atiende el mensaje. Cada envío se
+# encola por chat (un chat en orden, chats distintos en paralelo) y se hace con un pool
+# de conexiones keep-alive de urllib3. Dos cubetas de tokens respetan los límites de
+# Telegram: uno global del bot y otro por chat. Un chat sin tokens no ocupa un hilo del
+# pool esperando: su cola se vuelve a programar para cuando tenga uno. Con la cola llena
+# el que envía espera lugar (hasta ENVIOS_ESPERA_LLENO) y si no, el envío falla.
+# TELEGRAM_API_URL permite apuntar a un servidor local (ver stub_telegram.py).
+
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+ENVIOS_HILOS = int(os.getenv("ENVIOS_HILOS", "16"))
+ENVIOS_MAX_PENDIENTES = int(os.getenv("ENVIOS_MAX_PENDIENTES", "2000"))
+ENVIOS_POR_SEGUNDO = float(os.getenv("ENVIOS_POR_SEGUNDO", "30"))   # límite global de Telegram
+ENVIOS_POR_CHAT = float(os.getenv("ENVIOS_POR_CHAT", "1"))          # mensajes por segundo a un chat
+ENVIOS_RAFAGA_CHAT = int(os.getenv("ENVIOS_RAFAGA_CHAT", "3"))
+ENVIOS_TIMEOUT = float(os.getenv("ENVIOS_TIMEOUT", "30"))
+ENVIOS_ESPERA_LLENO = float(os.getenv("ENVIOS_ESPERA_LLENO", "5"))   # segundos esperando lugar en la cola
+REINTENTOS = 3
+
+ENVIO_SEGUNDOS = metricas.Histograma("seri_telegram_envio_segundos", "Duración de las llamadas a la Bot API", "metodo")
+ENVIOS_LIMITADOS = metricas.Contador("seri_telegram_429_total", "Respuestas 429 (límite de Telegram)", "metodo")
+
+
+class ErrorTelegram(Exception):
+    """
+    La Bot API respondió ok=false o no se pudo completar la llamada.
+    """
+
+    def __init__(self, descripcion, codigo=None):
+        super().__init__(descripcion)
+        self.codigo = codigo
+
+
+class Enviador:
+    def __init__(self, token, url=TELEGRAM_API_URL, hilos=ENVIOS_HILOS, max_pendientes=ENVIOS_MAX_PENDIENTES,
+                 por_segundo=ENVIOS_POR_SEGUNDO, por_chat=ENVIOS_POR_CHAT, rafaga_chat=ENVIOS_RAFAGA_CHAT,
+                 timeout=ENVIOS_TIMEOUT, espera_lleno=ENVIOS_ESPERA_LLENO):
+        self.base = f"{url.rstrip('/')}/bot{token}/"
+        self.hilos = max(hilos, 1)
+        self.timeout = timeout
+        self.max_pendientes = max_pendientes
+        self.espera_lleno = espera_lleno
+        self._http = None
+        self._http_lock = threading.Lock()
+        self._global = CuboTokens(por_segundo, por_segundo)
+        self._por_chat = CubosPorClave(por_chat, rafaga_chat)
+        self._colas = {}            # chat_id -> deque de envíos; el chat está en curso mientras exista
+        self._pendientes = 0
+        self._cambio = threading.Condition()
+        self._pool = ThreadPoolExecutor(max_workers=self.hilos, thread_name_prefix="envios")
+        # Chats que esperan un token: (cuándo, orden, chat_id), atendidos por un solo hilo
+        self._programados = []
+        self._orden = itertools.count()
+        self._planificador = None
+
+    def _conexiones(self):
+        if self._http is None:
+            with self._http_lock:
+                if self._http is None:
+                    import urllib3
+                    self._http = urllib3.PoolManager(
+                        maxsize=self.hilos, block=True, retries=False,
+                        timeout=urllib3.Timeout(connect=5.0, read=self.timeout))
+        return self._http
+
+    def llamar(self, metodo, campos, archivo=None):
+        """
+        Llamada síncrona a la Bot API. Reintenta ante 429 (esperando retry_after),
+        errores 5xx y fallas de conexión. Devuelve el campo "result" de la respuesta.
+        """
+        import urllib3
+
+        http = self._conexiones()
+        url = self.base + metodo
+        for intento in range(REINTENTOS):
+            ultimo = intento == REINTENTOS - 1
+            self._global.esperar()
+            try:
+                with ENVIO_SEGUNDOS.medir(metodo):
+                    if archivo is not None:
+                        campos_multipart = {k: str(v) for k, v in campos.items()}
+                        campos_multipart["document"] = archivo
+                        respuesta = http.request("POST", url, fields=campos_multipart)
+                    else:
+                        respuesta = http.request("POST", url, json=campos)
+                datos = json.loads(respuesta.data or b"{}")
+            except (urllib3.exceptions.HTTPError, ValueError) as e:
+                if ultimo:
+                    raise ErrorTelegram(f"Error de conexión con Telegram: {e}")
+                time.sleep(0.5 * (intento + 1))
+                continue
+            if datos.get("ok"):
+                return datos.get("result")
+            retry_after = (datos.get("parameters") or {}).get("retry_after")
+            if respuesta.status == 429 and not ultimo:
+                ENVIOS_LIMITADOS.incrementar(metodo)
+                logging.warning(f"Telegram limitó {metodo}; reintento en {retry_after or 1} s")
+                time.sleep(retry_after or 1)
+                continue
+            if respuesta.status >= 500 and not ultimo:
+                time.sleep(0.5 * (intento + 1))
+                continue
+            raise ErrorTelegram(datos.get("description") or f"HTTP {respuesta.status}", respuesta.status)
+
+    def _procesar(self, trabajo):
+        chat_id, metodo, campos, archivo, futuro = trabajo
+        if not futuro.set_running_or_notify_cancel():
+            return
+        try:
+            futuro.set_result(self.llamar(metodo, campos, archivo))
+        except Exception as e:
+            logging.warning(f"No se pudo enviar {metodo} a {chat_id}: {e}")
+            futuro.set_exception(e)
+
+    def _drenar(self, chat_id):
+        """
+        Envía en orden lo que tiene el chat mientras le queden tokens; si se le acaban
+        deja la cola como está y la programa para cuando tenga uno.
+        """
+        while True:
+            with self._cambio:
+                cola = self._colas[chat_id]
+                if not cola:
+                    del self._colas[chat_id]
+                    return
+                falta = self._por_chat.intentar(chat_id)
+                if falta:
+                    self._programar(chat_id, falta)
+                    return
+                trabajo = cola.popleft()
+            try:
+                self._procesar(trabajo)
+            finally:
+                with self._cambio:
+                    self._pendientes -= 1
+                    self._cambio.notify_all()
+
+    def _programar(self, chat_id, segundos):
+        # Llamar con self._cambio tomado
+        heapq.heappush(self._programados, (time.monotonic() + segundos, next(self._orden), chat_id))
+        if self._planificador is None:
+            self._planificador = threading.Thread(target=self._planificar, name="envios-planificador", daemon=True)
+            self._planificador.start()
+        self._cambio.notify_all()
+
+    def _planificar(self):
+        with self._cambio:
+            while True:
+                ahora = time.monotonic()
+                while self._programados and self._programados[0][0] <= ahora:
+                    _, _, chat_id = heapq.heappop(self._programados)
+                    self._pool.submit(self._drenar, chat_id)
+                self._cambio.wait(self._programados[0][0] - ahora if self._programados else None)
+
+    def enviar(self, chat_id, metodo, campos, archivo=None):
+        """
+        Encola el envío y devuelve un Future con el "result" de la API. Con la cola
+        llena espera hasta espera_lleno segundos; si no hay lugar el Future falla.
+        """
+        futuro = Future()
+        trabajo = (chat_id, metodo, campos, archivo, futuro)
+        with self._cambio:
+            if not self._cambio.wait_for(lambda: self._pendientes < self.max_pendientes, self.espera_lleno):
+                logging.warning(f"Cola de envíos llena ({self.max_pendientes}); no se envía {metodo} a {chat_id}")
+                futuro.set_exception(ErrorTelegram("Cola de envíos llena"))
+                return futuro
+            self._pendientes += 1
+            cola = self._colas.get(chat_id)
+            if cola is not None:
+                # El chat ya está en curso (enviando o programado); espera su turno
+                cola.append(trabajo)
+                return futuro
+            self._colas[chat_id] = deque([trabajo])
+        self._pool.submit(self._drenar, chat_id)
+        return futuro
+
+    def enviar_mensaje(self, chat_id, texto):
+        return self.enviar(chat_id, "sendMessage", {"chat_id": chat_id, "text": texto})
+
+    def enviar_documento(self, chat_id, documento, nombre=None):
+        """
+        `documento` son los bytes del PDF (se suben) o un file_id de Telegram.
+        El file_id del documento enviado queda en result["document"]["file_id"].
+        """
+        if isinstance(documento, (bytes, bytearray)):
+            return self.enviar(chat_id, "sendDocument", {"chat_id": chat_id},
+                               (nombre or "documento.pdf", bytes(documento), "application/pdf"))
+        return self.enviar(chat_id, "sendDocument", {"chat_id": chat_id, "document": documento})
+
+    def pendientes(self):
+        with self._cambio:
+            return self._pendientes
+
+    def esperar_vacio(self, timeout=None):
+        """
+        Espera a que no queden envíos pendientes (benchmark y pruebas de carga).
+        """
+        limite = None if timeout is None else time.monotonic() + timeout
+        while self.pendientes():
+            if limite is not None and time.monotonic() > limite:
+                return False
+            time.sleep(0.005)
+        return True
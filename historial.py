@@ -0,0 +1,106 @@
+import os
+import re
+import time
+
+import db
+
+# Búsqueda en el libro de cotizaciones (tabla quotes): prefijo de cliente por índice,
+# texto libre con FTS5 sobre cliente y descripción, rango de fechas y producto.
+# Se pide una fila de más para saber si hay otra página sin contar todo el resultado.
+
+POR_PAGINA = int(os.getenv("HISTORIAL_POR_PAGINA", "10"))
+POR_PAGINA_MAX = 50
+
+COLUMNAS = "quotes.id, quotes.fecha, quotes.cliente, quotes.producto, quotes.descripcion, " \
+           "quotes.cantidad, quotes.costo_total"
+
+
+class FiltroInvalido(Exception):
+    """
+    Filtro de búsqueda mal escrito; el mensaje se le muestra al usuario.
+    """
+
+
+def normalizar_fecha(texto):
+    """
+    Acepta AAAA-MM-DD o DD/MM/AAAA (el formato de la hoja de cotización).
+    """
+    for formato in ("%Y-%m-%d", "%d/%m/%Y"):
+        try:
+            return time.strftime("%Y-%m-%d", time.strptime(texto.strip(), formato))
+        except ValueError:
+            continue
+    raise FiltroInvalido(f"Fecha inválida '{texto}', usa AAAA-MM-DD o DD/MM/AAAA")
+
+
+def consulta_fts(texto):
+    """
+    Convierte texto libre en una consulta FTS5 segura: cada palabra se busca por prefijo.
+    """
+    return " ".join(f'"{palabra}"*' for palabra in re.findall(r"\w+", texto))
+
+
+def buscar(cliente=None, texto=None, desde=None, hasta=None, producto=None, chat_id=None,
+           pagina=1, por_pagina=POR_PAGINA):
+    """
+    Devuelve {"resultados": [...], "pagina": n, "hay_mas": bool}, de la más reciente
+    a la más antigua. Con chat_id solo se ven las cotizaciones de ese chat.
+    """
+    pagina = max(int(pagina), 1)
+    por_pagina = min(max(int(por_pagina), 1), POR_PAGINA_MAX)
+    origen = "quotes"
+    # fecha, id sale en orden de idx_quotes_fecha / idx_quotes_producto sin ordenar en memoria
+    orden = "quotes.fecha DESC, quotes.id DESC"
+    condiciones = []
+    parametros = []
+    if texto:
+        fts = consulta_fts(texto)
+        if fts:
+            origen = "quotes_fts JOIN quotes ON quotes.id = quotes_fts.rowid"
+            condiciones.append("quotes_fts MATCH ?")
+            # FTS5 entrega los rowid en orden; los id crecen con la fecha
+            orden = "quotes_fts.rowid DESC"
+            parametros.append(fts)
+    if cliente:
+        # Rango sobre idx_quotes_cliente en lugar de LIKE, que no usaría el índice
+        condiciones.append("quotes.cliente >= ? COLLATE NOCASE AND quotes.cliente < ? COLLATE NOCASE")
+        parametros += [cliente, cliente + "\U0010ffff"]
+    if desde:
+        condiciones.append("quotes.fecha >= ?")
+        parametros.append(normalizar_fecha(desde))
+    if hasta:
+        condiciones.append("quotes.fecha <= ?")
+        parametros.append(normalizar_fecha(hasta))
+    if producto:
+        condiciones.append("quotes.producto = ?")
+        parametros.append(producto)
+    if chat_id is not None:
+        condiciones.append("quotes.chat_id = ?")
+        parametros.append(str(chat_id))
+    sql = f"SELECT {COLUMNAS} FROM {origen}"
+    if condiciones:
+        sql += " WHERE " + " AND ".join(condiciones)
+    sql += f" ORDER BY {orden} LIMIT ? OFFSET ?"
+    parametros += [por_pagina + 1, (pagina - 1) * por_pagina]
+    filas = db.consultar_filas("buscar_cotizaciones", tuple(parametros), sql=sql)
+    return {"resultados": filas[:por_pagina], "pagina": pagina, "hay_mas": len(filas) > por_pagina}
+
+
+def leer_filtros(texto):
+    """
+    Separa los filtros clave:valor de un comando del bot del texto libre, p. ej.
+    "volante cliente:Juan desde:01/10/2026 pagina:2".
+    """
+    filtros = {}
+    libres = []
+    for parte in texto.split():
+        clave, sep, valor = parte.partition(":")
+        if sep and clave.lower() in ("cliente", "desde", "hasta", "producto", "pagina") and valor:
+            # Nombres con espacios se escriben con guion bajo: cliente:Juan_Perez
+            filtros[clave.lower()] = valor.replace("_", " ")
+        else:
+            libres.append(parte)
+    if "pagina" in filtros and not filtros["pagina"].isdigit():
+        raise FiltroInvalido("La página debe ser un número")
+    filtros["texto"] = " ".join(libres)
+    return filtros
@@ -0,0 +1,136 @@
+import os
+from bisect import bisect_right
+from functools import lru_cache
+
+# Imposición: cuántas piezas caben en un pliego de material.
+# Prueba ambas orientaciones y acomodos mixtos con cortes de guillotina, descontando
+# sangrado, calle entre piezas y pinza. Las medidas van en las mismas unidades que
+# las dimensiones del catálogo.
+
+SANGRADO = float(os.getenv("IMPOSICION_SANGRADO", "0"))  # por lado de cada pieza
+CALLE = float(os.getenv("IMPOSICION_CALLE", "0"))        # separación entre piezas
+PINZA = float(os.getenv("IMPOSICION_PINZA", "0"))        # borde que toma la máquina
+
+ESCALA = 100  # se trabaja en centésimas para no arrastrar errores de punto flotante
+# Tope de cortes que se prueban por pliego; las piezas muy chicas frente al pliego
+# generan demasiadas posiciones de corte y ahí se usa la mejor rejilla uniforme.
+MAX_CORTES = int(os.getenv("IMPOSICION_MAX_CORTES", "100000"))
+
+
+class _SinPresupuesto(Exception):
+    pass
+
+
+def _a_entero(valor):
+    return int(round(valor * ESCALA))
+
+
+def _normales(a, b, largo):
+    """
+    Posiciones de corte útiles: combinaciones i*a + j*b que caben en `largo`.
+    """
+    posiciones = set()
+    for i in range(largo // a + 1):
+        resto = largo - i * a
+        for j in range(resto // b + 1):
+            posiciones.add(i * a + j * b)
+    return sorted(posiciones)
+
+
+def _bajar(valor, normales):
+    # Mayor posición normal <= valor (lo que sobra nunca lleva piezas)
+    return normales[bisect_right(normales, valor) - 1]
+
+
+def _rejilla(a, b, w, h):
+    """
+    Mejor acomodo de una o dos rejillas uniformes: todo en una orientación, o un
+    solo corte con cada lado en una orientación distinta.
+    """
+    resultado = max((w // a) * (h // b), (w // b) * (h // a))
+    for p, q in ((a, b), (b, a)):
+        for columnas in range(1, w // p):
+            resultado = max(resultado, columnas * (h // q) + ((w - columnas * p) // q) * (h // p))
+        for filas in range(1, h // q):
+            resultado = max(resultado, filas * (w // p) + ((h - filas * q) // p) * (w // q))
+    return resultado
+
+
+def _guillotina(a, b, ancho, alto, max_cortes=None):
+    """
+    Máximo de piezas a x b (o b x a) en un rectángulo ancho x alto con cortes de guillotina.
+    Si la búsqueda pasa de max_cortes cortes probados devuelve la mejor rejilla (_rejilla).
+    """
+    restantes = [MAX_CORTES if max_cortes is None else max_cortes]
+    chica, grande = min(a, b), max(a, b)
+    # Armar las posiciones de corte ya cuesta del orden de (largo/chica) * (largo/grande)
+    if max(ancho, alto) ** 2 // (chica * grande) > restantes[0]:
+        return _rejilla(a, b, ancho, alto)
+    normales_w = _normales(chica, grande, ancho)
+    normales_h = _normales(chica, grande, alto)
+    ancho, alto = _bajar(ancho, normales_w), _bajar(alto, normales_h)
+    area_pieza = a * b
+    memo = {}
+
+    def mejor(w, h):
+        clave = (w, h)
+        if clave in memo:
+            return memo[clave]
+        cota = (w * h) // area_pieza
+        resultado = max((w // a) * (h // b), (w // b) * (h // a))
+        # Corte vertical en x y horizontal en y; por simetría basta hasta la mitad
+        for x in normales_w:
+            if resultado >= cota or x > w // 2:
+                break
+            if x:
+                restantes[0] -= 1
+                if restantes[0] < 0:
+                    raise _SinPresupuesto
+                resultado = max(resultado, mejor(x, h) + mejor(_bajar(w - x, normales_w), h))
+        for y in normales_h:
+            if resultado >= cota or y > h // 2:
+                break
+            if y:
+                restantes[0] -= 1
+                if restantes[0] < 0:
+                    raise _SinPresupuesto
+                resultado = max(resultado, mejor(w, y) + mejor(w, _bajar(h - y, normales_h)))
+        memo[clave] = resultado
+        return resultado
+
+    try:
+        return mejor(ancho, alto)
+    except _SinPresupuesto:
+        return max(_rejilla(a, b, ancho, alto), max(memo.values(), default=0))
+
+
+@lru_cache(maxsize=4096)
+def _imponer(ancho, alto, pliego_ancho, pliego_alto, sangrado, calle, pinza):
+    # La calle se suma a la pieza y al área útil: así n piezas ocupan n*p + (n-1)*calle
+    a = _a_entero(ancho + 2 * sangrado + calle)
+    b = _a_entero(alto + 2 * sangrado + calle)
+    if a <= 0 or b <= 0:
+        return 0
+    mejor = 0
+    # La pinza puede quedar en cualquiera de los dos bordes según cómo entre el pliego
+    for w, h in [(pliego_ancho, pliego_alto - pinza), (pliego_ancho - pinza, pliego_alto)]:
+        util_w = _a_entero(w + calle)
+        util_h = _a_entero(h + calle)
+        if util_w < min(a, b) or util_h < min(a, b):
+            continue
+        mejor = max(mejor, _guillotina(a, b, util_w, util_h))
+    return mejor
+
+
+def piezas_por_pliego(ancho, alto, pliego_ancho, pliego_alto, sangrado=None, calle=None, pinza=None):
+    """
+    Número máximo de piezas de ancho x alto que salen de un pliego. El resultado se
+    memoriza por combinación de medidas, así que las cotizaciones repetidas no
+    vuelven a calcular el acomodo.
+    """
+    if ancho <= 0 or alto <= 0 or pliego_ancho <= 0 or pliego_alto <= 0:
+        return 0
+    return _imponer(float(ancho), float(alto), float(pliego_ancho), float(pliego_alto),
+                    SANGRADO if sangrado is None else float(sangrado),
+                    CALLE if calle is None else float(calle),
+                    PINZA if pinza is None else float(pinza))
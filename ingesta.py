@@ -0,0 +1,85 @@
+import os
+import logging
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Ingesta de updates de Telegram: el webhook responde de inmediato y el update se
+# procesa después. Se descartan los update_id repetidos (reintentos de Telegram) y
+# los mensajes de un mismo chat se procesan en orden, uno a la vez, mientras que
+# chats distintos avanzan en paralelo.
+
+INGESTA_HILOS = int(os.getenv("INGESTA_HILOS", "8"))
+INGESTA_IDS_RECIENTES = int(os.getenv("INGESTA_IDS_RECIENTES", "10000"))
+INGESTA_MAX_PENDIENTES = int(os.getenv("INGESTA_MAX_PENDIENTES", "500"))
+
+ACEPTADO = "aceptado"
+DUPLICADO = "duplicado"
+LLENO = "lleno"
+
+
+class Ingesta:
+    def __init__(self, procesar, hilos=INGESTA_HILOS, ids_recientes=INGESTA_IDS_RECIENTES,
+                 max_pendientes=INGESTA_MAX_PENDIENTES):
+        self.procesar = procesar
+        self.ids_recientes = ids_recientes
+        self.max_pendientes = max_pendientes
+        self._vistos = OrderedDict()
+        self._colas = {}
+        self._pendientes = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max(hilos, 1), thread_name_prefix="ingesta")
+
+    def recibir(self, update_id, chat_id, update):
+        """
+        Encola el update para su chat. Devuelve ACEPTADO, DUPLICADO o LLENO; un update
+        rechazado por LLENO no queda marcado como visto, así Telegram lo puede reintentar.
+        """
+        with self._lock:
+            if update_id in self._vistos:
+                return DUPLICADO
+            if self._pendientes >= self.max_pendientes:
+                return LLENO
+            self._vistos[update_id] = None
+            while len(self._vistos) > self.ids_recientes:
+                self._vistos.popitem(last=False)
+            self._pendientes += 1
+            cola = self._colas.get(chat_id)
+            if cola is not None:
+                # El chat ya tiene un hilo drenando su cola; el update espera su turno
+                cola.append(update)
+                return ACEPTADO
+            self._colas[chat_id] = deque([update])
+        self._pool.submit(self._drenar, chat_id)
+        return ACEPTADO
+
+    def _drenar(self, chat_id):
+        while True:
+            with self._lock:
+                cola = self._colas[chat_id]
+                if not cola:
+                    del self._colas[chat_id]
+                    return
+                update = cola.popleft()
+            try:
+                self.procesar(update)
+            except Exception as e:
+                logging.exception(f"Error al procesar update del chat {chat_id}: {e}")
+            finally:
+                with self._lock:
+                    self._pendientes -= 1
+
+    def visto(self, update_id):
+        """
+        True si el update ya se aceptó antes (un reintento de Telegram).
+        """
+        with self._lock:
+            return update_id in self._vistos
+
+    def pendientes(self):
+        with self._lock:
+            return self._pendientes
+
+    def chats_activos(self):
+        with self._lock:
+            return len(self._colas)
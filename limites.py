@@ -0,0 +1,93 @@
+import time
+import threading
+from collections import OrderedDict
+
+# Cubetas de tokens para limitar la tasa de operaciones (envíos a Telegram, mensajes
+# por chat). Cada cubeta se rellena a `tasa` tokens por segundo hasta `capacidad`.
+
+
+class CuboTokens:
+    def __init__(self, tasa, capacidad):
+        self.tasa = float(tasa)
+        self.capacidad = float(capacidad)
+        self._tokens = float(capacidad)
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _rellenar(self, ahora):
+        self._tokens = min(self.capacidad, self._tokens + (ahora - self._ultimo) * self.tasa)
+        self._ultimo = ahora
+
+    def intentar(self, n=1):
+        """
+        Toma n tokens si hay. Devuelve 0 si los tomó o los segundos que faltan para tenerlos.
+        """
+        with self._lock:
+            self._rellenar(time.monotonic())
+            if self._tokens >= n:
+                self._tokens -= n
+                return 0.0
+            return (n - self._tokens) / self.tasa
+
+    def devolver(self, n=1):
+        """
+        Regresa n tokens tomados para una operación que al final no se hizo.
+        """
+        with self._lock:
+            self._rellenar(time.monotonic())
+            self._tokens = min(self.capacidad, self._tokens + n)
+
+    def esperar(self, n=1):
+        """
+        Bloquea hasta tomar n tokens (duerme fuera del lock).
+        """
+        while True:
+            falta = self.intentar(n)
+            if not falta:
+                return
+            time.sleep(falta)
+
+    def lleno(self):
+        with self._lock:
+            self._rellenar(time.monotonic())
+            return self._tokens >= self.capacidad
+
+
+class CubosPorClave:
+    """
+    Una cubeta por clave (p. ej. chat_id). Al pasar de max_claves se descartan las
+    cubetas más antiguas que ya están llenas, que equivalen a una cubeta nueva.
+    """
+
+    def __init__(self, tasa, capacidad, max_claves=10000):
+        self.tasa = tasa
+        self.capacidad = capacidad
+        self.max_claves = max_claves
+        self._cubos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def cubo(self, clave):
+        with self._lock:
+            cubo = self._cubos.get(clave)
+            if cubo is None:
+                cubo = self._cubos[clave] = CuboTokens(self.tasa, self.capacidad)
+                if len(self._cubos) > self.max_claves:
+                    self._podar()
+            else:
+                self._cubos.move_to_end(clave)
+            return cubo
+
+    def _podar(self):
+        # Baja al 90% (de la más antigua a la más reciente) para no podar en cada clave nueva
+        sobran = len(self._cubos) - int(self.max_claves * 0.9)
+        for clave in [c for c, cubo in self._cubos.items() if cubo.lleno()][:sobran]:
+            del self._cubos[clave]
+
+    def intentar(self, clave, n=1):
+        return self.cubo(clave).intentar(n)
+
+    def devolver(self, clave, n=1):
+        self.cubo(clave).devolver(n)
+
+    def esperar(self, clave, n=1):
+        self.cubo(clave).esperar(n)
@@ -0,0 +1,200 @@
+import os
+import io
+import re
+import csv
+import logging
+import zipfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from pasos import EntradaInvalida, numero
+from precios import (DIMENSION_MAXIMA, DIMENSION_MINIMA, MARGEN_DEFECTO, cotizar_lote,
+                     dimension_aceptable, parse_dimension)
+from cotizacion_pdf import generar_pdf
+
+# Cotizaciones en lote: valida las especificaciones, calcula todos los precios en
+# una pasada y genera los PDFs en un pool de procesos (ReportLab usa CPU y el GIL
+# no deja repartirlo entre hilos).
+
+LOTE_MAX = int(os.getenv("LOTE_MAX", "1000"))
+LOTE_PROCESOS = int(os.getenv("LOTE_PROCESOS", str(os.cpu_count() or 2)))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class LoteInvalido(Exception):
+    """
+    Error en los datos del lote; el mensaje indica la fila y `errores` trae uno por fila.
+    """
+
+    def __init__(self, mensaje, errores=()):
+        super().__init__(mensaje)
+        self.errores = list(errores)
+
+
+# Mismas reglas que los pasos de la conversación; (campo, validador, valor por defecto)
+CAMPOS_NUMERICOS = (
+    ("cantidad", numero(int, "la cantidad debe ser un entero", minimo=0, minimo_incluido=False,
+                        error_minimo="la cantidad debe ser mayor a 0"), None),
+    ("adicionales", numero(float, "adicionales debe ser numérico", minimo=0,
+                           error_minimo="adicionales no puede ser negativo"), 0.0),
+    ("margen", numero(float, "el margen debe ser numérico", minimo=0,
+                      error_minimo="el margen no puede ser negativo"), float(MARGEN_DEFECTO)),
+    ("tiro_retiro", numero(float, "tiro_retiro debe ser numérico", minimo=0,
+                           error_minimo="tiro_retiro no puede ser negativo"), 0.0),
+    ("dias", numero(int, "dias debe ser un entero", minimo=0,
+                    error_minimo="dias no puede ser negativo"), 1),
+)
+
+
+def leer_especificaciones(cuerpo, tipo):
+    """
+    Convierte el cuerpo de la petición (JSON o CSV) en una lista de dicts con los campos
+    cliente, producto, dimension, material, cantidad, adicionales, margen, tiro_retiro y dias.
+    """
+    if tipo == "csv":
+        texto = cuerpo.decode("utf-8-sig") if isinstance(cuerpo, bytes) else cuerpo
+        filas = list(csv.DictReader(io.StringIO(texto)))
+    else:
+        filas = cuerpo.get("cotizaciones") if isinstance(cuerpo, dict) else cuerpo
+        if not isinstance(filas, list):
+            raise LoteInvalido("Se esperaba una lista de cotizaciones")
+    if not filas:
+        raise LoteInvalido("El lote está vacío")
+    if len(filas) > LOTE_MAX:
+        raise LoteInvalido(f"El lote tiene {len(filas)} cotizaciones; el máximo es {LOTE_MAX}")
+    return filas
+
+
+def _validar_fila(fila, catalogo):
+    """
+    Especificación normalizada de una fila, o la lista de problemas que tiene.
+    """
+    if not isinstance(fila, dict):
+        return None, ["formato inválido"]
+    problemas = []
+    textos = {}
+    for campo in ("producto", "dimension", "material"):
+        valor = fila.get(campo)
+        textos[campo] = "" if valor is None else str(valor).strip()
+        if not textos[campo]:
+            problemas.append(f"falta el campo '{campo}'")
+    if textos["producto"] and textos["producto"] not in catalogo["productos"]:
+        problemas.append(f"producto desconocido '{textos['producto']}'")
+    if textos["material"] and textos["material"] not in catalogo["material"]:
+        problemas.append(f"material desconocido '{textos['material']}'")
+    if textos["dimension"]:
+        ancho, alto = parse_dimension(textos["dimension"])
+        if ancho <= 0 or alto <= 0:
+            problemas.append(f"dimensión inválida '{textos['dimension']}' (usa 'ancho x alto')")
+        elif not dimension_aceptable(ancho, alto):
+            problemas.append(f"cada medida debe estar entre {DIMENSION_MINIMA:g} y {DIMENSION_MAXIMA:g}")
+    numeros = {}
+    for campo, validador, defecto in CAMPOS_NUMERICOS:
+        valor = fila.get(campo)
+        if valor is None or str(valor).strip() == "":
+            if defecto is None:
+                problemas.append(f"falta el campo '{campo}'")
+            numeros[campo] = defecto
+            continue
+        try:
+            numeros[campo] = validador(str(valor).strip())
+        except EntradaInvalida as e:
+            problemas.append(f"{e} ('{valor}')")
+    if problemas:
+        return None, problemas
+    precio_mat, medida_mat = catalogo["material"][textos["material"]]
+    return {
+        "cliente": str(fila.get("cliente") or "Cliente").strip(),
+        "producto": textos["producto"],
+        "dimension": textos["dimension"],
+        "material": textos["material"],
+        "precio_material": float(precio_mat),
+        "medida_material": medida_mat,
+        **numeros,
+    }, []
+
+
+def validar(filas, catalogo):
+    """
+    Normaliza cada fila y busca el precio y la medida del material en el catálogo.
+    Revisa todas las filas y levanta LoteInvalido con un error por cada fila mala.
+    """
+    especificaciones = []
+    errores = []
+    for i, fila in enumerate(filas, start=1):
+        especificacion, problemas = _validar_fila(fila, catalogo)
+        if problemas:
+            errores.append(f"Fila {i}: " + "; ".join(problemas))
+        else:
+            especificaciones.append(especificacion)
+    if errores:
+        resumen = errores[0] if len(errores) == 1 else f"{len(errores)} filas con errores"
+        raise LoteInvalido(resumen, errores)
+    return especificaciones
+
+
+def precios_lote(especificaciones):
+    totales = cotizar_lote([e["dimension"] for e in especificaciones],
+                           [e["precio_material"] for e in especificaciones],
+                           [e["medida_material"] for e in especificaciones],
+                           [e["cantidad"] for e in especificaciones],
+                           [e["adicionales"] for e in especificaciones],
+                           [e["margen"] for e in especificaciones],
+                           [e["tiro_retiro"] for e in especificaciones])
+    return [float(total) for total in totales]
+
+
+def _pool_procesos():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: los procesos hijos importan solo cotizacion_pdf, no el bot
+            _pool = ProcessPoolExecutor(max_workers=max(LOTE_PROCESOS, 1),
+                                        mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+class _SalidaZip:
+    """
+    Archivo de solo escritura (sin seek) que acumula lo que zipfile va escribiendo.
+    """
+
+    def __init__(self):
+        self._partes = []
+
+    def write(self, datos):
+        self._partes.append(bytes(datos))
+        return len(datos)
+
+    def flush(self):
+        pass
+
+    def vaciar(self):
+        datos = b"".join(self._partes)
+        self._partes = []
+        return datos
+
+
+def generar_zip(especificaciones, totales):
+    """
+    Genera los PDFs en el pool y va entregando el ZIP por partes, en el orden del lote.
+    """
+    pool = _pool_procesos()
+    futuros = []
+    for e, total in zip(especificaciones, totales):
+        descripcion = f"{e['producto']}, Tamaño: {e['dimension']}, Material: {e['material']}"
+        flyer_width = parse_dimension(e["dimension"])[0]
+        futuros.append(pool.submit(generar_pdf, e["cliente"], e["material"], flyer_width,
+                                   e["cantidad"], total, descripcion, None, e["dias"], en_memoria=True))
+    salida = _SalidaZip()
+    # Los PDF ya vienen comprimidos; ZIP_STORED evita gastar CPU en recomprimir
+    with zipfile.ZipFile(salida, "w", zipfile.ZIP_STORED) as archivo:
+        for i, (e, futuro) in enumerate(zip(especificaciones, futuros), start=1):
+            nombre = re.sub(r"[^\w.-]+", "_", e["cliente"])
+            archivo.writestr(f"{i:04d}_cotizacion_{nombre}.pdf", futuro.result())
+            yield salida.vaciar()
+    yield salida.vaciar()
+    logging.info(f"Lote de {len(especificaciones)} cotizaciones generado")
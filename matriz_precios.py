@@ -0,0 +1,141 @@
+import os
+import time
+import logging
+import threading
+
+import db
+from precios import MARGEN_DEFECTO, cotizar, parse_dimension, precio_final
+
+# Matriz de precios materializada (tabla matriz_precios): para cada tamaño de
+# dimensions_volante, cada material y cada cantidad estándar guarda el costo de papel
+# ya calculado, así una cotización rápida es una sola búsqueda por clave primaria.
+# El producto no entra en la fórmula y los cobros adicionales no tienen monto en el
+# catálogo (se preguntan en cada cotización): la matriz solo cambia con los tamaños y
+# los materiales, y sincronizar() recalcula únicamente las combinaciones que cambiaron.
+# programar() la sincroniza en un hilo aparte, para que recargar el catálogo no espere
+# el cálculo; mientras tanto buscar() no devuelve filas calculadas con otro precio.
+
+CANTIDADES = tuple(sorted({int(c) for c in os.getenv("MATRIZ_CANTIDADES", "100,250,500,1000,2000,5000,10000")
+                           .split(",") if c.strip()}))
+
+_firma = None
+_lock = threading.Lock()
+_pendiente = None           # último catálogo que falta sincronizar
+_hilo = None
+_hilo_lock = threading.Lock()
+
+
+def _despues_de_fork():
+    # El hilo de sincronización del padre no existe en el hijo
+    global _hilo, _hilo_lock, _lock
+    _hilo = None
+    _hilo_lock = threading.Lock()
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_despues_de_fork)
+
+
+def combinaciones(catalogo):
+    """
+    {(dimensión, material): (precio, medida)} del catálogo; se omiten los tamaños
+    que no se pueden leer, que la matriz no podría cotizar.
+    """
+    dimensiones = [d for d in catalogo["dimensiones"] if parse_dimension(d)[0] > 0]
+    return {(dimension, material): (float(precio or 0), medida or "")
+            for dimension in dimensiones
+            for material, (precio, medida) in catalogo["material"].items()}
+
+
+def filas_combinacion(dimension, material, precio, medida, ahora):
+    filas = []
+    for cantidad in CANTIDADES:
+        p = cotizar(dimension, precio, medida, cantidad)
+        filas.append((dimension, material, cantidad, precio, medida, p["flyer_width"], p["flyer_height"],
+                      p["flyers_per_sheet"], p["required_sheets"], p["paper_cost"], p["final_cost"], ahora))
+    return filas
+
+
+def sincronizar(catalogo):
+    """
+    Pone la matriz al día con el catálogo: borra las combinaciones que ya no existen y
+    recalcula las nuevas o las que cambiaron de precio o medida. Devuelve cuántas
+    combinaciones recalculó; si el catálogo no cambió desde la última vez no toca la base.
+    """
+    global _firma
+    deseadas = combinaciones(catalogo)
+    firma = (CANTIDADES, sorted(deseadas.items()))
+    with _lock:
+        if firma == _firma:
+            return 0
+        # Otro proceso pudo haberla sincronizado ya: se compara contra lo que hay en la tabla
+        existentes = {(dimension, material): (precio, medida, {int(c) for c in cantidades.split(",")})
+                      for dimension, material, precio, medida, cantidades in db.consultar("matriz_combinaciones")}
+        borrar = [par for par in existentes if par not in deseadas]
+        recalcular = [par for par, (precio, medida) in deseadas.items()
+                      if existentes.get(par) != (precio, medida, set(CANTIDADES))]
+        if borrar or recalcular:
+            ahora = time.time()
+            filas = [fila for par in recalcular for fila in filas_combinacion(*par, *deseadas[par], ahora)]
+            db.ejecutar_varios([("matriz_borrar", borrar + recalcular), ("matriz_insertar", filas)])
+            logging.info(f"Matriz de precios: {len(recalcular)} combinaciones recalculadas, {len(borrar)} borradas")
+        _firma = firma
+        return len(recalcular)
+
+
+def programar(catalogo):
+    """
+    Sincroniza la matriz con `catalogo` en un hilo aparte. Si llegan varios catálogos
+    mientras uno se está sincronizando, después solo se sincroniza el último.
+    """
+    global _pendiente, _hilo
+    with _hilo_lock:
+        _pendiente = catalogo
+        if _hilo is None:
+            _hilo = threading.Thread(target=_sincronizar_pendientes, name="matriz-precios", daemon=True)
+            _hilo.start()
+
+
+def _sincronizar_pendientes():
+    global _pendiente, _hilo
+    while True:
+        with _hilo_lock:
+            catalogo, _pendiente = _pendiente, None
+            if catalogo is None:
+                _hilo = None
+                return
+        try:
+            sincronizar(catalogo)
+        except Exception as e:
+            # Sin matriz las cotizaciones rápidas se calculan con cotizar()
+            logging.error(f"No se pudo actualizar la matriz de precios: {e}")
+
+
+def buscar(dimension, material, cantidad, precio_material, medida_material):
+    """
+    Fila de la matriz para la combinación, o None si la cantidad no es estándar o la
+    fila es de un precio o medida del material que ya no es el del catálogo (la
+    sincronización todavía no llegó).
+    """
+    filas = db.consultar_filas("matriz_precio", (dimension, material, cantidad))
+    if not filas:
+        return None
+    fila = filas[0]
+    if (fila["precio_material"], fila["medida_material"]) != (float(precio_material or 0), medida_material or ""):
+        return None
+    return fila
+
+
+def precio(fila, adicionales=(), margin=MARGEN_DEFECTO, costo_tr=0.0):
+    """
+    Mismo resultado que precios.cotizar, a partir de una fila de la matriz.
+    """
+    return {
+        "flyer_width": fila["ancho"],
+        "flyer_height": fila["alto"],
+        "flyers_per_sheet": fila["piezas_por_pliego"],
+        "required_sheets": fila["pliegos"],
+        "paper_cost": fila["costo_papel"],
+        "additional_costs": sum(adicionales) + costo_tr,
+        "final_cost": precio_final(fila["costo_papel"], adicionales, margin, costo_tr),
+    }
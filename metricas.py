@@ -0,0 +1,125 @@
+import time
+import logging
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Métricas en proceso (contadores, histogramas de latencia e indicadores) expuestas
+# en formato de texto de Prometheus por la ruta /metrics. Cada observación es un
+# bisect y una suma bajo un lock, así que se pueden dejar siempre activas.
+
+# Límites de los histogramas en segundos
+LIMITES = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registro = []
+_registro_lock = threading.Lock()
+
+
+def _registrar(metrica):
+    with _registro_lock:
+        _registro.append(metrica)
+    return metrica
+
+
+def _etiquetas(nombre, valor, extra=""):
+    partes = []
+    if nombre is not None:
+        partes.append(f'{nombre}="{valor}"')
+    if extra:
+        partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+
+class Contador:
+    def __init__(self, nombre, ayuda, etiqueta=None):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiqueta = etiqueta
+        self._valores = {}
+        self._lock = threading.Lock()
+        _registrar(self)
+
+    def incrementar(self, valor_etiqueta=None, n=1):
+        with self._lock:
+            self._valores[valor_etiqueta] = self._valores.get(valor_etiqueta, 0) + n
+
+    def exportar(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} counter"]
+        with self._lock:
+            for valor, total in sorted(self._valores.items(), key=lambda v: str(v[0])):
+                lineas.append(f"{self.nombre}{_etiquetas(self.etiqueta, valor)} {total}")
+        return lineas
+
+
+class Histograma:
+    def __init__(self, nombre, ayuda, etiqueta=None, limites=LIMITES):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiqueta = etiqueta
+        self.limites = tuple(limites)
+        self._series = {}  # valor de etiqueta -> [cubetas..., suma, cuenta]
+        self._lock = threading.Lock()
+        _registrar(self)
+
+    def observar(self, segundos, valor_etiqueta=None):
+        i = bisect_left(self.limites, segundos)
+        with self._lock:
+            serie = self._series.get(valor_etiqueta)
+            if serie is None:
+                serie = self._series[valor_etiqueta] = [0] * (len(self.limites) + 1) + [0.0, 0]
+            serie[i] += 1
+            serie[-2] += segundos
+            serie[-1] += 1
+
+    @contextmanager
+    def medir(self, valor_etiqueta=None):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(time.perf_counter() - inicio, valor_etiqueta)
+
+    def exportar(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        with self._lock:
+            series = {valor: list(serie) for valor, serie in self._series.items()}
+        for valor, serie in sorted(series.items(), key=lambda v: str(v[0])):
+            acumulado = 0
+            for limite, cuenta in zip(self.limites + (float("inf"),), serie):
+                acumulado += cuenta
+                le = 'le="+Inf"' if limite == float("inf") else f'le="{limite}"'
+                lineas.append(f"{self.nombre}_bucket{_etiquetas(self.etiqueta, valor, le)} {acumulado}")
+            lineas.append(f"{self.nombre}_sum{_etiquetas(self.etiqueta, valor)} {serie[-2]}")
+            lineas.append(f"{self.nombre}_count{_etiquetas(self.etiqueta, valor)} {serie[-1]}")
+        return lineas
+
+
+class Indicador:
+    """
+    Valor que se calcula al momento de exportar: instantáneo (gauge) o, con
+    tipo="counter", un total que solo crece y que lleva otro componente.
+    """
+
+    def __init__(self, nombre, ayuda, funcion, tipo="gauge"):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.funcion = funcion
+        self.tipo = tipo
+        _registrar(self)
+
+    def exportar(self):
+        try:
+            valor = self.funcion()
+        except Exception as e:
+            logging.warning(f"No se pudo calcular la métrica {self.nombre}: {e}")
+            return []
+        return [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}", f"{self.nombre} {valor}"]
+
+
+def exportar():
+    with _registro_lock:
+        metricas = list(_registro)
+    lineas = []
+    for metrica in metricas:
+        lineas.extend(metrica.exportar())
+    return "\n".join(lineas) + "\n"
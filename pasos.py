@@ -0,0 +1,119 @@
+import math
+import time
+import threading
+
+# Motor de la conversación: cada paso se registra con su manejador, su validador
+# y el paso al que regresa con "r". Lo usan el bot de Telegram (app.py) y el de
+# Twilio/WhatsApp (test.py).
+
+
+class EntradaInvalida(Exception):
+    """
+    El mensaje no sirve para el paso actual; el texto de la excepción se le responde al usuario.
+    """
+
+
+class Paso:
+    __slots__ = ("nombre", "manejador", "validador", "atras")
+
+    def __init__(self, nombre, manejador, validador=None, atras=None):
+        self.nombre = nombre
+        self.manejador = manejador
+        self.validador = validador
+        self.atras = atras
+
+
+class MaquinaPasos:
+    """
+    Registro de pasos con despacho directo por nombre (un dict, no una cadena de if/elif).
+    """
+
+    def __init__(self, nombre):
+        self.nombre = nombre
+        self.pasos = {}
+        self._tiempos = {}
+        self._lock = threading.Lock()
+
+    def paso(self, nombre, atras=None, validador=None):
+        """
+        Decorador para registrar el manejador de un paso: manejador(sesion, valor, *extra) -> respuesta.
+        """
+        def registrar(manejador):
+            self.pasos[nombre] = Paso(nombre, manejador, validador, atras)
+            return manejador
+        return registrar
+
+    def anterior(self, nombre):
+        paso = self.pasos.get(nombre)
+        return paso.atras if paso else None
+
+    def despachar(self, sesion, mensaje, *extra):
+        """
+        Valida el mensaje y corre el manejador del paso en que está la sesión.
+        Devuelve None si el paso no está registrado.
+        """
+        nombre = sesion.get("step")
+        paso = self.pasos.get(nombre)
+        if paso is None:
+            return None
+        inicio = time.perf_counter()
+        try:
+            valor = paso.validador(mensaje) if paso.validador else mensaje
+            return paso.manejador(sesion, valor, *extra)
+        except EntradaInvalida as e:
+            return str(e)
+        finally:
+            self._registrar_tiempo(nombre, time.perf_counter() - inicio)
+
+    def _registrar_tiempo(self, nombre, segundos):
+        with self._lock:
+            mensajes, total, maximo = self._tiempos.get(nombre, (0, 0.0, 0.0))
+            self._tiempos[nombre] = (mensajes + 1, total + segundos, max(maximo, segundos))
+
+    def tiempos(self):
+        """
+        Tiempo por paso en milisegundos: {paso: {"mensajes", "promedio_ms", "max_ms"}}.
+        """
+        with self._lock:
+            return {
+                nombre: {
+                    "mensajes": mensajes,
+                    "promedio_ms": round(total / mensajes * 1000, 3),
+                    "max_ms": round(maximo * 1000, 3),
+                }
+                for nombre, (mensajes, total, maximo) in self._tiempos.items()
+            }
+
+
+# Validadores comunes
+
+def numero(tipo, error, minimo=None, error_minimo=None, minimo_incluido=True):
+    """
+    Convierte el mensaje con `tipo` (int/float) y rechaza nan/inf; `minimo` rechaza
+    valores menores (o iguales, si minimo_incluido=False) con error_minimo.
+    """
+    def validar(mensaje):
+        try:
+            valor = tipo(mensaje)
+        except ValueError:
+            raise EntradaInvalida(error)
+        if not math.isfinite(valor):
+            raise EntradaInvalida(error)
+        if minimo is not None and (valor < minimo or (not minimo_incluido and valor == minimo)):
+            raise EntradaInvalida(error_minimo or error)
+        return valor
+    return validar
+
+
+def si_no(error):
+    """
+    Acepta 'si'/'sí'/'no' (sin importar mayúsculas) y devuelve True o False.
+    """
+    def validar(mensaje):
+        respuesta = mensaje.lower()
+        if respuesta in ["si", "sí"]:
+            return True
+        if respuesta == "no":
+            return False
+        raise EntradaInvalida(error)
+    return validar
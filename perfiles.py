@@ -0,0 +1,135 @@
+import os
+import re
+import time
+import logging
+import itertools
+import threading
+
+# Perfilado bajo demanda con cProfile: una de cada N ejecuciones (muestreo) o todas las
+# de un chat marcado por un administrador durante unos minutos. Cada perfil se guarda
+# como <ms>-<tipo>-<etiqueta>-<pid>.prof en un directorio con un máximo de archivos
+# (se borran los más viejos) y resumen() junta los de cada tipo y etiqueta (p. ej. el
+# paso de la conversación) en las funciones con más tiempo propio.
+# Apagado (muestreo 0 y sin chats marcados) el costo es leer el atributo `activo`.
+
+# El PDF de un mensaje perfilado empieza antes de que termine el perfil del mensaje
+ESPERA = 1.0
+
+
+class Perfilador:
+    def __init__(self, directorio, muestreo=0, maximo=200):
+        self.directorio = directorio
+        self.muestreo = max(int(muestreo), 0)
+        self.maximo = max(int(maximo), 1)
+        self.activo = self.muestreo > 0
+        self._marcados = {}             # clave -> hasta cuándo (time.monotonic)
+        self._contadores = {}           # tipo -> itertools.count
+        self._lock = threading.Lock()
+        # Un perfil a la vez: desde Python 3.12 cProfile no admite dos activos
+        self._perfilando = threading.Lock()
+
+    def marcar(self, clave, minutos=10):
+        """
+        Perfila todo lo de `clave` (un chat) durante los próximos minutos; 0 quita la marca.
+        """
+        with self._lock:
+            if minutos > 0:
+                self._marcados[clave] = time.monotonic() + minutos * 60
+            else:
+                self._marcados.pop(clave, None)
+            self.activo = self.muestreo > 0 or bool(self._marcados)
+
+    def elegir(self, tipo, clave=None):
+        """
+        True si esta ejecución se perfila: la clave está marcada o le toca por muestreo.
+        """
+        with self._lock:
+            if self._marcados:
+                ahora = time.monotonic()
+                for vencida in [c for c, hasta in self._marcados.items() if hasta < ahora]:
+                    del self._marcados[vencida]
+                self.activo = self.muestreo > 0 or bool(self._marcados)
+                if clave in self._marcados:
+                    return True
+            if not self.muestreo:
+                return False
+            contador = self._contadores.setdefault(tipo, itertools.count())
+            return next(contador) % self.muestreo == 0
+
+    def correr(self, tipo, etiqueta, funcion, *args, **kwargs):
+        """
+        Ejecuta funcion(*args, **kwargs) con cProfile y guarda el perfil. Si otro perfil
+        sigue en curso después de ESPERA segundos la ejecuta sin perfilar.
+        """
+        if not self._perfilando.acquire(timeout=ESPERA):
+            return funcion(*args, **kwargs)
+        try:
+            import cProfile
+
+            perfil = cProfile.Profile()
+            perfil.enable()
+            try:
+                return funcion(*args, **kwargs)
+            finally:
+                perfil.disable()
+                self._guardar(perfil, tipo, etiqueta)
+        finally:
+            self._perfilando.release()
+
+    def _guardar(self, perfil, tipo, etiqueta):
+        try:
+            os.makedirs(self.directorio, exist_ok=True)
+            etiqueta = re.sub(r"[^\w]+", "_", str(etiqueta))[:40] or "ninguno"
+            nombre = f"{int(time.time() * 1000)}-{tipo}-{etiqueta}-{os.getpid()}.prof"
+            perfil.dump_stats(os.path.join(self.directorio, nombre))
+            self._rotar()
+        except OSError as e:
+            logging.error(f"No se pudo guardar el perfil: {e}")
+
+    def _archivos(self):
+        try:
+            return sorted(n for n in os.listdir(self.directorio) if n.endswith(".prof"))
+        except FileNotFoundError:
+            return []
+
+    def _rotar(self):
+        archivos = self._archivos()
+        for nombre in archivos[:max(len(archivos) - self.maximo, 0)]:
+            try:
+                os.remove(os.path.join(self.directorio, nombre))
+            except FileNotFoundError:
+                pass
+
+    def resumen(self, top=15, tipo=None):
+        """
+        {tipo: {etiqueta: {"perfiles": n, "funciones": [...]}}} con las `top` funciones de
+        más tiempo propio sumando todos los perfiles guardados de cada tipo y etiqueta.
+        """
+        import pstats
+
+        grupos = {}
+        for nombre in self._archivos():
+            partes = nombre[:-len(".prof")].split("-")
+            if len(partes) != 4 or (tipo and partes[1] != tipo):
+                continue
+            grupos.setdefault((partes[1], partes[2]), []).append(os.path.join(self.directorio, nombre))
+        salida = {}
+        for (tipo_perfil, etiqueta), rutas in sorted(grupos.items()):
+            try:
+                estadisticas = pstats.Stats(*rutas)
+            except (OSError, EOFError, TypeError, ValueError) as e:
+                # Un archivo a medio rotar o truncado no impide ver el resto
+                logging.warning(f"Perfiles de {tipo_perfil}/{etiqueta} ilegibles: {e}")
+                continue
+            filas = sorted(estadisticas.stats.items(), key=lambda item: item[1][2], reverse=True)[:top]
+            salida.setdefault(tipo_perfil, {})[etiqueta] = {
+                "perfiles": len(rutas),
+                "funciones": [{
+                    # Las funciones de C vienen como ("~", 0, "<built-in method ...>")
+                    "funcion": funcion if archivo == "~" else f"{os.path.basename(archivo)}:{linea}({funcion})",
+                    "llamadas": llamadas,
+                    "propio_ms": round(propio * 1000, 3),
+                    "acumulado_ms": round(acumulado * 1000, 3),
+                } for (archivo, linea, funcion), (_primitivas, llamadas, propio, acumulado, _) in filas],
+            }
+        return salida
@@ -0,0 +1,139 @@
+import os
+import re
+import math
+
+from imposicion import piezas_por_pliego
+
+# Motor de precios de cotizaciones: la fórmula del paso "confirmacion" para una
+# cotización (cotizar), para muchas a la vez con NumPy (cotizar_lote) y sobre el
+# costo de papel precalculado en la matriz de precios (precio_final).
+
+DIMENSION_ALIASES = {
+    "carta 8.5x11": (8.5, 11),        # 8.5" x 11"
+    "oficio 8.5x14": (8.5, 14),       # 8.5" x 14"
+    "media carta 8.5x5.5": (8.5, 5.5),  # 8.5" x 5.5"
+    "medio oficio 8.5x7": (8.5, 7),   # 8.5" x 7"
+    # Agrega aquí más equivalencias si lo requieres...
+}
+
+HOJAS_POR_RESMA = 500.0   # el precio del material es por resma
+HOJAS_EXTRA = 2           # hojas de arranque/merma por trabajo
+MARGEN_DEFECTO = 50
+FACTOR_IVA = 1.17
+# Medidas aceptables para un tamaño que escribe el usuario (mismas unidades que el catálogo)
+DIMENSION_MINIMA = float(os.getenv("DIMENSION_MINIMA", "0.5"))
+DIMENSION_MAXIMA = float(os.getenv("DIMENSION_MAXIMA", "200"))
+
+
+def parse_dimension(dim_str: str) -> (float, float):
+    """
+    Devuelve (width, height) en cm a partir de una cadena como '20x30', 'carta' o 'carta 8.5x11'.
+    Si no se puede parsear, devuelve (0,0).
+    """
+    dim_str = dim_str.lower().strip()
+
+    # Buscar un patrón que contenga dos números separados por "x"
+    match = re.search(r'(\d+(?:\.\d+)?)\s*x\s*(\d+(?:\.\d+)?)', dim_str)
+    if match:
+        try:
+            w = float(match.group(1))
+            h = float(match.group(2))
+            if w > 0 and h > 0:
+                return (w, h)
+        except Exception:
+            return (0, 0)
+
+    # Si no se encontró un patrón numérico, se busca el alias completo en DIMENSION_ALIASES.
+    if dim_str in DIMENSION_ALIASES:
+        return DIMENSION_ALIASES[dim_str]
+
+    return (0, 0)
+
+
+def medidas_material(mat_medida):
+    """
+    Medidas (ancho, alto) del pliego de material; (0, 0) si no se pueden leer.
+    """
+    try:
+        if "x" in mat_medida:
+            mw, mh = mat_medida.lower().split("x")
+            mat_w, mat_h = float(mw), float(mh)
+            if mat_w <= 0 or mat_h <= 0:
+                return (0, 0)
+            return (mat_w, mat_h)
+        return parse_dimension(mat_medida)
+    except Exception:
+        return (0, 0)
+
+
+def dimension_aceptable(width, height):
+    """
+    True si ambas medidas están entre DIMENSION_MINIMA y DIMENSION_MAXIMA.
+    """
+    return DIMENSION_MINIMA <= min(width, height) and max(width, height) <= DIMENSION_MAXIMA
+
+
+def flyers_per_sheet(flyer_w, flyer_h, mat_w, mat_h):
+    """
+    Piezas por pliego según la imposición real (ver imposicion.py); mínimo 1.
+    """
+    return max(piezas_por_pliego(flyer_w, flyer_h, mat_w, mat_h), 1)
+
+
+def cotizar(dim_str, mat_price, mat_medida, cantidad, adicionales=(), margin=MARGEN_DEFECTO, costo_tr=0.0):
+    """
+    Precio de una cotización. `adicionales` son los montos de cobros adicionales y
+    costos extra; `costo_tr` es el costo de tiro-retiro.
+    """
+    flyer_width, flyer_height = parse_dimension(dim_str)
+    mat_w, mat_h = medidas_material(mat_medida)
+    por_hoja = flyers_per_sheet(flyer_width, flyer_height, mat_w, mat_h)
+    required_sheets = math.ceil(cantidad / por_hoja) + HOJAS_EXTRA
+    paper_cost = required_sheets * (mat_price / HOJAS_POR_RESMA)
+    return {
+        "flyer_width": flyer_width,
+        "flyer_height": flyer_height,
+        "flyers_per_sheet": por_hoja,
+        "required_sheets": required_sheets,
+        "paper_cost": paper_cost,
+        "additional_costs": sum(adicionales) + costo_tr,
+        "final_cost": precio_final(paper_cost, adicionales, margin, costo_tr),
+    }
+
+
+def precio_final(paper_cost, adicionales=(), margin=MARGEN_DEFECTO, costo_tr=0.0):
+    """
+    Costo final a partir del costo del papel (lo único que depende del catálogo; ver
+    matriz_precios.py): cobros adicionales, margen, tiro-retiro e IVA.
+    """
+    total_cost = paper_cost + (sum(adicionales) + costo_tr)
+    return (total_cost * (1 + margin / 100.0) + costo_tr) * FACTOR_IVA
+
+
+def cotizar_lote(dimensiones, precios_material, medidas, cantidades, adicionales=None, margenes=None, costos_tr=None):
+    """
+    Misma fórmula que `cotizar` sobre arreglos (una posición por variante).
+    `adicionales` es la suma de cobros adicionales de cada variante. Las cadenas
+    de dimensión y de medida y la imposición se calculan una sola vez por valor distinto.
+    Devuelve un arreglo NumPy con el costo final de cada variante.
+    """
+    import numpy as np
+
+    n = len(cantidades)
+    dims_unicas = {d: parse_dimension(d) for d in set(dimensiones)}
+    medidas_unicas = {m: medidas_material(m) for m in set(medidas)}
+    # La imposición se calcula una vez por par (dimensión, medida) distinto
+    pares = {par: flyers_per_sheet(*dims_unicas[par[0]], *medidas_unicas[par[1]])
+             for par in set(zip(dimensiones, medidas))}
+    por_hoja = np.array([pares[par] for par in zip(dimensiones, medidas)], dtype=float)
+
+    cantidades = np.asarray(cantidades, dtype=float)
+    precios = np.asarray(precios_material, dtype=float)
+    extras = np.zeros(n) if adicionales is None else np.asarray(adicionales, dtype=float)
+    margenes = np.full(n, MARGEN_DEFECTO, dtype=float) if margenes is None else np.asarray(margenes, dtype=float)
+    tiro_retiro = np.zeros(n) if costos_tr is None else np.asarray(costos_tr, dtype=float)
+
+    required_sheets = np.ceil(cantidades / por_hoja) + HOJAS_EXTRA
+    paper_cost = required_sheets * (precios / HOJAS_POR_RESMA)
+    total_cost = paper_cost + extras + tiro_retiro
+    return (total_cost * (1 + margenes / 100.0) + tiro_retiro) * FACTOR_IVA
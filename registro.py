@@ -0,0 +1,134 @@
+import os
+import json
+import copy
+import time
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
+
+# Logging sin bloquear el hilo del webhook: los registros pasan por una cola y un
+# hilo (QueueListener) los escribe en disco como JSON, con rotación por tamaño o por día.
+# El archivo se abre y el hilo arranca con el primer registro de cada proceso: un hilo
+# creado antes del fork de gunicorn (--preload) no existe en los workers.
+
+LOG_FILE = os.getenv("SERI_LOG_FILE", "/var/www/db_serigraph/logs/serigraph.log")
+LOG_ROTACION = os.getenv("SERI_LOG_ROTACION", "tamano")     # "tamano" o "diaria"
+LOG_MAX_MB = int(os.getenv("SERI_LOG_MAX_MB", "20"))
+LOG_RESPALDOS = int(os.getenv("SERI_LOG_RESPALDOS", "10"))
+LOG_COLA_MAX = int(os.getenv("SERI_LOG_COLA_MAX", "10000"))
+# Nivel por módulo: "root=INFO,telegram=WARNING,werkzeug=WARNING"
+LOG_NIVELES = os.getenv("SERI_LOG_NIVELES", "root=INFO,telegram=WARNING,urllib3=WARNING,werkzeug=WARNING")
+
+# Campos extra que se copian al JSON si vienen en el registro (logging.info(..., extra={...}))
+CAMPOS_EXTRA = ("chat_id", "step", "latencia_ms", "update_id")
+
+_manejador = None
+
+
+class FormatoJSON(logging.Formatter):
+    def format(self, record):
+        datos = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "nivel": record.levelname,
+            "modulo": record.name,
+            "mensaje": record.getMessage(),
+        }
+        for campo in CAMPOS_EXTRA:
+            valor = getattr(record, campo, None)
+            if valor is not None:
+                datos[campo] = valor
+        if record.exc_info:
+            datos["excepcion"] = self.formatException(record.exc_info)
+        return json.dumps(datos, ensure_ascii=False, default=str)
+
+
+class ColaSinBloqueo(logging.handlers.QueueHandler):
+    """
+    Si la cola está llena se descarta el registro en lugar de frenar la petición.
+    Cada proceso tiene su propia cola y su propio QueueListener, creados con su primer registro.
+    """
+
+    descartados = 0
+    _descartados_lock = threading.Lock()
+
+    def __init__(self, manejadores, max_cola=LOG_COLA_MAX):
+        super().__init__(queue.Queue(maxsize=max_cola))
+        self.manejadores = manejadores
+        self.max_cola = max_cola
+        self._pid = None
+        self._arranque_lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._despues_de_fork)
+
+    def _despues_de_fork(self):
+        # El lock pudo quedar tomado por un hilo que no existe en el hijo
+        self._arranque_lock = threading.Lock()
+        ColaSinBloqueo._descartados_lock = threading.Lock()
+
+    def _asegurar_listener(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._arranque_lock:
+            if self._pid == pid:
+                return
+            self.queue = queue.Queue(maxsize=self.max_cola)
+            listener = logging.handlers.QueueListener(self.queue, *self.manejadores, respect_handler_level=True)
+            listener.start()
+            atexit.register(listener.stop)
+            self._pid = pid
+
+    def prepare(self, record):
+        # QueueHandler.prepare mete el traceback en msg y borra exc_info; aquí solo se
+        # resuelven los argumentos y FormatoJSON sigue escribiendo la excepción aparte.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        self._asegurar_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with ColaSinBloqueo._descartados_lock:
+                ColaSinBloqueo.descartados += 1
+
+
+def _niveles(texto):
+    niveles = {}
+    for parte in texto.split(","):
+        if "=" in parte:
+            nombre, nivel = parte.split("=", 1)
+            niveles[nombre.strip()] = nivel.strip().upper()
+    return niveles
+
+
+def _manejador_archivo():
+    if LOG_ROTACION == "diaria":
+        manejador = logging.handlers.TimedRotatingFileHandler(
+            LOG_FILE, when="midnight", backupCount=LOG_RESPALDOS, encoding="utf-8", delay=True)
+    else:
+        manejador = logging.handlers.RotatingFileHandler(
+            LOG_FILE, maxBytes=LOG_MAX_MB * 1024 * 1024, backupCount=LOG_RESPALDOS, encoding="utf-8",
+            delay=True)
+    manejador.setFormatter(FormatoJSON())
+    return manejador
+
+
+def configurar():
+    """
+    Instala la cola de logging en el logger raíz. Igual que logging.basicConfig,
+    no hace nada si ya hay handlers configurados (por ejemplo en el benchmark).
+    No abre el archivo ni arranca hilos: eso pasa con el primer registro del proceso.
+    """
+    global _manejador
+    raiz = logging.getLogger()
+    if _manejador is not None or raiz.handlers:
+        return _manejador
+    _manejador = ColaSinBloqueo([_manejador_archivo()])
+    raiz.addHandler(_manejador)
+    for nombre, nivel in _niveles(LOG_NIVELES).items():
+        logging.getLogger(None if nombre == "root" else nombre).setLevel(nivel)
+    return _manejador
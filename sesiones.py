@@ -0,0 +1,183 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+import db
+
+# Estado de conversación compartido entre procesos de gunicorn.
+# Cada sesión es el dict del paso actual ("step", "client_name", ...) asociado a un chat.
+
+SESIONES_BACKEND = os.getenv("SESIONES_BACKEND", "sqlite")
+SESIONES_DB = os.getenv("SESIONES_DB", "/var/www/db_serigraph/sesiones.db")
+SESIONES_TTL = int(os.getenv("SESIONES_TTL", str(6 * 3600)))       # segundos sin actividad
+SESIONES_CACHE_MAX = int(os.getenv("SESIONES_CACHE_MAX", "1000"))  # entradas en memoria
+
+
+def serializar(datos):
+    # JSON compacto; las tuplas (producto, material, ...) vuelven como listas
+    return json.dumps(datos, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def deserializar(blob):
+    return json.loads(blob)
+
+
+class SesionesMemoria:
+    """
+    Sesiones en un dict local del proceso, con expiración y límite de tamaño (LRU).
+    Sirve para un solo proceso o para desarrollo.
+    """
+
+    def __init__(self, ttl=SESIONES_TTL, max_entradas=SESIONES_CACHE_MAX):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, chat_id):
+        with self._lock:
+            entrada = self._datos.get(chat_id)
+            if entrada is None:
+                return None
+            expira, datos = entrada
+            if expira < time.time():
+                del self._datos[chat_id]
+                return None
+            self._datos.move_to_end(chat_id)
+            return deserializar(datos)
+
+    def guardar(self, chat_id, datos):
+        with self._lock:
+            self._datos[chat_id] = (time.time() + self.ttl, serializar(datos))
+            self._datos.move_to_end(chat_id)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+
+    def borrar(self, chat_id):
+        with self._lock:
+            self._datos.pop(chat_id, None)
+
+    def activas(self):
+        with self._lock:
+            ahora = time.time()
+            return sum(1 for expira, _ in self._datos.values() if expira >= ahora)
+
+
+class SesionesSQLite:
+    """
+    Sesiones en SQLite (modo WAL) compartidas por todos los procesos, con una caché
+    LRU al frente. Cada escritura sube la columna version; la caché solo se usa si la
+    versión guardada en la base sigue siendo la misma.
+    """
+
+    PURGAR_CADA = 200  # escrituras entre cada limpieza de sesiones vencidas
+
+    def __init__(self, ruta=SESIONES_DB, ttl=SESIONES_TTL, max_cache=SESIONES_CACHE_MAX):
+        self.ruta = ruta
+        self.ttl = ttl
+        self.max_cache = max_cache
+        self._local = threading.local()
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._escrituras = 0
+        self._tabla_lista = False  # la tabla se crea con la primera conexión, no al importar
+
+    def _conexion(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = db.conectar(self.ruta)
+            self._local.conn = conn
+            if not self._tabla_lista:
+                self._crear_tabla(conn)
+        return conn
+
+    def _crear_tabla(self, conn):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS sesiones (
+                chat_id TEXT PRIMARY KEY,
+                datos BLOB NOT NULL,
+                version INTEGER NOT NULL,
+                expira REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sesiones_expira ON sesiones (expira)")
+        conn.commit()
+        self._tabla_lista = True
+
+    def _cachear(self, chat_id, version, blob):
+        with self._lock:
+            self._cache[chat_id] = (version, blob)
+            self._cache.move_to_end(chat_id)
+            while len(self._cache) > self.max_cache:
+                self._cache.popitem(last=False)
+
+    def obtener(self, chat_id):
+        chat_id = str(chat_id)
+        conn = self._conexion()
+        with self._lock:
+            en_cache = self._cache.get(chat_id)
+        if en_cache is not None:
+            fila = conn.execute("SELECT version, expira FROM sesiones WHERE chat_id=?", (chat_id,)).fetchone()
+            if fila and fila[0] == en_cache[0] and fila[1] >= time.time():
+                with self._lock:
+                    if chat_id in self._cache:
+                        self._cache.move_to_end(chat_id)
+                return deserializar(en_cache[1])
+        fila = conn.execute("SELECT version, expira, datos FROM sesiones WHERE chat_id=?", (chat_id,)).fetchone()
+        if fila is None or fila[1] < time.time():
+            with self._lock:
+                self._cache.pop(chat_id, None)
+            return None
+        self._cachear(chat_id, fila[0], fila[2])
+        return deserializar(fila[2])
+
+    def guardar(self, chat_id, datos):
+        chat_id = str(chat_id)
+        blob = serializar(datos)
+        conn = self._conexion()
+        with conn:
+            conn.execute("""
+                INSERT INTO sesiones (chat_id, datos, version, expira) VALUES (?, ?, 1, ?)
+                ON CONFLICT(chat_id) DO UPDATE SET
+                    datos=excluded.datos, version=sesiones.version + 1, expira=excluded.expira
+            """, (chat_id, blob, time.time() + self.ttl))
+            version = conn.execute("SELECT version FROM sesiones WHERE chat_id=?", (chat_id,)).fetchone()[0]
+        self._cachear(chat_id, version, blob)
+        with self._lock:
+            self._escrituras += 1
+            toca_purgar = self._escrituras % self.PURGAR_CADA == 0
+        if toca_purgar:
+            self.purgar()
+
+    def borrar(self, chat_id):
+        chat_id = str(chat_id)
+        conn = self._conexion()
+        with conn:
+            conn.execute("DELETE FROM sesiones WHERE chat_id=?", (chat_id,))
+        with self._lock:
+            self._cache.pop(chat_id, None)
+
+    def purgar(self):
+        """
+        Elimina las sesiones abandonadas (vencidas por TTL).
+        """
+        conn = self._conexion()
+        with conn:
+            borradas = conn.execute("DELETE FROM sesiones WHERE expira < ?", (time.time(),)).rowcount
+        if borradas:
+            logging.info(f"Sesiones vencidas eliminadas: {borradas}")
+
+    def activas(self):
+        fila = self._conexion().execute("SELECT COUNT(*) FROM sesiones WHERE expira >= ?", (time.time(),)).fetchone()
+        return fila[0]
+
+
+def crear_almacen(backend=SESIONES_BACKEND):
+    if backend == "memoria":
+        return SesionesMemoria()
+    if backend == "sqlite":
+        return SesionesSQLite()
+    raise ValueError(f"Backend de sesiones desconocido: {backend}")
@@ -0,0 +1,137 @@
+"""
+Servidor local que imita la Bot API de Telegram (getMe, sendMessage, sendDocument)
+para el benchmark y las pruebas de carga. Responde con el mismo formato JSON que
+Telegram, puede simular la latencia de red y el límite de mensajes por segundo
+(respuestas 429 con retry_after) y cuenta lo recibido por método y por chat.
+`al_recibir(chat_id, contenido)` se llama con cada mensaje o documento entregado
+(carga.py lo usa para medir la latencia de punta a punta).
+
+    python stub_telegram.py --puerto 8081 --latencia-ms 40
+    TELEGRAM_API_URL=http://127.0.0.1:8081 gunicorn app:app
+"""
+import re
+import json
+import time
+import argparse
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from limites import CuboTokens
+
+_RUTA = re.compile(r"^/bot[^/]+/(\w+)$")
+_CHAT_MULTIPART = re.compile(rb'name="chat_id"\r\n\r\n(-?\d+)')
+
+
+class StubTelegram:
+    def __init__(self, puerto=0, latencia_ms=0.0, limite_por_segundo=None, al_recibir=None):
+        self.latencia = latencia_ms / 1000
+        self.limite = CuboTokens(limite_por_segundo, limite_por_segundo) if limite_por_segundo else None
+        self.mensajes = 0
+        self.documentos = 0
+        self.reenviados = 0
+        self.limitados = 0
+        self.por_chat = defaultdict(list)   # chat_id -> textos y documentos en orden de llegada
+        self.al_recibir = al_recibir
+        self._lock = threading.Lock()
+        self._ids = 0
+        stub = self
+
+        class Manejador(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"   # keep-alive, como api.telegram.org
+            disable_nagle_algorithm = True  # encabezados y cuerpo salen en escrituras separadas
+
+            def do_POST(self):
+                cuerpo = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                codigo, datos = stub.responder(self.path, self.headers.get("Content-Type", ""), cuerpo)
+                salida = json.dumps(datos).encode("utf-8")
+                self.send_response(codigo)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(salida)))
+                self.end_headers()
+                self.wfile.write(salida)
+
+            do_GET = do_POST
+
+            def log_message(self, *args):
+                pass
+
+        self.servidor = ThreadingHTTPServer(("127.0.0.1", puerto), Manejador)
+        self.servidor.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.servidor.server_address[1]}"
+
+    def _siguiente_id(self):
+        with self._lock:
+            self._ids += 1
+            return self._ids
+
+    def responder(self, ruta, tipo, cuerpo):
+        coincidencia = _RUTA.match(ruta.split("?")[0])
+        if not coincidencia:
+            return 404, {"ok": False, "error_code": 404, "description": "Not Found"}
+        metodo = coincidencia.group(1)
+        if metodo == "getMe":
+            return 200, {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "Stub", "username": "stub_bot"}}
+        if self.limite is not None and self.limite.intentar():
+            with self._lock:
+                self.limitados += 1
+            return 429, {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                         "parameters": {"retry_after": 1}}
+        if self.latencia:
+            time.sleep(self.latencia)
+        if tipo.startswith("application/json"):
+            campos = json.loads(cuerpo or b"{}")
+            chat_id = campos.get("chat_id")
+        else:
+            campos = {}
+            encontrado = _CHAT_MULTIPART.search(cuerpo)
+            chat_id = int(encontrado.group(1)) if encontrado else None
+        mensaje_id = self._siguiente_id()
+        resultado = {"message_id": mensaje_id, "date": int(time.time()), "chat": {"id": chat_id, "type": "private"}}
+        with self._lock:
+            if metodo == "sendMessage":
+                self.mensajes += 1
+                resultado["text"] = campos.get("text", "")
+                contenido = resultado["text"]
+            elif metodo == "sendDocument":
+                if "document" in campos:
+                    self.reenviados += 1
+                    file_id = campos["document"]
+                else:
+                    self.documentos += 1
+                    file_id = f"stub-{mensaje_id}"
+                resultado["document"] = {"file_id": file_id, "file_unique_id": file_id}
+                contenido = f"[documento {file_id}]"
+            else:
+                return 400, {"ok": False, "error_code": 400, "description": f"Método no soportado: {metodo}"}
+            self.por_chat[chat_id].append(contenido)
+        if self.al_recibir is not None:
+            self.al_recibir(chat_id, contenido)
+        return 200, {"ok": True, "result": resultado}
+
+    def iniciar(self):
+        threading.Thread(target=self.servidor.serve_forever, name="stub-telegram", daemon=True).start()
+        return self.url
+
+    def detener(self):
+        self.servidor.shutdown()
+        self.servidor.server_close()
+
+    def resumen(self):
+        with self._lock:
+            return {"mensajes": self.mensajes, "documentos": self.documentos,
+                    "reenviados": self.reenviados, "limitados_429": self.limitados}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bot API de Telegram falsa para pruebas")
+    parser.add_argument("--puerto", type=int, default=8081)
+    parser.add_argument("--latencia-ms", type=float, default=0.0)
+    parser.add_argument("--limite-por-segundo", type=float, default=None)
+    args = parser.parse_args()
+    stub = StubTelegram(args.puerto, args.latencia_ms, args.limite_por_segundo)
+    print(f"Bot API falsa en {stub.url}")
+    try:
+        stub.servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -1,7 +1,10 @@
+import os
 from flask import Flask, request
 from twilio.twiml.messaging_response import MessagingResponse
 from twilio.rest import Client
 from dotenv import load_dotenv
+from sesiones import crear_almacen
+from pasos import MaquinaPasos
 load_dotenv()  # Cargar variables desde .env
 app = Flask(__name__)
 
@@ -13,16 +16,72 @@ auth_token = os.environ.get('TWILIO_AUTH_TOKEN')
 client = Client(account_sid, auth_token)
 
 
-# Estado de la conversación (simulado en memoria)
-user_data = {}
+# Estado de la conversación (almacén compartido entre procesos, ver sesiones.py)
+sesiones = crear_almacen()
+
+# Pasos de la conversación (mismo motor que el bot de Telegram, ver pasos.py)
+conversacion_whatsapp = MaquinaPasos("whatsapp")
+
+@conversacion_whatsapp.paso("menu")
+def paso_menu(sesion, incoming_message, user_number):
+    if "1" in incoming_message:
+        sesion.clear()
+        sesion.update({"step": "impresion", "service": "impresión"})
+        return (
+            "Has seleccionado el servicio de impresión. "
+            "Por favor, ingresa el ancho y alto en centímetros (ejemplo: 20x30)."
+        )
+    elif "2" in incoming_message:
+        sesion.clear()
+        sesion.update({"step": "diseno", "service": "diseño"})
+        return (
+            "Has seleccionado el servicio de diseño. "
+            "Por favor, describe tu proyecto."
+        )
+    elif "3" in incoming_message:
+        sesion.clear()
+        sesion.update({"step": "envios", "service": "envíos"})
+        return (
+            "Has seleccionado el servicio de envíos. "
+            "Por favor, ingresa la dirección de entrega."
+        )
+    return "Opción no válida. Por favor, elige 1, 2 o 3."
+
+@conversacion_whatsapp.paso("impresion", atras="menu")
+def paso_impresion(sesion, incoming_message, user_number):
+    # Procesar datos de impresión
+    try:
+        ancho, alto = incoming_message.split("x")
+    except ValueError:
+        return "Formato incorrecto. Por favor, ingresa el ancho y alto en formato '20x30'."
+    sesion["ancho"] = ancho
+    sesion["alto"] = alto
+    sesion["step"] = "confirmacion_impresion"
+    return (
+        f"Has ingresado un tamaño de {ancho}x{alto} cm para el servicio de impresión. "
+        "¿Confirmas? (responde 'sí' o 'no')."
+    )
+
+@conversacion_whatsapp.paso("confirmacion_impresion", atras="impresion")
+def paso_confirmacion_impresion(sesion, incoming_message, user_number):
+    if "sí" in incoming_message:
+        response_message = (
+            "¡Gracias! Hemos registrado tu pedido de impresión. "
+            f"Tamaño: {sesion['ancho']}x{sesion['alto']} cm."
+        )
+    else:
+        response_message = "Pedido cancelado. ¿En qué más puedo ayudarte?"
+    sesion.clear()  # Limpiar estado
+    return response_message
+
+# Agregar más pasos para otros servicios (diseño, envíos, etc.)
 
 @app.route("/webhook", methods=["POST"])
 def webhook():
-    global user_data
-
     # Obtener el mensaje entrante y el número del usuario
     incoming_message = request.form.get("Body", "").lower()
     user_number = request.form.get("From", "")
+    sesion = sesiones.obtener(user_number)
 
     # Inicializar la respuesta
     response_message = ""
@@ -38,65 +97,33 @@ def webhook():
             "2. Servicio de diseño\n"
             "3. Servicio de envíos"
         )
-        user_data[user_number] = {"step": "menu"}  # Guardar estado
+        sesion = {"step": "menu"}  # Guardar estado
 
-    elif user_number in user_data:
+    elif sesion is not None and incoming_message.strip() == "r":
+        # Opción de "paso atrás" (mismos destinos que el bot de Telegram, ver pasos.py)
+        prev = conversacion_whatsapp.anterior(sesion.get("step", ""))
+        if prev:
+            sesion["step"] = prev
+            response_message = f"Retrocediendo. Por favor ingresa nuevamente la información para '{prev}':"
+        else:
+            response_message = "No puedes retroceder en este paso."
+
+    elif sesion is not None:
         # Manejar respuestas según el estado del usuario
-        if user_data[user_number]["step"] == "menu":
-            if "1" in incoming_message:
-                response_message = (
-                    "Has seleccionado el servicio de impresión. "
-                    "Por favor, ingresa el ancho y alto en centímetros (ejemplo: 20x30)."
-                )
-                user_data[user_number] = {"step": "impresion", "service": "impresión"}
-            elif "2" in incoming_message:
-                response_message = (
-                    "Has seleccionado el servicio de diseño. "
-                    "Por favor, describe tu proyecto."
-                )
-                user_data[user_number] = {"step": "diseno", "service": "diseño"}
-            elif "3" in incoming_message:
-                response_message = (
-                    "Has seleccionado el servicio de envíos. "
-                    "Por favor, ingresa la dirección de entrega."
-                )
-                user_data[user_number] = {"step": "envios", "service": "envíos"}
-            else:
-                response_message = "Opción no válida. Por favor, elige 1, 2 o 3."
-
-        elif user_data[user_number]["step"] == "impresion":
-            # Procesar datos de impresión
-            try:
-                ancho, alto = incoming_message.split("x")
-                response_message = (
-                    f"Has ingresado un tamaño de {ancho}x{alto} cm para el servicio de impresión. "
-                    "¿Confirmas? (responde 'sí' o 'no')."
-                )
-                user_data[user_number]["ancho"] = ancho
-                user_data[user_number]["alto"] = alto
-                user_data[user_number]["step"] = "confirmacion_impresion"
-            except:
-                response_message = "Formato incorrecto. Por favor, ingresa el ancho y alto en formato '20x30'."
-
-        elif user_data[user_number]["step"] == "confirmacion_impresion":
-            if "sí" in incoming_message:
-                response_message = (
-                    "¡Gracias! Hemos registrado tu pedido de impresión. "
-                    f"Tamaño: {user_data[user_number]['ancho']}x{user_data[user_number]['alto']} cm."
-                )
-                del user_data[user_number]  # Limpiar estado
-            else:
-                response_message = "Pedido cancelado. ¿En qué más puedo ayudarte?"
-                del user_data[user_number]  # Limpiar estado
-
-        # Agregar más lógica para otros servicios (diseño, envíos, etc.)
+        response_message = conversacion_whatsapp.despachar(sesion, incoming_message, user_number) or ""
 
     else:
         response_message = "Por favor, escribe 'hola' para comenzar."
 
+    # Guardar (o limpiar) el estado del usuario
+    if sesion:
+        sesiones.guardar(user_number, sesion)
+    else:
+        sesiones.borrar(user_number)
+
     # Enviar respuesta
     twiml.message(response_message)
     return str(twiml)
 
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=True)
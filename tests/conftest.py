@@ -0,0 +1,47 @@
+import os
+import sys
+import sqlite3
+import threading
+
+import pytest
+
+# Los módulos viven en la raíz del repositorio (junto a app.py), sin paquete
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+
+# Tablas del catálogo tal como existen en seri.db (las propias las crea db.asegurar_esquema)
+CATALOGO = """
+CREATE TABLE products (id INTEGER PRIMARY KEY, name TEXT, price REAL);
+CREATE TABLE dimensions_volante (id INTEGER PRIMARY KEY, dimension TEXT, price REAL);
+CREATE TABLE material (id INTEGER PRIMARY KEY, name TEXT, price REAL, medida TEXT);
+CREATE TABLE additional_charges (id INTEGER PRIMARY KEY, name TEXT, description TEXT);
+"""
+
+
+@pytest.fixture
+def base(tmp_path, monkeypatch):
+    """
+    seri.db vacía en un directorio temporal; db.py abre conexiones nuevas contra ella.
+    """
+    ruta = str(tmp_path / "seri.db")
+    conn = sqlite3.connect(ruta)
+    conn.executescript(CATALOGO)
+    conn.close()
+    monkeypatch.setattr(db, "DB_PATH", ruta)
+    monkeypatch.setattr(db, "_local", threading.local())
+    monkeypatch.setattr(db, "_esquema_listo", False)
+    monkeypatch.setattr(db, "_version_conn", None)
+    monkeypatch.setattr(db, "_revision", None)
+    return ruta
+
+
+@pytest.fixture
+def catalogo():
+    """
+    Catálogo con la forma que arma app.obtener_catalogo (solo lo que usa la matriz).
+    """
+    return {
+        "dimensiones": {"carta 8.5x11": 0, "4x6": 0, "2x3.5": 0, "sin medida": 0},
+        "material": {"Bond 80": (450, "26x40"), "Couche 100": (900, "26x40"), "Husky": (1200, "18x24")},
+    }
@@ -0,0 +1,74 @@
+import threading
+
+import pytest
+
+from admision import ADMITIDO, LIMITADO, OCUPADO, Admision, Ocupado
+
+
+def crear(**opciones):
+    valores = dict(por_chat=0.001, rafaga=2, cotizaciones_por_minuto=0.001, rafaga_cotizaciones=1,
+                   altas_por_hora=0.001, rafaga_altas=1, umbral_ingesta=10, umbral_envios=10,
+                   aviso_segundos=1000, renders_max=1, renders_espera=0.01)
+    valores.update(opciones)
+    return Admision(**valores)
+
+
+def test_cuota_de_mensajes_por_chat():
+    admision = crear()
+    assert admision.admitir(1, 0, 0) == ADMITIDO
+    assert admision.admitir(1, 0, 0) == ADMITIDO
+    assert admision.admitir(1, 0, 0) == LIMITADO
+    assert admision.admitir(2, 0, 0) == ADMITIDO
+
+
+def test_ocupado_no_gasta_tokens():
+    admision = crear(rafaga=1)
+    assert admision.admitir(1, 10, 0) == OCUPADO
+    assert admision.admitir(1, 0, 10) == OCUPADO
+    assert admision.admitir(1, 0, 0) == ADMITIDO
+    assert admision.admitir(1, 0, 0) == LIMITADO
+
+
+def test_cotizacion_devuelta():
+    admision = crear()
+    assert admision.cotizacion(1)
+    assert not admision.cotizacion(1)
+    admision.devolver_cotizacion(1)
+    assert admision.cotizacion(1)
+    assert not admision.cotizacion(1)
+
+
+def test_altas():
+    admision = crear()
+    assert admision.alta(1)
+    assert not admision.alta(1)
+    assert admision.alta(2)
+
+
+def test_avisos():
+    admision = crear()
+    assert admision.avisar(1)
+    assert not admision.avisar(1)
+    assert crear(aviso_segundos=0).avisar(1)
+
+
+def test_renders_simultaneos():
+    admision = crear()
+    dentro = threading.Event()
+    salir = threading.Event()
+
+    def renderizar():
+        with admision.render():
+            dentro.set()
+            salir.wait()
+
+    hilo = threading.Thread(target=renderizar)
+    hilo.start()
+    dentro.wait()
+    with pytest.raises(Ocupado):
+        with admision.render():
+            pass
+    salir.set()
+    hilo.join()
+    with admision.render():
+        pass
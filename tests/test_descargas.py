@@ -0,0 +1,59 @@
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+import descargas
+
+
+@pytest.fixture(autouse=True)
+def secreto(monkeypatch):
+    monkeypatch.setattr(descargas, "DESCARGAS_SECRETO", "secreto")
+    monkeypatch.setattr(descargas, "URL_PUBLICA", "https://seri.example")
+
+
+def partes(url):
+    partes = urlsplit(url)
+    consulta = parse_qs(partes.query)
+    return partes.path, consulta["exp"][0], consulta["firma"][0]
+
+
+def test_url_valida():
+    ruta, expira, firma = partes(descargas.url_descarga(42))
+    assert ruta == "/cotizaciones/42.pdf"
+    assert descargas.verificar(42, expira, firma)
+
+
+def test_vencimiento_al_final_del_dia():
+    _, expira, _ = partes(descargas.url_descarga(42, vigencia=60))
+    assert int(expira) % descargas.REDONDEO == 0
+    assert partes(descargas.url_descarga(42, vigencia=61)) == partes(descargas.url_descarga(42, vigencia=60))
+
+
+def test_enlace_vencido(monkeypatch):
+    _, expira, firma = partes(descargas.url_descarga(42))
+    assert descargas.verificar(42, expira, firma)
+    monkeypatch.setattr(descargas.time, "time", lambda: int(expira) + 1)
+    assert not descargas.verificar(42, expira, firma)
+
+
+def test_enlace_alterado():
+    _, expira, firma = partes(descargas.url_descarga(42))
+    assert not descargas.verificar(43, expira, firma)
+    assert not descargas.verificar(42, str(int(expira) + descargas.REDONDEO), firma)
+    assert not descargas.verificar(42, expira, firma[:-1] + ("0" if firma[-1] != "0" else "1"))
+    assert not descargas.verificar(42, expira, "")
+    assert not descargas.verificar(42, "-1", firma)
+    assert not descargas.verificar(42, None, firma)
+
+
+def test_otro_secreto(monkeypatch):
+    _, expira, firma = partes(descargas.url_descarga(42))
+    monkeypatch.setattr(descargas, "DESCARGAS_SECRETO", "otro")
+    assert not descargas.verificar(42, expira, firma)
+
+
+def test_sin_secreto(monkeypatch):
+    _, expira, firma = partes(descargas.url_descarga(42))
+    monkeypatch.setattr(descargas, "DESCARGAS_SECRETO", "")
+    assert descargas.url_descarga(42) is None
+    assert not descargas.verificar(42, expira, firma)
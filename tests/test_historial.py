@@ -0,0 +1,90 @@
+import time
+
+import pytest
+
+import db
+import historial
+from historial import FiltroInvalido, buscar, leer_filtros, normalizar_fecha
+
+COTIZACIONES = [
+    # fecha, chat_id, cliente, producto, descripcion
+    ("2026-09-01", "1", "Juan Pérez", "Volante", "Volantes carta para la feria"),
+    ("2026-09-15", "1", "Juana Gómez", "Afiche", "Afiches del concierto"),
+    ("2026-10-01", "2", "Imprenta Sur", "Volante", "Volantes media carta"),
+    ("2026-10-02", "2", "juan perez", "Tarjeta", "Tarjetas de presentación"),
+    ("2026-10-03", "3", "María López", "Volante", "Promoción de verano"),
+]
+
+
+@pytest.fixture
+def libro(base):
+    for fecha, chat_id, cliente, producto, descripcion in COTIZACIONES:
+        db.ejecutar("registrar_cotizacion", (
+            time.time(), fecha, chat_id, cliente, producto, "4x6", "Bond 80", 450, "26x40", 100,
+            "[]", 50, 0, 1, 40, 5, 10.0, descripcion, 1, None, None))
+    return base
+
+
+def clientes(resultado):
+    return [fila["cliente"] for fila in resultado["resultados"]]
+
+
+def test_de_la_mas_reciente_a_la_mas_antigua(libro):
+    assert clientes(buscar()) == [c[2] for c in reversed(COTIZACIONES)]
+
+
+def test_paginas(libro):
+    primera = buscar(por_pagina=2)
+    assert primera["pagina"] == 1 and primera["hay_mas"]
+    assert clientes(primera) == ["María López", "juan perez"]
+    assert clientes(buscar(pagina=2, por_pagina=2)) == ["Imprenta Sur", "Juana Gómez"]
+    ultima = buscar(pagina=3, por_pagina=2)
+    assert clientes(ultima) == ["Juan Pérez"] and not ultima["hay_mas"]
+    assert buscar(pagina=4, por_pagina=2)["resultados"] == []
+    assert buscar(pagina=0)["pagina"] == 1
+    assert len(buscar(por_pagina=1000)["resultados"]) == len(COTIZACIONES)
+
+
+def test_prefijo_de_cliente_sin_mayusculas(libro):
+    assert clientes(buscar(cliente="juan")) == ["juan perez", "Juana Gómez", "Juan Pérez"]
+    assert clientes(buscar(cliente="IMPRENTA")) == ["Imprenta Sur"]
+
+
+def test_texto_libre(libro):
+    assert clientes(buscar(texto="volantes")) == ["Imprenta Sur", "Juan Pérez"]
+    # Sin acentos y por prefijo
+    assert clientes(buscar(texto="promocion ver")) == ["María López"]
+    assert clientes(buscar(texto="perez")) == ["juan perez", "Juan Pérez"]
+    # Comillas y operadores de FTS5 se tratan como texto
+    assert clientes(buscar(texto='"afiches" (*')) == ["Juana Gómez"]
+    assert buscar(texto="afiches OR volantes")["resultados"] == []
+
+
+def test_fechas_producto_y_chat(libro):
+    assert clientes(buscar(desde="2026-10-01", hasta="02/10/2026")) == ["juan perez", "Imprenta Sur"]
+    assert clientes(buscar(producto="Volante", desde="15/09/2026")) == ["María López", "Imprenta Sur"]
+    assert clientes(buscar(chat_id=1)) == ["Juana Gómez", "Juan Pérez"]
+    assert clientes(buscar(texto="volantes", chat_id=2)) == ["Imprenta Sur"]
+
+
+def test_fecha_invalida(libro):
+    with pytest.raises(FiltroInvalido):
+        buscar(desde="31/02/2026")
+
+
+def test_normalizar_fecha():
+    assert normalizar_fecha("05/10/2026") == "2026-10-05"
+    assert normalizar_fecha(" 2026-10-05 ") == "2026-10-05"
+
+
+def test_leer_filtros():
+    filtros = leer_filtros("volante cliente:Juan_Perez desde:01/10/2026 pagina:2 otra:cosa")
+    assert filtros == {"cliente": "Juan Perez", "desde": "01/10/2026", "pagina": "2",
+                       "texto": "volante otra:cosa"}
+    with pytest.raises(FiltroInvalido):
+        leer_filtros("pagina:dos")
+
+
+def test_consulta_fts():
+    assert historial.consulta_fts('media "carta"') == '"media"* "carta"*'
+    assert historial.consulta_fts("***") == ""
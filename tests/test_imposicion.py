@@ -0,0 +1,56 @@
+import time
+
+import imposicion
+from imposicion import piezas_por_pliego
+
+
+def test_rejilla_simple():
+    assert piezas_por_pliego(10, 10, 20, 20) == 4
+    assert piezas_por_pliego(4, 5, 20, 40) == 40
+
+
+def test_acomodo_mixto_llega_al_area():
+    # 4x6 en 26x40: la mejor rejilla da 40 y el acomodo mixto llega a 43 = 1040 // 24
+    assert piezas_por_pliego(4, 6, 26, 40) == 43
+
+
+def test_acomodo_mixto():
+    # 2x3 en 5x6: una rejilla da 4, girando una parte caben 5
+    assert piezas_por_pliego(2, 3, 5, 6) == 5
+
+
+def test_medidas_invalidas():
+    assert piezas_por_pliego(0, 10, 20, 20) == 0
+    assert piezas_por_pliego(10, 10, 20, -1) == 0
+    assert piezas_por_pliego(30, 30, 20, 20) == 0
+
+
+def test_sangrado_calle_y_pinza():
+    assert piezas_por_pliego(10, 10, 20, 20, sangrado=0.5) == 1
+    # Dos piezas con calle ocupan 10 + 1 + 10
+    assert piezas_por_pliego(10, 10, 20, 20, calle=1) == 1
+    assert piezas_por_pliego(10, 10, 21, 20, calle=1) == 2
+    assert piezas_por_pliego(10, 10, 20, 21, pinza=1) == 4
+    assert piezas_por_pliego(10, 10, 20, 20, pinza=1) == 2
+
+
+def test_no_pasa_del_area():
+    for medidas in [(3, 7, 26, 40), (2.5, 3.5, 18, 24), (8.5, 11, 26, 40)]:
+        ancho, alto, pliego_ancho, pliego_alto = medidas
+        piezas = piezas_por_pliego(*medidas)
+        assert 0 < piezas <= (pliego_ancho * pliego_alto) // (ancho * alto)
+
+
+def test_sin_presupuesto_usa_la_rejilla():
+    a, b, w, h = 200, 300, 2600, 4000
+    rejilla = imposicion._rejilla(a, b, w, h)
+    assert imposicion._guillotina(a, b, w, h, max_cortes=0) == rejilla
+    assert imposicion._guillotina(a, b, w, h, max_cortes=1) >= rejilla
+    assert imposicion._guillotina(a, b, w, h) >= rejilla
+
+
+def test_piezas_chicas_no_recorren_todos_los_cortes():
+    inicio = time.perf_counter()
+    assert piezas_por_pliego(0.5, 0.5, 200, 200) == 160000
+    assert piezas_por_pliego(0.53, 0.71, 199.9, 187.3) > 0
+    assert time.perf_counter() - inicio < 5
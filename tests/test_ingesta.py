@@ -0,0 +1,79 @@
+import threading
+import time
+
+from ingesta import ACEPTADO, DUPLICADO, LLENO, Ingesta
+
+
+def esperar_vacia(ingesta, limite=5):
+    fin = time.monotonic() + limite
+    while ingesta.pendientes() and time.monotonic() < fin:
+        time.sleep(0.005)
+    assert ingesta.pendientes() == 0
+
+
+def test_orden_por_chat():
+    procesados = {}
+    lock = threading.Lock()
+
+    def procesar(update):
+        chat_id, n = update
+        time.sleep(0.001)
+        with lock:
+            procesados.setdefault(chat_id, []).append(n)
+
+    ingesta = Ingesta(procesar, hilos=4)
+    update_id = 0
+    for n in range(20):
+        for chat_id in range(5):
+            update_id += 1
+            assert ingesta.recibir(update_id, chat_id, (chat_id, n)) == ACEPTADO
+    esperar_vacia(ingesta)
+    assert procesados == {chat_id: list(range(20)) for chat_id in range(5)}
+    assert ingesta.chats_activos() == 0
+
+
+def test_update_repetido():
+    recibidos = []
+    ingesta = Ingesta(recibidos.append, hilos=1)
+    assert not ingesta.visto(7)
+    assert ingesta.recibir(7, 1, "a") == ACEPTADO
+    assert ingesta.visto(7)
+    assert ingesta.recibir(7, 1, "a") == DUPLICADO
+    esperar_vacia(ingesta)
+    assert recibidos == ["a"]
+
+
+def test_ids_recientes_acotados():
+    ingesta = Ingesta(lambda update: None, hilos=1, ids_recientes=3)
+    for update_id in range(5):
+        ingesta.recibir(update_id, 1, update_id)
+    esperar_vacia(ingesta)
+    assert not ingesta.visto(0)
+    assert ingesta.visto(4)
+
+
+def test_lleno_no_queda_visto():
+    soltar = threading.Event()
+    ingesta = Ingesta(lambda update: soltar.wait(), hilos=1, max_pendientes=2)
+    assert ingesta.recibir(1, 1, "a") == ACEPTADO
+    assert ingesta.recibir(2, 2, "b") == ACEPTADO
+    assert ingesta.recibir(3, 3, "c") == LLENO
+    assert not ingesta.visto(3)
+    soltar.set()
+    esperar_vacia(ingesta)
+    assert ingesta.recibir(3, 3, "c") == ACEPTADO
+
+
+def test_error_no_detiene_el_chat():
+    procesados = []
+
+    def procesar(update):
+        if update == "falla":
+            raise ValueError(update)
+        procesados.append(update)
+
+    ingesta = Ingesta(procesar, hilos=1)
+    for update_id, update in enumerate(["a", "falla", "b"]):
+        ingesta.recibir(update_id, 1, update)
+    esperar_vacia(ingesta)
+    assert procesados == ["a", "b"]
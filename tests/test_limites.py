@@ -0,0 +1,43 @@
+from limites import CuboTokens, CubosPorClave
+
+
+def test_cubo_gasta_y_devuelve():
+    cubo = CuboTokens(tasa=0.001, capacidad=2)
+    assert cubo.lleno()
+    assert cubo.intentar() == 0
+    assert cubo.intentar() == 0
+    falta = cubo.intentar()
+    assert 0 < falta <= 1 / 0.001
+    cubo.devolver()
+    assert cubo.intentar() == 0
+
+
+def test_devolver_no_pasa_de_la_capacidad():
+    cubo = CuboTokens(tasa=0.001, capacidad=1)
+    cubo.devolver(5)
+    assert cubo.intentar() == 0
+    assert cubo.intentar() > 0
+
+
+def test_cubo_se_rellena():
+    cubo = CuboTokens(tasa=1000, capacidad=1)
+    assert cubo.intentar() == 0
+    cubo.esperar()
+    assert not cubo.lleno()
+
+
+def test_cubos_independientes_por_clave():
+    cubos = CubosPorClave(tasa=0.001, capacidad=1)
+    assert cubos.intentar("a") == 0
+    assert cubos.intentar("a") > 0
+    assert cubos.intentar("b") == 0
+
+
+def test_poda_solo_cubos_llenos():
+    cubos = CubosPorClave(tasa=0.001, capacidad=1, max_claves=10)
+    cubos.intentar("gastado")
+    for i in range(20):
+        cubos.cubo(i)
+    assert len(cubos._cubos) <= 10
+    # La cubeta gastada no se descarta: una nueva le devolvería el token
+    assert cubos.intentar("gastado") > 0
@@ -0,0 +1,62 @@
+import math
+
+import pytest
+
+import db
+import matriz_precios
+from precios import cotizar
+
+
+@pytest.fixture
+def matriz(base, monkeypatch):
+    monkeypatch.setattr(matriz_precios, "_firma", None)
+    return base
+
+
+def filas_matriz():
+    return db.consultar("matriz_combinaciones")
+
+
+def test_igual_a_cotizar(matriz, catalogo):
+    assert matriz_precios.sincronizar(catalogo) == 3 * 3
+    variantes = [((), 50, 0.0), ((25.0, 7.5), 30, 4.0), ((), 0, 0.0), ((100.0,), 120, 12.0)]
+    for dimension in ("carta 8.5x11", "4x6", "2x3.5"):
+        for material, (precio, medida) in catalogo["material"].items():
+            for cantidad in matriz_precios.CANTIDADES:
+                fila = matriz_precios.buscar(dimension, material, cantidad, precio, medida)
+                assert fila is not None
+                for adicionales, margen, tiro_retiro in variantes:
+                    esperado = cotizar(dimension, precio, medida, cantidad, adicionales, margen, tiro_retiro)
+                    obtenido = matriz_precios.precio(fila, adicionales, margen, tiro_retiro)
+                    assert obtenido.keys() == esperado.keys()
+                    for clave, valor in esperado.items():
+                        assert math.isclose(obtenido[clave], valor, rel_tol=1e-12), clave
+
+
+def test_fuera_de_la_matriz(matriz, catalogo):
+    matriz_precios.sincronizar(catalogo)
+    # Tamaños ilegibles y cantidades no estándar se cotizan con cotizar()
+    assert matriz_precios.buscar("sin medida", "Bond 80", 100, 450, "26x40") is None
+    assert matriz_precios.buscar("4x6", "Bond 80", 123, 450, "26x40") is None
+    # Fila calculada con otro precio o medida del material
+    assert matriz_precios.buscar("4x6", "Bond 80", 100, 500, "26x40") is None
+    assert matriz_precios.buscar("4x6", "Bond 80", 100, 450, "18x24") is None
+
+
+def test_sincroniza_solo_lo_que_cambio(matriz, catalogo):
+    matriz_precios.sincronizar(catalogo)
+    assert matriz_precios.sincronizar(catalogo) == 0
+    catalogo["material"]["Bond 80"] = (500, "26x40")
+    del catalogo["dimensiones"]["2x3.5"]
+    assert matriz_precios.sincronizar(catalogo) == 2
+    combinaciones = {(dimension, material): precio for dimension, material, precio, _, _ in filas_matriz()}
+    assert len(combinaciones) == 2 * 3
+    assert combinaciones[("4x6", "Bond 80")] == 500
+    assert matriz_precios.buscar("4x6", "Bond 80", 100, 500, "26x40") is not None
+
+
+def test_otro_proceso_ya_sincronizo(matriz, catalogo, monkeypatch):
+    matriz_precios.sincronizar(catalogo)
+    # Un proceso nuevo (sin firma en memoria) compara contra la tabla y no recalcula
+    monkeypatch.setattr(matriz_precios, "_firma", None)
+    assert matriz_precios.sincronizar(catalogo) == 0
@@ -0,0 +1,57 @@
+import math
+
+import pytest
+
+import precios
+from precios import cotizar, cotizar_lote, dimension_aceptable, medidas_material, parse_dimension
+
+
+def test_parse_dimension():
+    assert parse_dimension("20x30") == (20, 30)
+    assert parse_dimension(" 8.5 X 11 ") == (8.5, 11)
+    assert parse_dimension("carta 8.5x11") == (8.5, 11)
+    assert parse_dimension("0x10") == (0, 0)
+    assert parse_dimension("grande") == (0, 0)
+
+
+def test_medidas_material():
+    assert medidas_material("26x40") == (26, 40)
+    assert medidas_material("0x40") == (0, 0)
+    assert medidas_material("axb") == (0, 0)
+
+
+def test_dimension_aceptable():
+    assert dimension_aceptable(precios.DIMENSION_MINIMA, precios.DIMENSION_MAXIMA)
+    assert not dimension_aceptable(precios.DIMENSION_MINIMA / 2, 10)
+    assert not dimension_aceptable(10, precios.DIMENSION_MAXIMA + 1)
+
+
+def test_cotizar():
+    # 4x5 en 20x40: 40 piezas por pliego, 1000 volantes = 25 pliegos + 2 de arranque
+    p = cotizar("4x5", 450, "20x40", 1000, adicionales=(10, 5), margin=20, costo_tr=3)
+    assert p["flyers_per_sheet"] == 40
+    assert p["required_sheets"] == 27
+    assert p["paper_cost"] == pytest.approx(27 * 450 / 500)
+    assert p["additional_costs"] == 18
+    assert p["final_cost"] == pytest.approx(((27 * 0.9 + 18) * 1.2 + 3) * precios.FACTOR_IVA)
+
+
+def test_cotizar_medida_ilegible_usa_una_pieza_por_pliego():
+    p = cotizar("tamaño raro", 450, "26x40", 10)
+    assert p["flyers_per_sheet"] == 1
+    assert p["required_sheets"] == 10 + precios.HOJAS_EXTRA
+
+
+def test_cotizar_lote_igual_a_cotizar():
+    variantes = [
+        ("4x6", 450, "26x40", 1000, 0, 50, 0),
+        ("carta 8.5x11", 900, "26x40", 250, 12.5, 30, 4),
+        ("2x3.5", 1200, "18x24", 5000, 0, 0, 0),
+        ("4x6", 450, "26x40", 1, 3, 100, 1),
+        ("tamaño raro", 450, "26x40", 7, 0, 50, 0),
+    ]
+    dims, precios_mat, medidas, cantidades, extras, margenes, trs = zip(*variantes)
+    lote = cotizar_lote(dims, precios_mat, medidas, cantidades, extras, margenes, trs)
+    for (dim, precio, medida, cantidad, extra, margen, tr), total in zip(variantes, lote):
+        esperado = cotizar(dim, precio, medida, cantidad, (extra,), margen, tr)["final_cost"]
+        assert math.isclose(total, esperado, rel_tol=1e-12)
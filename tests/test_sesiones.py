@@ -0,0 +1,78 @@
+import pytest
+
+import sesiones
+from sesiones import SesionesMemoria, SesionesSQLite
+
+
+def test_memoria_ttl():
+    almacen = SesionesMemoria(ttl=-1)
+    almacen.guardar(1, {"step": "menu"})
+    assert almacen.obtener(1) is None
+    assert almacen.activas() == 0
+
+
+def test_memoria_lru():
+    almacen = SesionesMemoria(ttl=60, max_entradas=2)
+    almacen.guardar(1, {"step": "a"})
+    almacen.guardar(2, {"step": "b"})
+    assert almacen.obtener(1) == {"step": "a"}
+    almacen.guardar(3, {"step": "c"})
+    assert almacen.obtener(2) is None
+    assert almacen.obtener(1) == {"step": "a"}
+    assert almacen.obtener(3) == {"step": "c"}
+
+
+def test_memoria_devuelve_copias():
+    almacen = SesionesMemoria(ttl=60)
+    datos = {"step": "menu", "product": ("Volante", 0)}
+    almacen.guardar(1, datos)
+    leida = almacen.obtener(1)
+    leida["step"] = "otro"
+    assert almacen.obtener(1) == {"step": "menu", "product": ["Volante", 0]}
+
+
+def test_sqlite_ttl_y_purga(tmp_path):
+    almacen = SesionesSQLite(str(tmp_path / "s.db"), ttl=-1)
+    almacen.guardar(1, {"step": "menu"})
+    assert almacen.obtener(1) is None
+    assert almacen.activas() == 0
+    almacen.purgar()
+    assert almacen._conexion().execute("SELECT COUNT(*) FROM sesiones").fetchone()[0] == 0
+
+
+def test_sqlite_cache_lru(tmp_path):
+    almacen = SesionesSQLite(str(tmp_path / "s.db"), ttl=60, max_cache=2)
+    for chat_id in range(5):
+        almacen.guardar(chat_id, {"step": str(chat_id)})
+    assert list(almacen._cache) == ["3", "4"]
+    # Lo que salió de la caché se sigue leyendo de la base
+    assert almacen.obtener(0) == {"step": "0"}
+    assert list(almacen._cache) == ["4", "0"]
+
+
+def test_sqlite_compartida_entre_procesos(tmp_path):
+    ruta = str(tmp_path / "s.db")
+    uno, otro = SesionesSQLite(ruta, ttl=60), SesionesSQLite(ruta, ttl=60)
+    uno.guardar(1, {"step": "menu"})
+    assert otro.obtener(1) == {"step": "menu"}
+    # La caché de `otro` tiene la versión 1; la escritura de `uno` la invalida
+    uno.guardar(1, {"step": "productos"})
+    assert otro.obtener(1) == {"step": "productos"}
+    otro.borrar(1)
+    assert uno.obtener(1) is None
+
+
+def test_purga_cada_n_escrituras(tmp_path, monkeypatch):
+    almacen = SesionesSQLite(str(tmp_path / "s.db"), ttl=60)
+    monkeypatch.setattr(almacen, "PURGAR_CADA", 3)
+    purgas = []
+    monkeypatch.setattr(almacen, "purgar", lambda: purgas.append(1))
+    for chat_id in range(7):
+        almacen.guardar(chat_id, {})
+    assert len(purgas) == 2
+
+
+def test_crear_almacen():
+    assert isinstance(sesiones.crear_almacen("memoria"), SesionesMemoria)
+    with pytest.raises(ValueError):
+        sesiones.crear_almacen("redis")